@@ -0,0 +1,125 @@
+"""Measure plugin import throughput with synthetic FIT data and an in-memory SQLite activities database."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import event
+
+from idbutils import DbParams
+from garmindb import PluginManager
+from garmindb.garmindb import ActivitiesDb, Activities
+
+from synthetic_fit import profiles, SyntheticActivity
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class MemoryActivitiesDb(ActivitiesDb):
+    """The activities database in SQLite memory."""
+
+    @classmethod
+    def _sqlite_url(cls, db_params):
+        return 'sqlite://'
+
+
+class QueryCounter():
+    """Counts the statements executed on an engine."""
+
+    def __init__(self, engine):
+        """Start counting statements executed on engine."""
+        self.queries = 0
+        self.rows = 0
+        event.listen(engine, 'before_cursor_execute', self.__count)
+
+    def __count(self, conn, cursor, statement, parameters, context, executemany):
+        self.queries += 1
+        self.rows += len(parameters) if executemany else 1
+
+
+def load_plugins(plugin_dir):
+    """Return the activity plugins that have a synthetic data profile."""
+    db_params = DbParams(db_type='sqlite', db_path=tempfile.gettempdir())
+    plugins = PluginManager(plugin_dir, db_params).plugins.get('ActivityFit', {})
+    return db_params, {name: plugin for name, plugin in plugins.items() if name in profiles}
+
+
+def import_activity(plugin, db_session, activity):
+    """Send an activity's messages through the plugin the way the GarminDb activity importer does."""
+    fit_file = activity.fit_file
+    for record_num, message_fields in enumerate(activity.record_messages()):
+        plugin.write_record_entry(db_session, fit_file, activity.activity_id, message_fields, record_num)
+    session_fields = activity.session_message()
+    write_session_entry = getattr(plugin, 'write_session_entry', None)
+    if write_session_entry:
+        write_session_entry(db_session, fit_file, activity.activity_id, session_fields)
+    sport_handler = activity.profile['sport_handler']
+    if sport_handler:
+        getattr(plugin, sport_handler)(db_session, fit_file, activity.activity_id, None, session_fields)
+
+
+def run_plugin(name, plugin, db_params, activities, records, rescan, trace_memory=True):
+    """Import synthetic activities through one plugin and return the measurements."""
+    plugin.init_activity(ActivitiesDb, Activities)
+    act_db = MemoryActivitiesDb(db_params)
+    counter = QueryCounter(act_db.engine)
+    synthetic = [SyntheticActivity(name, plugin._application_id, activity_id, records, seed=activity_id) for activity_id in range(activities)]
+    results = {}
+    for phase in ['import', 'rescan'] if rescan else ['import']:
+        counter.queries = counter.rows = 0
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        for activity in synthetic:
+            with act_db.managed_session() as db_session:
+                import_activity(plugin, db_session, activity)
+        elapsed = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+        total = activities * records
+        results[phase] = {'records': total, 'seconds': elapsed, 'records_per_sec': total / elapsed, 'queries': counter.queries, 'rows': counter.rows,
+                          'peak_kb': peak}
+    act_db.engine.dispose()
+    return results
+
+
+def print_report(results, file=sys.stdout):
+    """Print a table of the per plugin measurements."""
+    print(f"{'plugin':<18}{'phase':<8}{'records':>10}{'seconds':>10}{'records/s':>12}{'queries':>10}{'rows':>10}{'peak KiB':>10}", file=file)
+    for name, phases in results.items():
+        for phase, result in phases.items():
+            peak_kb = '-' if result['peak_kb'] is None else f"{result['peak_kb']:.0f}"
+            print(f"{name:<18}{phase:<8}{result['records']:>10}{result['seconds']:>10.3f}{result['records_per_sec']:>12.0f}{result['queries']:>10}"
+                  f"{result['rows']:>10}{peak_kb:>10}", file=file)
+
+
+def main(argv):
+    """Run the import benchmark."""
+    parser = argparse.ArgumentParser(description='Measure plugin import throughput with synthetic FIT data.')
+    parser.add_argument('-p', '--plugins', nargs='+', choices=sorted(profiles), default=sorted(profiles), help='the plugins to benchmark')
+    parser.add_argument('-a', '--activities', type=int, default=5, help='the number of activities to import per plugin')
+    parser.add_argument('-r', '--records', type=int, default=3600, help='the number of records per activity')
+    parser.add_argument('--rescan', action='store_true', help='import the same activities a second time to measure re-scans')
+    parser.add_argument('--no-memory', action='store_true', help="don't trace memory, tracing slows the import down")
+    parser.add_argument('--plugin-dir', default=repo_dir, help='the directory to load the plugins from')
+    args = parser.parse_args(argv)
+
+    db_params, plugins = load_plugins(args.plugin_dir)
+    results = {}
+    for name in args.plugins:
+        results[name] = run_plugin(name, plugins[name], db_params, args.activities, args.records, args.rescan, not args.no_memory)
+    print_report(results)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
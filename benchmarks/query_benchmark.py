@@ -0,0 +1,208 @@
+"""Time the plugin activity views, records time range scans, and per activity series loads on a large synthetic activities database."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import json
+import random
+import sqlite3
+import argparse
+import datetime
+import platform
+import statistics
+import time
+
+from sqlalchemy import text, select, bindparam, DateTime
+
+from idbutils import DbParams
+from garmindb.garmindb import ActivitiesDb, Activities
+
+from synthetic_fit import profiles, SyntheticActivity
+from import_benchmark import repo_dir, load_plugins, import_activity
+
+sys.path.insert(0, repo_dir)
+try:
+    from plugin_utils.record_cache import RecordCache
+    from plugin_utils.record_query import RecordQuery
+except ImportError:
+    # NumPy is needed for the array reads, without it only the SQL queries are timed.
+    RecordQuery = None
+
+
+# Every plugin's activities start on the same days, each plugin's activity ids are offset by this.
+activity_id_offset = 10000000
+
+
+def activity_ids(plugin_index, days):
+    """Return the ids of a plugin's synthetic activities, one per day."""
+    return [str((plugin_index + 1) * activity_id_offset + day) for day in range(days)]
+
+
+def plugin_activities(act_db, plugin):
+    """Return the number of activities the plugin has in the database."""
+    table = plugin._tables.get('session', plugin._tables.get('record_columns', plugin._tables['record']))
+    with act_db.managed_session() as db_session:
+        return db_session.query(table.activity_id).distinct().count()
+
+
+def build_plugin(name, plugin, plugin_index, act_db, first_day, days, records):
+    """Import a synthetic activity per day through the plugin, with its activities table row, unless the database has them."""
+    existing = plugin_activities(act_db, plugin)
+    if existing == days:
+        print(f'{name}: using the {days} activities in the database', file=sys.stderr)
+        return 0.0
+    if existing:
+        raise RuntimeError(f'{name} has {existing} activities in the database, not {days}, use an empty or matching database')
+    start = time.perf_counter()
+    for day, activity_id in enumerate(activity_ids(plugin_index, days)):
+        activity = SyntheticActivity(name, plugin._application_id, activity_id, records, start=first_day + datetime.timedelta(days=day), seed=day)
+        start_time = activity.fit_file.utc_datetime_to_local(activity.start)
+        with act_db.managed_session() as db_session:
+            db_session.add(Activities(activity_id=activity_id, name=f'{name} {day}', sport='generic', start_time=start_time,
+                                      stop_time=start_time + datetime.timedelta(seconds=records)))
+            import_activity(plugin, db_session, activity)
+        if day % 365 == 364:
+            print(f'{name}: imported {day + 1} of {days} activities', file=sys.stderr)
+    return time.perf_counter() - start
+
+
+def plugin_views(act_db, plugin):
+    """Return the names of the database views over the plugin's sessions table."""
+    sessions_table = plugin._tables.get('session')
+    if sessions_table is None:
+        return []
+    with act_db.managed_session() as db_session:
+        views = db_session.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'view'")).fetchall()
+    return sorted(name for name, sql in views if sessions_table.__tablename__ in sql)
+
+
+def time_query(function, repeat):
+    """Run function once to warm the caches, then repeat times, and return the rows it returned and the median and min milliseconds."""
+    rows = function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'rows': rows, 'median_ms': statistics.median(times), 'min_ms': min(times)}
+
+
+def plugin_queries(act_db, plugin, plugin_index, first_day, days, samples):
+    """Return (query name, function) pairs of the queries timed for a plugin, each function returns the number of rows read."""
+    queries = []
+    last_day = first_day + datetime.timedelta(days=days)
+
+    def count(statement, **params):
+        def run():
+            with act_db.managed_session() as db_session:
+                return len(db_session.execute(statement, params).fetchall())
+        return run
+
+    for view in plugin_views(act_db, plugin):
+        queries.append((f'view {view}', count(text(f'SELECT * FROM {view}'))))
+        recent = text(f'SELECT * FROM {view} WHERE start_time >= :start').bindparams(bindparam('start', type_=DateTime))
+        queries.append((f'view {view} last year', count(recent, start=last_day - datetime.timedelta(days=365))))
+    sample = random.Random(plugin_index).sample(activity_ids(plugin_index, days), min(samples, days))
+    ranges = [('day', datetime.timedelta(days=1)), ('week', datetime.timedelta(days=7)), ('month', datetime.timedelta(days=30))]
+    range_end = last_day - datetime.timedelta(days=days // 2)
+    if 'record_columns' not in plugin._tables:
+        record_table = plugin._tables['record'].__table__
+        for range_name, length in ranges:
+            statement = select(record_table).where(record_table.c.timestamp >= range_end - length, record_table.c.timestamp < range_end)
+            queries.append((f'records {range_name} scan', count(statement)))
+
+        def series_rows():
+            statement = select(record_table).where(record_table.c.activity_id == bindparam('activity_id')).order_by(record_table.c.record)
+            with act_db.managed_session() as db_session:
+                return sum(len(db_session.execute(statement, {'activity_id': activity_id}).fetchall()) for activity_id in sample)
+        queries.append((f'records series x{len(sample)}', series_rows))
+    if RecordQuery is not None:
+        # No cache, every read goes to the database.
+        record_query = RecordQuery(plugin, RecordCache(max_bytes=0))
+        for range_name, length in ranges:
+            def range_arrays(length=length):
+                with act_db.managed_session() as db_session:
+                    return len(record_query.time_range(db_session, range_end - length, range_end)['timestamp'])
+            queries.append((f'arrays {range_name} range', range_arrays))
+
+        def series_arrays():
+            with act_db.managed_session() as db_session:
+                return sum(len(record_query.activity(db_session, activity_id, ['timestamp']).get('timestamp', ())) for activity_id in sample)
+        queries.append((f'arrays series x{len(sample)}', series_arrays))
+    return queries
+
+
+def table_rows(act_db):
+    """Return table name to number of rows of the database's tables."""
+    with act_db.managed_session() as db_session:
+        tables = [row[0] for row in db_session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"))]
+        return {table: db_session.execute(text(f'SELECT COUNT(*) FROM "{table}"')).scalar() for table in tables}
+
+
+def print_report(report, previous=None, file=sys.stdout):
+    """Print a table of the query timings, with the change from a previous report's timings of the same queries if given."""
+    parameters = report['parameters']
+    print(f"{parameters['years']} years, {parameters['records']} records per activity, database {report['database']['size_mb']:.0f} MB, "
+          f"SQLite {parameters['sqlite']}", file=file)
+    before = {(result['plugin'], result['query']): result for result in previous['results']} if previous else {}
+    print(f"{'plugin':<18}{'query':<48}{'rows':>10}{'median ms':>12}{'min ms':>10}{'change':>9}", file=file)
+    for result in report['results']:
+        earlier = before.get((result['plugin'], result['query']))
+        change = f"{(result['median_ms'] / earlier['median_ms'] - 1) * 100:+.0f}%" if earlier and earlier['median_ms'] else '-'
+        print(f"{result['plugin']:<18}{result['query']:<48}{result['rows']:>10}{result['median_ms']:>12.1f}{result['min_ms']:>10.1f}{change:>9}", file=file)
+
+
+def main(argv):
+    """Run the query benchmark."""
+    parser = argparse.ArgumentParser(description='Time plugin views and records reads on a large synthetic activities database.')
+    parser.add_argument('-p', '--plugins', nargs='+', choices=sorted(profiles), default=['fbb_dozen_cycle', 'fbb_dozen_run', 'fbb_elliptical', 'fbb_hrv', 'stryd_zones'],
+                        help='the plugins to benchmark')
+    parser.add_argument('-y', '--years', type=int, default=10, help='the years of daily activities per plugin')
+    parser.add_argument('-r', '--records', type=int, default=1800, help='the number of records, one a second, per activity')
+    parser.add_argument('-d', '--db-dir', required=True, help='the directory of the activities database, it is reused by later runs')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of timed runs of each query')
+    parser.add_argument('--samples', type=int, default=50, help='the number of activities loaded by the per activity series queries')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--compare', help='show the change from the report in this file')
+    parser.add_argument('--plugin-dir', default=repo_dir, help='the directory to load the plugins from')
+    args = parser.parse_args(argv)
+
+    db_params = DbParams(db_type='sqlite', db_path=args.db_dir)
+    _, plugins = load_plugins(args.plugin_dir)
+    days = args.years * 365
+    first_day = datetime.datetime(2010, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    report = {
+        'parameters': {'years': args.years, 'records': args.records, 'repeat': args.repeat, 'samples': args.samples, 'sqlite': sqlite3.sqlite_version,
+                       'python': platform.python_version(), 'date': datetime.datetime.now().isoformat(timespec='seconds')},
+        'build_seconds': {},
+        'results': []
+    }
+    for name in args.plugins:
+        plugins[name].init_activity(ActivitiesDb, Activities)
+    # The plugin tables are created with the database, so it's opened after the plugins are initialized.
+    act_db = ActivitiesDb(db_params)
+    # Every plugin's ids are offset by its place among all profiles, so a database stays usable when runs pick different plugins.
+    for name in args.plugins:
+        plugin = plugins[name]
+        report['build_seconds'][name] = build_plugin(name, plugin, sorted(profiles).index(name), act_db, first_day, days, args.records)
+    for name in args.plugins:
+        plugin = plugins[name]
+        for query, function in plugin_queries(act_db, plugin, sorted(profiles).index(name), first_day, days, args.samples):
+            report['results'].append(dict(time_query(function, args.repeat), plugin=name, query=query))
+            print(f'{name}: {query} done', file=sys.stderr)
+    report['database'] = {'size_mb': os.path.getsize(ActivitiesDb._sqlite_path(db_params)) / (1024 * 1024), 'tables': table_rows(act_db)}
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            previous = json.load(file)
+    print_report(report, previous)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,133 @@
+"""Synthetic FIT file data for exercising the plugins without real FIT files."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+import random
+
+from fitfile.data_message import MessageFields
+
+
+def _hrv_record(rng, index):
+    btb = int(rng.gauss(850, 60))
+    return {'dev_hrv_s': index % 60, 'dev_hrv_btb': btb, 'dev_hrv_hr': int(60000 / btb)}
+
+
+def _hrv_session(rng):
+    return {'dev_min_hr': rng.randint(45, 60), 'dev_hrv_rmssd': rng.randint(20, 80), 'dev_hrv_sdrr_f': rng.randint(20, 80),
+            'dev_hrv_sdrr_l': rng.randint(20, 80), 'dev_hrv_pnn50': rng.randint(0, 40), 'dev_hrv_pnn20': rng.randint(10, 70)}
+
+
+def _stryd_record(rng, index):
+    return {'dev_Power': rng.gauss(250, 30), 'dev_cadence': rng.randint(80, 95), 'dev_stance_time': rng.randint(200, 280),
+            'dev_avg_vertical_oscillation': rng.randint(6, 10), 'dev_Elevation': 100.0 + index * 0.01, 'dev_Form Power': rng.gauss(60, 5),
+            'dev_Leg Spring Stiffness': rng.gauss(10, 1)}
+
+
+def _dozen_run_record(rng, index):
+    return {'dev_eE': rng.gauss(800, 50), 'dev_rE': rng.gauss(1.0, 0.05), 'dev_tpRE': rng.gauss(1.1, 0.05)}
+
+
+def _dozen_run_session(rng):
+    return {'dev_aE': rng.gauss(1.0, 0.05), 'dev_tpaRE': rng.gauss(1.1, 0.05), 'dev_xRE': rng.gauss(1.0, 0.05), 'dev_tS': rng.randint(4000, 12000)}
+
+
+def _dozen_cycle_record(rng, index):
+    return {'dev_grade': rng.gauss(0, 3), 'dev_eFTP': rng.gauss(240, 10)}
+
+
+def _dozen_cycle_session(rng):
+    return {'dev_mxFTP': rng.gauss(260, 10)}
+
+
+def _elliptical_record(rng, index):
+    return {'dev_distance': index * 3, 'dev_speed': rng.randint(2, 4), 'dev_cadence': rng.randint(50, 70), 'dev_engExpend': rng.gauss(600, 40)}
+
+
+def _elliptical_session(rng):
+    return {'dev_total_distance': rng.randint(3000, 8000), 'dev_avg_cadence': rng.randint(50, 70), 'dev_tStps': rng.randint(2000, 6000),
+            'dev_%bat': rng.uniform(1, 5), 'dev_tcal': rng.randint(200, 600)}
+
+
+def _paddle_plus_record(rng, index):
+    return {'cadence': rng.randint(40, 70), 'dev_Strk': index // 2, 'dev_Srd': rng.gauss(2.5, 0.2)}
+
+
+def _paddle_plus_session(rng):
+    return {'dev_tStrk': rng.randint(1000, 4000), 'dev_aSrd': rng.gauss(2.5, 0.2), 'dev_Tdst': rng.uniform(2, 10), 'dev_Tcal': rng.randint(200, 600)}
+
+
+def _dozen_paddle_record(rng, index):
+    return {'cadence': rng.randint(40, 70), 'dev_sc': index // 2}
+
+
+def _dozen_paddle_session(rng):
+    return {'dev_sc': rng.randint(1000, 4000)}
+
+
+def _no_session(rng):
+    return {}
+
+
+# Per plugin: the message generators and the sport specific session handler the host calls after write_session_entry.
+profiles = {
+    'fbb_hrv'           : {'record': _hrv_record, 'session': _hrv_session, 'sport_handler': None},
+    'stryd_zones'       : {'record': _stryd_record, 'session': _no_session, 'sport_handler': None},
+    'fbb_dozen_run'     : {'record': _dozen_run_record, 'session': _dozen_run_session, 'sport_handler': 'write_steps_entry'},
+    'fbb_dozen_cycle'   : {'record': _dozen_cycle_record, 'session': _dozen_cycle_session, 'sport_handler': 'write_cycle_entry'},
+    'fbb_elliptical'    : {'record': _elliptical_record, 'session': _elliptical_session, 'sport_handler': None},
+    'fbb_paddle_plus'   : {'record': _paddle_plus_record, 'session': _paddle_plus_session, 'sport_handler': 'write_paddle_entry'},
+    'fbb_dozen_paddle'  : {'record': _dozen_paddle_record, 'session': _dozen_paddle_session, 'sport_handler': 'write_paddle_entry'},
+}
+
+
+class SyntheticFitFile():
+    """Stands in for a parsed fitfile.File with the attributes the plugins use."""
+
+    def __init__(self, activity_id, application_id, dev_fields, utc_offset=-5 * 3600):
+        """Return a SyntheticFitFile for an activity written by the IQ app application_id."""
+        self.filename = f'{activity_id}.fit'
+        self.dev_application_ids = [application_id]
+        self.dev_fields = {dev_field[4:]: {'native_message_num': None, 'units': None} for dev_field in dev_fields}
+        self.sport_type = None
+        self.sub_sport_type = None
+        self.utc_offset = utc_offset
+        self.local_tz = datetime.timezone(datetime.timedelta(seconds=utc_offset))
+
+    def utc_datetime_to_local(self, dt):
+        """Return a local datetime based on the passed in UTC datetime and the file's UTC offset."""
+        if self.local_tz is not None and dt.tzinfo is datetime.timezone.utc:
+            return dt.astimezone(self.local_tz).replace(tzinfo=None)
+        return dt.replace(tzinfo=None)
+
+
+class SyntheticActivity():
+    """A synthetic activity: a FIT file stand in plus record and session message streams for one plugin."""
+
+    def __init__(self, plugin_name, application_id, activity_id, records, start=None, seed=0):
+        """Return a SyntheticActivity with records one second apart."""
+        self.profile = profiles[plugin_name]
+        self.activity_id = str(activity_id)
+        self.records = records
+        self.start = start or datetime.datetime(2020, 1, 1, 12, tzinfo=datetime.timezone.utc)
+        self.seed = seed
+        rng = random.Random(seed)
+        dev_fields = set(self.profile['record'](rng, 0)) | set(self.profile['session'](rng))
+        self.fit_file = SyntheticFitFile(self.activity_id, application_id, dev_fields)
+
+    def record_messages(self):
+        """Yield the record message fields."""
+        rng = random.Random(self.seed)
+        generate = self.profile['record']
+        for index in range(self.records):
+            message_fields = MessageFields(generate(rng, index))
+            message_fields['timestamp'] = self.start + datetime.timedelta(seconds=index)
+            yield message_fields
+
+    def session_message(self):
+        """Return the session message fields."""
+        message_fields = MessageFields(self.profile['session'](random.Random(self.seed)))
+        message_fields['timestamp'] = self.start + datetime.timedelta(seconds=self.records)
+        return message_fields
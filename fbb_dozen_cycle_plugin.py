@@ -9,9 +9,14 @@ from sqlalchemy import Integer, Float, DateTime, String, ForeignKey
 
 from garmindb import ActivityFitPluginBase
 
+from plugin_utils import RecordWriterMixin, MaterializedView
+
 
 logger = logging.getLogger(__file__)
 
+materialize_activity_view = False
+raw_record_days = None
+
 
 @classmethod
 def create_activity_view(cls, act_db):
@@ -35,15 +40,20 @@ def create_activity_view(cls, act_db):
         cls.round_ext_col(cls.activities_table, 'avg_speed'),
         cls.round_ext_col(cls.activities_table, 'max_speed'),
         cls.round_col('max_ftp'),
+        cls.round_col('avg_ftp'),
+        cls.round_col('avg_grade'),
         cls.activities_table.training_effect.label('training_effect'),
         cls.activities_table.anaerobic_training_effect.label('anaerobic_training_effect')
     ]
     view_name = 'dozen_cycle_activities'
     logger.info("Creating view %s of %s and %s if needed.", view_name, cls, cls.activities_table)
-    cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
+    if materialize_activity_view:
+        MaterializedView(view_name, cls, view_selectable).create(act_db)
+    else:
+        cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
 
 
-class fbb_dozen_cycle(ActivityFitPluginBase):
+class fbb_dozen_cycle(RecordWriterMixin, ActivityFitPluginBase):
     """Plugin for processing for the IQ data field Dozen Cycle from fbbbrown."""
 
     _application_id = bytearray(b'\xe8\xa4bZ\x84}@\x9a\x95d\xaf\x1f\xcb\x96C\x05')
@@ -63,42 +73,67 @@ class fbb_dozen_cycle(ActivityFitPluginBase):
         'percent_grade': {'args': [Float]},
         'estmated_ftp': {'args': [Float], 'units': 'watts'}
     }
+    _records_indexes = {
+        'timestamp': ['timestamp']
+    }
+    _records_fields = {
+        'percent_grade': {'fields': ['dev_grade']},
+        'estmated_ftp': {'fields': ['dev_eFTP']}
+    }
+
+    _records_tiers = (10, 60)
+    _records_raw_days = raw_record_days
 
     _sessions_tablename = 'dozen_cycle_sessions'
-    _sessions_version = 1
+    _sessions_version = 2
     _sessions_cols = {
         'activity_id': {'args': [String, ForeignKey('activities.activity_id')], 'kwargs': {'primary_key': True}},
         'timestamp': {'args': [DateTime]},
         'max_ftp': {'args': [Float], 'units': 'watts'},
+        'avg_ftp': {'args': [Float], 'units': 'watts'},
+        'ftp_stddev': {'args': [Float], 'units': 'watts'},
+        'ftp_p50': {'args': [Float], 'units': 'watts'},
+        'ftp_p90': {'args': [Float], 'units': 'watts'},
+        'avg_grade': {'args': [Float], 'units': 'percent'},
+        'min_grade': {'args': [Float], 'units': 'percent'},
+        'max_grade': {'args': [Float], 'units': 'percent'},
+        'grade_p90': {'args': [Float], 'units': 'percent'}
     }
+    _sessions_fields = {
+        'max_ftp': {'fields': ['dev_mxFTP']}
+    }
+    # Computed from the records as they are imported, max_ftp only when the app didn't write it to the session.
+    _sessions_aggregates = {
+        'max_ftp': ('estmated_ftp', 'max'),
+        'avg_ftp': ('estmated_ftp', 'mean'),
+        'ftp_stddev': ('estmated_ftp', 'stddev'),
+        'ftp_p50': ('estmated_ftp', 'p50'),
+        'ftp_p90': ('estmated_ftp', 'p90'),
+        'avg_grade': ('percent_grade', 'mean'),
+        'min_grade': ('percent_grade', 'min'),
+        'max_grade': ('percent_grade', 'max'),
+        'grade_p90': ('percent_grade', 'p90')
+    }
+
+    _sessions_rollups = ('max_ftp', 'avg_ftp', 'avg_grade')
 
     _tables = {}
     _views = {'activity_view': create_activity_view}
 
     def write_record_entry(self, activity_db_session, fit_file, activity_id, message_fields, record_num):
         """Write a record message into the plugin records table."""
-        record_table = self._tables['record']
-        if not record_table.s_exists(activity_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            record = {
-                'activity_id'       : activity_id,
-                'record'            : record_num,
-                'timestamp'         : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'percent_grade'     : message_fields.get('dev_grade'),
-                'estmated_ftp'      : message_fields.get('dev_eFTP'),
-            }
-            logger.debug("writing %s record %r for %s", self.__class__.__name__, record, fit_file.filename)
-            activity_db_session.add(record_table(**record))
+        self._import_record(activity_db_session, fit_file, activity_id, record_num, message_fields)
+        return {}
+
+    def write_session_entry(self, activity_db_session, fit_file, activity_id, message_fields):
+        """Write the buffered records once all record messages have been processed."""
+        self._flush_records(activity_db_session)
         return {}
 
     def write_cycle_entry(self, activity_db_session, fit_file, activity_id, sub_sport, message_fields):
         """Write a session message into the plugin's sessions table."""
-        session_table = self._tables['session']
-        if not session_table.s_exists(activity_db_session, {'activity_id' : activity_id}):
-            session = {
-                'activity_id'           : activity_id,
-                'timestamp'             : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'max_ftp'               : message_fields.get('dev_mxFTP'),
-            }
+        if not self._activity_imported(activity_db_session, activity_id):
+            session = self._session_entry(fit_file, activity_id, message_fields)
             logger.debug("writing %s session %r for %s message %r", self.__class__.__name__, session, fit_file.filename, message_fields)
-            activity_db_session.add(session_table(**session))
+            self._write_session(activity_db_session, session)
         return {}
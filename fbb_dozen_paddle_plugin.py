@@ -5,14 +5,55 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 import logging
+from sqlalchemy import Integer, Float, DateTime, String, ForeignKey
 
 from garmindb import ActivityFitPluginBase
 
+from plugin_utils import StrokeRecordsMixin, MaterializedView
+
 
 logger = logging.getLogger(__file__)
 
+materialize_activity_view = False
+columnar_records = False
+raw_record_days = None
+
+# The dev field the app writes its running stroke count to in record messages. It is the name of the session's stroke count and hasn't
+# been seen in a record message yet, if your FIT files name it differently change it here. An empty list stores no stroke counts and
+# the strokes are estimated from the stroke rate.
+record_stroke_count_fields = ['dev_sc']
+
 
-class fbb_dozen_paddle(ActivityFitPluginBase):
+@classmethod
+def create_activity_view(cls, act_db):
+    """Create a database view for the Dozen Paddle plugin data."""
+    view_selectable = [
+        cls.activity_id.label('activity_id'),
+        cls.activities_table.name.label('name'),
+        cls.activities_table.description.label('description'),
+        cls.activities_table.sub_sport.label('sub_sport'),
+        cls.activities_table.start_time.label('start_time'),
+        cls.activities_table.stop_time.label('stop_time'),
+        cls.activities_table.elapsed_time.label('elapsed_time'),
+        cls.strokes.label('strokes'),
+        cls.round_col('avg_stroke_rate'),
+        cls.max_stroke_rate.label('max_stroke_rate'),
+        cls.activities_table.avg_hr.label('avg_hr'),
+        cls.activities_table.max_hr.label('max_hr'),
+        cls.round_ext_col(cls.activities_table, 'calories'),
+        cls.round_ext_col(cls.activities_table, 'avg_speed'),
+        cls.activities_table.training_effect.label('training_effect'),
+        cls.activities_table.anaerobic_training_effect.label('anaerobic_training_effect')
+    ]
+    view_name = 'dozen_paddle_activities'
+    logger.info("Creating view %s of %s and %s if needed.", view_name, cls, cls.activities_table)
+    if materialize_activity_view:
+        MaterializedView(view_name, cls, view_selectable).create(act_db)
+    else:
+        cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
+
+
+class fbb_dozen_paddle(StrokeRecordsMixin, ActivityFitPluginBase):
     """Plugin for processing for the IQ data field Dozen Paddle from fbbbrown."""
 
     _application_id = bytearray(b'\xd6x,\x853\xf6D{\xb3Rza\xfa\x90SS')
@@ -22,10 +63,62 @@ class fbb_dozen_paddle(ActivityFitPluginBase):
     # represented here, please send in the example FIT file and I will add the additional fields.
     #
 
+    _records_tablename = 'dozen_paddle_records'
+    _records_version = 1
+    _records_pk = ("activity_id", "record")
+    _records_cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'record': {'args': [Integer]},
+        'timestamp': {'args': [DateTime]},
+        'stroke_rate': {'args': [Integer], 'units': 'spm'},
+        'strokes': {'args': [Integer]}
+    }
+    _records_columnar = columnar_records
+    _records_indexes = {
+        'timestamp': ['timestamp']
+    }
+    _records_fields = {
+        'stroke_rate': {'fields': ['cadence']},
+        'strokes': {'fields': record_stroke_count_fields}
+    }
+
+    _records_tiers = (10, 60)
+    _records_raw_days = raw_record_days
+
+    _sessions_tablename = 'dozen_paddle_sessions'
+    _sessions_version = 1
+    _sessions_cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')], 'kwargs': {'primary_key': True}},
+        'timestamp': {'args': [DateTime]},
+        'strokes': {'args': [Integer]},
+        'avg_stroke_rate': {'args': [Float], 'units': 'spm'},
+        'max_stroke_rate': {'args': [Integer], 'units': 'spm'}
+    }
+    _sessions_fields = {
+        'strokes': {'fields': ['dev_sc']}
+    }
+
+    _sessions_rollups = ('strokes', 'avg_stroke_rate')
+
     _tables = {}
-    _views = {}
+    _views = {'activity_view': create_activity_view}
+
+    def write_record_entry(self, activity_db_session, fit_file, activity_id, message_fields, record_num):
+        """Write a record message into the plugin records table."""
+        self._import_record(activity_db_session, fit_file, activity_id, record_num, message_fields)
+        return {}
+
+    def write_session_entry(self, activity_db_session, fit_file, activity_id, message_fields):
+        """Write the buffered records, the stroke summaries computed from them, and the session into the plugin tables."""
+        self._flush_records(activity_db_session)
+        if not self._activity_imported(activity_db_session, activity_id):
+            session = self._session_entry(fit_file, activity_id, message_fields)
+            self._write_strokes(activity_db_session, fit_file, session)
+            logger.debug("writing %s session %r for %s", self.__class__.__name__, session, fit_file.filename)
+            self._write_session(activity_db_session, session)
+        return {}
 
     def write_paddle_entry(self, activity_db_session, fit_file, activity_id, sub_sport, message_fields):
-        """Write a session message into the plugin's sessions table."""
+        """Return the app's stroke count for the paddle activities table."""
         stroke_count = message_fields.get('dev_sc')
         return {'strokes': stroke_count} if stroke_count else {}
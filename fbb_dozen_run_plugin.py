@@ -9,9 +9,14 @@ from sqlalchemy import Integer, Float, DateTime, String, ForeignKey
 
 from garmindb import ActivityFitPluginBase
 
+from plugin_utils import RecordWriterMixin, MaterializedView
+
 
 logger = logging.getLogger(__file__)
 
+materialize_activity_view = False
+raw_record_days = None
+
 
 @classmethod
 def create_activity_view(cls, act_db):
@@ -37,15 +42,20 @@ def create_activity_view(cls, act_db):
         cls.round_col('avg_running_economy'),
         cls.round_col('avg_training_peaks_re'),
         cls.round_col('xuxumatu_re'),
+        cls.round_col('max_running_economy'),
+        cls.round_col('avg_energy_expenditure'),
         cls.activities_table.training_effect.label('training_effect'),
         cls.activities_table.anaerobic_training_effect.label('anaerobic_training_effect')
     ]
     view_name = 'dozen_run_activities'
     logger.info("Creating view %s of %s and %s if needed.", view_name, cls, cls.activities_table)
-    cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
+    if materialize_activity_view:
+        MaterializedView(view_name, cls, view_selectable).create(act_db)
+    else:
+        cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
 
 
-class fbb_dozen_run(ActivityFitPluginBase):
+class fbb_dozen_run(RecordWriterMixin, ActivityFitPluginBase):
     """Plugin for processing for the IQ data field Dozen Run from fbbbrown."""
 
     _application_id = bytearray(b'\x9f\xf7Z\xfa\xd5\x94C\x11\x89\xf7\xf9,\xa0!\x18\xad')
@@ -66,48 +76,76 @@ class fbb_dozen_run(ActivityFitPluginBase):
         'relative_running_economy': {'args': [Float]},
         'training_peaks_re': {'args': [Float]},
     }
+    _records_indexes = {
+        'timestamp': ['timestamp']
+    }
+    _records_fields = {
+        'momentary_energy_expenditure': {'fields': ['dev_eE', 'dev_engExpend']},
+        'relative_running_economy': {'fields': ['dev_rE', 'dev_runEcono']},
+        'training_peaks_re': {'fields': ['dev_tpRE']}
+    }
+
+    _records_tiers = (10, 60)
+    _records_raw_days = raw_record_days
 
     _sessions_tablename = 'dozen_run_sessions'
-    _sessions_version = 1
+    _sessions_version = 2
     _sessions_cols = {
         'activity_id': {'args': [String, ForeignKey('activities.activity_id')], 'kwargs': {'primary_key': True}},
         'timestamp': {'args': [DateTime]},
         'avg_running_economy': {'args': [Float]},
         'avg_training_peaks_re': {'args': [Float]},
-        'xuxumatu_re': {'args': [Float]}
+        'xuxumatu_re': {'args': [Float]},
+        'max_running_economy': {'args': [Float]},
+        'running_economy_stddev': {'args': [Float]},
+        'running_economy_p50': {'args': [Float]},
+        'running_economy_p90': {'args': [Float]},
+        'max_training_peaks_re': {'args': [Float]},
+        'training_peaks_re_p50': {'args': [Float]},
+        'avg_energy_expenditure': {'args': [Float], 'units': 'c/hr'},
+        'max_energy_expenditure': {'args': [Float], 'units': 'c/hr'},
+        'energy_expenditure_p90': {'args': [Float], 'units': 'c/hr'}
     }
+    _sessions_fields = {
+        'avg_running_economy': {'fields': ['dev_aE']},
+        'avg_training_peaks_re': {'fields': ['dev_tpaRE']},
+        'xuxumatu_re': {'fields': ['dev_xRE']}
+    }
+    # Computed from the records as they are imported, the averages only when the app didn't write them to the session.
+    _sessions_aggregates = {
+        'avg_running_economy': ('relative_running_economy', 'mean'),
+        'max_running_economy': ('relative_running_economy', 'max'),
+        'running_economy_stddev': ('relative_running_economy', 'stddev'),
+        'running_economy_p50': ('relative_running_economy', 'p50'),
+        'running_economy_p90': ('relative_running_economy', 'p90'),
+        'avg_training_peaks_re': ('training_peaks_re', 'mean'),
+        'max_training_peaks_re': ('training_peaks_re', 'max'),
+        'training_peaks_re_p50': ('training_peaks_re', 'p50'),
+        'avg_energy_expenditure': ('momentary_energy_expenditure', 'mean'),
+        'max_energy_expenditure': ('momentary_energy_expenditure', 'max'),
+        'energy_expenditure_p90': ('momentary_energy_expenditure', 'p90')
+    }
+
+    _sessions_rollups = ('avg_running_economy', 'avg_training_peaks_re', 'avg_energy_expenditure')
 
     _tables = {}
     _views = {'activity_view': create_activity_view}
 
     def write_record_entry(self, activity_db_session, fit_file, activity_id, message_fields, record_num):
         """Write a record message into the plugin records table."""
-        record_table = self._tables['record']
-        if not record_table.s_exists(activity_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            record = {
-                'activity_id'                   : activity_id,
-                'record'                        : record_num,
-                'timestamp'                     : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'momentary_energy_expenditure'  : self._get_field(message_fields, ['dev_eE', 'dev_engExpend']),
-                'relative_running_economy'      : self._get_field(message_fields, ['dev_rE', 'dev_runEcono']),
-                'training_peaks_re'             : message_fields.get('dev_tpRE'),
-            }
-            logger.debug("writing %s record %r for %s", self.__class__.__name__, record, fit_file.filename)
-            activity_db_session.add(record_table(**record))
+        self._import_record(activity_db_session, fit_file, activity_id, record_num, message_fields)
+        return {}
+
+    def write_session_entry(self, activity_db_session, fit_file, activity_id, message_fields):
+        """Write the buffered records once all record messages have been processed."""
+        self._flush_records(activity_db_session)
         return {}
 
     def write_steps_entry(self, activity_db_session, fit_file, activity_id, sub_sport, message_fields):
         """Write a session message into the plugin's sessions table."""
-        session_table = self._tables['session']
         steps = message_fields.get('dev_tS')
-        if not session_table.s_exists(activity_db_session, {'activity_id' : activity_id}):
-            session = {
-                'activity_id'           : activity_id,
-                'timestamp'             : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'avg_running_economy'   : message_fields.get('dev_aE'),
-                'avg_training_peaks_re' : message_fields.get('dev_tpaRE'),
-                'xuxumatu_re'           : message_fields.get('dev_xRE'),
-            }
+        if not self._activity_imported(activity_db_session, activity_id):
+            session = self._session_entry(fit_file, activity_id, message_fields)
             logger.debug("writing %s session %r for %s message %r", self.__class__.__name__, session, fit_file.filename, message_fields)
-            activity_db_session.add(session_table(**session))
+            self._write_session(activity_db_session, session)
         return {'steps': steps} if steps else {}
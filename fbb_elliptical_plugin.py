@@ -9,9 +9,15 @@ from sqlalchemy import Integer, Float, DateTime, String, ForeignKey
 
 from garmindb import ActivityFitPluginBase
 
+from plugin_utils import RecordWriterMixin, MaterializedView
+
 
 logger = logging.getLogger(__file__)
 
+columnar_records = False
+materialize_activity_view = False
+raw_record_days = None
+
 
 @classmethod
 def create_activity_view(cls, act_db):
@@ -36,10 +42,13 @@ def create_activity_view(cls, act_db):
     ]
     view_name = 'elliptical_activities'
     logger.info("Creating elliptical view %s if needed.", view_name)
-    cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
+    if materialize_activity_view:
+        MaterializedView(view_name, cls, view_selectable).create(act_db)
+    else:
+        cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
 
 
-class fbb_elliptical(ActivityFitPluginBase):
+class fbb_elliptical(RecordWriterMixin, ActivityFitPluginBase):
     """A GarminDb plugin for saving data from the IQ application Elliptical from fbbbrown."""
 
     _application_id = bytearray(b'\x17+\xdc\xa5&\x8eL\x0e\xbbn\x12\xbe\xeej\xdc\x17')
@@ -61,6 +70,19 @@ class fbb_elliptical(ActivityFitPluginBase):
         'cadence': {'args': [Integer], 'units': 'rpm'},
         'momentary_energy_expenditure': {'args': [Float], 'units': 'c/hr'},
     }
+    _records_columnar = columnar_records
+    _records_indexes = {
+        'timestamp': ['timestamp']
+    }
+    _records_fields = {
+        'distance': {'fields': ['dev_distance']},
+        'speed': {'fields': ['dev_speed']},
+        'cadence': {'fields': ['dev_cadence']},
+        'momentary_energy_expenditure': {'fields': ['dev_eE', 'dev_engExpend']}
+    }
+
+    _records_tiers = (10, 60)
+    _records_raw_days = raw_record_days
 
     _sessions_tablename = 'elliptical_sessions'
     _sessions_version = 1
@@ -72,6 +94,15 @@ class fbb_elliptical(ActivityFitPluginBase):
         'avg_cadence': {'args': [Integer], 'units': 'rpm'},
         'battery_used': {'args': [Float], 'units': '%'}
     }
+    # some field names veried with versions of the app, so we check for all possible field names
+    _sessions_fields = {
+        'distance': {'fields': ['dev_total_distance', 'dev_distance']},
+        'steps': {'fields': ['dev_tStps', 'dev_Stps', 'dev_Steps', 'dev_ts', 'total_steps']},
+        'avg_cadence': {'fields': ['dev_avg_cadence']},
+        'battery_used': {'fields': ['dev_%bat', 'dev_BatteryUsed']}
+    }
+
+    _sessions_rollups = ('distance', 'steps', 'avg_cadence')
 
     _tables = {}
     _views = {'activity_view': create_activity_view}
@@ -83,38 +114,18 @@ class fbb_elliptical(ActivityFitPluginBase):
             'speed'         : message_fields.get('dev_speed'),
             'cadence'       : message_fields.get('dev_cadence')
         }
-        record_table = self._tables['record']
-        if not record_table.s_exists(activity_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            plugin_record = {
-                'activity_id'                   : activity_id,
-                'record'                        : record_num,
-                'timestamp'                     : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'momentary_energy_expenditure'  : self._get_field(message_fields, ['dev_eE', 'dev_engExpend']),
-            }
-            plugin_record.update(record)
-            logger.debug("writing %s record %r for %s", self.__class__.__name__, plugin_record, fit_file.filename)
-            activity_db_session.add(record_table(**plugin_record))
+        self._import_record(activity_db_session, fit_file, activity_id, record_num, message_fields)
         return record
 
     def write_session_entry(self, activity_db_session, fit_file, activity_id, message_fields):
         """Write a session message into the plugin sessions table."""
-        # some field names veried with versions of the app, so we check for all possible field names
-        distance = self._get_field(message_fields, ['dev_total_distance', 'dev_distance'])
-        avg_cadence = message_fields.get('dev_avg_cadence')
-        session_table = self._tables['session']
-        if not session_table.s_exists(activity_db_session, {'activity_id' : activity_id}):
-            session = {
-                'activity_id'   : activity_id,
-                'timestamp'     : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'distance'      : distance,
-                'avg_cadence'   : avg_cadence,
-                'steps'         : self._get_field(message_fields, ['dev_tStps', 'dev_Stps', 'dev_Steps', 'dev_ts', 'total_steps']),
-                'battery_used'  : self._get_field(message_fields, ['dev_%bat', 'dev_BatteryUsed'])
-            }
+        self._flush_records(activity_db_session)
+        session = self._session_entry(fit_file, activity_id, message_fields)
+        if not self._activity_imported(activity_db_session, activity_id):
             logger.debug("writing %s session %r for %s message %r", self.__class__.__name__, session, fit_file.filename, message_fields)
-            activity_db_session.add(session_table(**session))
+            self._write_session(activity_db_session, session)
         return {
-            'distance'      : distance,
-            'avg_cadence'   : avg_cadence,
+            'distance'      : session['distance'],
+            'avg_cadence'   : session['avg_cadence'],
             'calories'      : message_fields.get('dev_tcal'),
         }
@@ -5,13 +5,26 @@ __copyright__ = "Copyright Tom Goetz"
 __license__ = "GPL"
 
 import logging
-from sqlalchemy import Integer, DateTime, String, ForeignKey
+import math
+import datetime
+from itertools import groupby
+from sqlalchemy import Integer, DateTime, String, Float, Boolean, ForeignKey
 
 from garmindb import ActivityFitPluginBase
 
+from plugin_utils import RecordWriterMixin, MaterializedView, ArtifactFilter
+try:
+    from plugin_utils.hrv import intervals_array, seconds_array, time_domain, windowed_time_domain, frequency_domain, windowed_frequency_domain
+except ImportError:
+    # NumPy is needed to compute HRV metrics from the records, without it only the values the app wrote are stored.
+    time_domain = None
+
 
 logger = logging.getLogger(__file__)
 
+materialize_activity_view = False
+raw_record_days = None
+
 
 @classmethod
 def create_activity_view(cls, act_db):
@@ -32,16 +45,19 @@ def create_activity_view(cls, act_db):
     ]
     view_name = 'hrv_activities_view'
     logger.info("Creating hrv plugin view %s if needed.", view_name)
-    cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
+    if materialize_activity_view:
+        MaterializedView(view_name, cls, view_selectable).create(act_db)
+    else:
+        cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
 
 
-class fbb_hrv(ActivityFitPluginBase):
+class fbb_hrv(RecordWriterMixin, ActivityFitPluginBase):
     """A GarminDb plugin for saving data from the IQ application Heart Monitor + HRV from fbbbrown."""
 
     _application_id = bytearray(b'\x0b\xdc\x0eu\x9b\xaaAz\x8c\x9f\xe9vf*].')
 
     _records_tablename = 'hrv_records'
-    _records_version = 1
+    _records_version = 2
     _records_pk = ("activity_id", "record")
     _records_cols = {
         'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
@@ -49,8 +65,23 @@ class fbb_hrv(ActivityFitPluginBase):
         'timestamp': {'args': [DateTime]},
         'hrv_s': {'args': [Integer], 'units': 'ms'},
         'hrv_btb': {'args': [Integer], 'units': 'ms'},
-        'hrv_hr': {'args': [Integer], 'unis': 'bpm'}
+        'hrv_hr': {'args': [Integer], 'unis': 'bpm'},
+        'hrv_btb_clean': {'args': [Integer], 'units': 'ms'},
+        'hrv_artifact': {'args': [Boolean]}
+    }
+    _records_indexes = {
+        'timestamp': ['timestamp', 'hrv_btb_clean']
     }
+    _records_fields = {
+        'hrv_s': {'fields': ['dev_hrv_s']},
+        'hrv_btb': {'fields': ['dev_hrv_btb']},
+        'hrv_hr': {'fields': ['dev_hrv_hr']}
+    }
+    # hrv_btb with ectopic beats and dropouts replaced, and whether hrv_btb was an artifact, computed as the records are imported.
+    _records_computed = ('hrv_btb_clean', 'hrv_artifact')
+
+    _records_tiers = (10, 60)
+    _records_raw_days = raw_record_days
 
     _sessions_tablename = 'hrv_sessions'
     _sessions_version = 1
@@ -65,39 +96,204 @@ class fbb_hrv(ActivityFitPluginBase):
         'hrv_pnn20': {'args': [Integer], 'units': '%'}
     }
 
+    _sessions_fields = {
+        'min_hr': {'fields': ['dev_min_hr']},
+        'hrv_rmssd': {'fields': ['dev_hrv_rmssd']},
+        'hrv_sdrr_f': {'fields': ['dev_hrv_sdrr_f']},
+        'hrv_sdrr_l': {'fields': ['dev_hrv_sdrr_l']},
+        'hrv_pnn50': {'fields': ['dev_hrv_pnn50']},
+        'hrv_pnn20': {'fields': ['dev_hrv_pnn20']}
+    }
+
+    _windows_tablename = 'hrv_windows'
+    _windows_version = 1
+    _windows_pk = ("activity_id", "window")
+    _windows_cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'window': {'args': [Integer]},
+        'timestamp': {'args': [DateTime]},
+        'beats': {'args': [Integer]},
+        'hrv_rmssd': {'args': [Float], 'units': 'ms'},
+        'hrv_sdrr': {'args': [Float], 'units': 'ms'},
+        'hrv_pnn50': {'args': [Float], 'units': '%'},
+        'hrv_pnn20': {'args': [Float], 'units': '%'}
+    }
+    _frequency_tablename = 'hrv_frequency'
+    _frequency_version = 1
+    _frequency_cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')], 'kwargs': {'primary_key': True}},
+        'windows': {'args': [Integer]},
+        'hrv_lf': {'args': [Float], 'units': 'ms^2'},
+        'hrv_hf': {'args': [Float], 'units': 'ms^2'},
+        'hrv_lf_hf': {'args': [Float]}
+    }
+    _frequency_windows_tablename = 'hrv_frequency_windows'
+    _frequency_windows_version = 1
+    _frequency_windows_pk = ("activity_id", "window")
+    _frequency_windows_cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'window': {'args': [Integer]},
+        'timestamp': {'args': [DateTime]},
+        'beats': {'args': [Integer]},
+        'hrv_lf': {'args': [Float], 'units': 'ms^2'},
+        'hrv_hf': {'args': [Float], 'units': 'ms^2'},
+        'hrv_lf_hf': {'args': [Float]}
+    }
+    # The length of the hrv_windows and hrv_frequency_windows windows, and of the first and last windows the session SDRR values cover.
+    _window_seconds = 300
+
+    _sessions_rollups = ('min_hr', 'hrv_rmssd', 'hrv_sdrr_f', 'hrv_sdrr_l', 'hrv_pnn50', 'hrv_pnn20')
+
     _tables = {}
     _views = {'activity_view': create_activity_view}
 
+    @classmethod
+    def init_activity(cls, act_db_class, activities_table):
+        """Initialize the plugin tables, including the computed HRV tables."""
+        super().init_activity(act_db_class, activities_table)
+        if 'window' not in cls._tables:
+            cls._tables['window'] = activities_table.create(cls._windows_tablename, act_db_class, cls._windows_version, cls._windows_pk, cls._windows_cols)
+        if 'frequency' not in cls._tables:
+            cls._tables['frequency'] = activities_table.create(cls._frequency_tablename, act_db_class, cls._frequency_version, cols=cls._frequency_cols)
+        if 'frequency_window' not in cls._tables:
+            cls._tables['frequency_window'] = activities_table.create(cls._frequency_windows_tablename, act_db_class, cls._frequency_windows_version,
+                                                                      cls._frequency_windows_pk, cls._frequency_windows_cols)
+
+    @classmethod
+    def _float_or_none(cls, value):
+        return None if math.isnan(value) else float(value)
+
+    def _replace_rows(self, activity_db_session, table_name, activity_id, rows):
+        """Replace the rows of a computed HRV table for an activity with one bulk insert."""
+        table = self._tables[table_name]
+        activity_db_session.query(table).filter(table.activity_id == activity_id).delete()
+        if rows:
+            activity_db_session.execute(table.__table__.insert(), rows)
+
+    def _window_rows(self, activity_id, start_time, windows, columns):
+        """Return table rows for the windows returned by a windowed HRV function, columns maps table columns to window keys."""
+        return [
+            dict({
+                'activity_id'   : activity_id,
+                'window'        : int(windows['start'][index] // self._window_seconds),
+                'timestamp'     : start_time + datetime.timedelta(seconds=float(windows['start'][index])),
+                'beats'         : int(windows['beats'][index]),
+            }, **{column: self._float_or_none(windows[key][index]) for column, key in columns.items()})
+            for index in range(len(windows['start']))
+        ]
+
+    def _hrv_frequency(self, activity_db_session, activity_id, timestamps, seconds, intervals):
+        """Write the LF/HF rows for an activity to hrv_frequency and hrv_frequency_windows."""
+        windows = windowed_frequency_domain(seconds, intervals, self._window_seconds)
+        columns = {'hrv_lf': 'lf', 'hrv_hf': 'hf', 'hrv_lf_hf': 'lf_hf'}
+        self._replace_rows(activity_db_session, 'frequency_window', activity_id, self._window_rows(activity_id, timestamps[0], windows, columns))
+        session = frequency_domain(windows)
+        row = dict({'activity_id': activity_id, 'windows': session['windows']}, **{column: session[key] for column, key in columns.items()})
+        self._replace_rows(activity_db_session, 'frequency', activity_id, [row])
+
+    def _hrv_metrics(self, activity_db_session, activity_id, records):
+        """
+        Write the computed HRV table rows for an activity and return the session metrics.
+
+        The records are (timestamp, hrv_btb_clean, hrv_artifact, hrv_hr) tuples. Time domain metrics leave artifacts out, the frequency
+        domain metrics need evenly spaced beats and use the corrected intervals.
+        """
+        timestamps, clean, artifacts, hr = zip(*records)
+        corrected = intervals_array(clean)
+        intervals = intervals_array([None if artifact else interval for interval, artifact in zip(clean, artifacts)])
+        seconds = seconds_array(timestamps)
+        windows = windowed_time_domain(seconds, intervals, self._window_seconds)
+        window_rows = self._window_rows(activity_id, timestamps[0], windows, {'hrv_rmssd': 'rmssd', 'hrv_sdrr': 'sdrr', 'hrv_pnn50': 'pnn50', 'hrv_pnn20': 'pnn20'})
+        self._replace_rows(activity_db_session, 'window', activity_id, window_rows)
+        self._hrv_frequency(activity_db_session, activity_id, timestamps, seconds, corrected)
+        session = time_domain(intervals)
+        first = time_domain(intervals[seconds < seconds[0] + self._window_seconds])
+        last = time_domain(intervals[seconds > seconds[-1] - self._window_seconds])
+        heart_rates = [value for value in hr if value]
+        metrics = {
+            'min_hr'        : min(heart_rates) if heart_rates else None,
+            'hrv_rmssd'     : session['rmssd'],
+            'hrv_sdrr_f'    : first['sdrr'],
+            'hrv_sdrr_l'    : last['sdrr'],
+            'hrv_pnn50'     : session['pnn50'],
+            'hrv_pnn20'     : session['pnn20'],
+        }
+        logger.debug("hrv metrics for %s: %r from %d windows", activity_id, metrics, len(window_rows))
+        return {name: round(value) for name, value in metrics.items() if value is not None}
+
+    def _records_query(self, activity_db_session, activity_ids=None):
+        record_table = self._tables['record']
+        query = activity_db_session.query(record_table.activity_id, record_table.timestamp, record_table.hrv_btb_clean, record_table.hrv_artifact,
+                                            record_table.hrv_hr)
+        if activity_ids is not None:
+            query = query.filter(record_table.activity_id.in_(activity_ids))
+        return query.order_by(record_table.activity_id, record_table.record).yield_per(10000)
+
+    def _fill_session(self, session, metrics):
+        """Set the session fields the app didn't write from the computed metrics."""
+        for name, value in metrics.items():
+            if session.get(name) is None:
+                session[name] = value
+
+    def update_hrv_metrics(self, activity_db_session, activity_ids=None):
+        """
+        Compute the HRV metrics of already imported activities from their records.
+
+        Parameters:
+        ----------
+            activity_db_session (Session): a session on the activities database
+            activity_ids (list): the activities to update, defaults to the activities that have records but no computed HRV rows
+
+        The records are read with one query and the computed HRV table rows of each activity are rewritten. Session fields the app didn't
+        write are filled in and the session rollups are rebuilt. Returns the number of activities updated.
+        """
+        if time_domain is None:
+            raise RuntimeError('Computing HRV metrics needs NumPy')
+        record_table = self._tables['record']
+        session_table = self._tables['session']
+        if activity_ids is None:
+            windowed = activity_db_session.query(self._tables['window'].activity_id)
+            spectral = activity_db_session.query(self._tables['frequency'].activity_id)
+            query = activity_db_session.query(record_table.activity_id).filter(record_table.activity_id.not_in(windowed) | record_table.activity_id.not_in(spectral))
+            activity_ids = [row[0] for row in query.distinct()]
+        updated = 0
+        for activity_id, rows in groupby(self._records_query(activity_db_session, activity_ids), key=lambda row: row[0]):
+            metrics = self._hrv_metrics(activity_db_session, activity_id, [row[1:] for row in rows])
+            session = session_table.s_get(activity_db_session, activity_id)
+            if session is not None:
+                values = {name: getattr(session, name) for name in metrics}
+                self._fill_session(values, metrics)
+                session.update_from_dict(values)
+            updated += 1
+        if updated:
+            self.rebuild_rollups(activity_db_session)
+        logger.info("Updated the hrv metrics of %d activities", updated)
+        return updated
+
+    def _record_row(self, fit_file, activity_id, record_num, message_fields):
+        """Return a records table row with the interval passed through the artifact filter of the file."""
+        row = super()._record_row(fit_file, activity_id, record_num, message_fields)
+        file_cache = self._file_cache(fit_file)
+        artifact_filter = file_cache.get('artifact_filter')
+        if artifact_filter is None:
+            artifact_filter = file_cache['artifact_filter'] = ArtifactFilter()
+        # hrv_btb follows the activity_id, record, timestamp, and hrv_s columns.
+        return row + artifact_filter.filter(row[4])
+
     def write_record_entry(self, activity_db_session, fit_file, activity_id, message_fields, record_num):
         """Write a record message into the plugin records table."""
-        record_table = self._tables['record']
-        if not record_table.s_exists(activity_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            record = {
-                'activity_id'   : activity_id,
-                'record'        : record_num,
-                'timestamp'     : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'hrv_s'         : message_fields.get('dev_hrv_s'),
-                'hrv_btb'       : message_fields.get('dev_hrv_btb'),
-                'hrv_hr'        : message_fields.get('dev_hrv_hr'),
-            }
-            logger.debug("writing hrv record %r for %s", record, fit_file.filename)
-            activity_db_session.add(record_table(**record))
+        self._import_record(activity_db_session, fit_file, activity_id, record_num, message_fields)
         return {}
 
     def write_session_entry(self, activity_db_session, fit_file, activity_id, message_fields):
         """Write a session message into the plugin sessions table."""
-        session_table = self._tables['session']
-        if not session_table.s_exists(activity_db_session, {'activity_id' : activity_id}):
-            session = {
-                'activity_id'   : activity_id,
-                'timestamp'     : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                'min_hr'        : message_fields.get('dev_min_hr'),
-                'hrv_rmssd'     : message_fields.get('dev_hrv_rmssd'),
-                'hrv_sdrr_f'    : message_fields.get('dev_hrv_sdrr_f'),
-                'hrv_sdrr_l'    : message_fields.get('dev_hrv_sdrr_l'),
-                'hrv_pnn50'     : message_fields.get('dev_hrv_pnn50'),
-                'hrv_pnn20'     : message_fields.get('dev_hrv_pnn20'),
-            }
+        self._flush_records(activity_db_session)
+        if not self._activity_imported(activity_db_session, activity_id):
+            session = self._session_entry(fit_file, activity_id, message_fields)
+            if time_domain is not None:
+                records = [row[1:] for row in self._records_query(activity_db_session, [activity_id])]
+                if records:
+                    self._fill_session(session, self._hrv_metrics(activity_db_session, activity_id, records))
             logger.debug("writing hrv session %r for %s", session, fit_file.filename)
-            activity_db_session.add(session_table(**session))
+            self._write_session(activity_db_session, session)
         return {}
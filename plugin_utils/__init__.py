@@ -0,0 +1,21 @@
+"""Shared helpers for the GarminDb plugins in this repository."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+from .field_map import FieldMap, FieldExtractor
+from .local_time import local_time_converter
+from .stats import PluginStats
+from .materialized_view import MaterializedView
+from .manifest import PluginManifest, build_manifest, write_manifest
+from .indexes import sync_indexes
+from .record_writer import RecordWriter, RecordWriterMixin
+from .parallel_import import PluginImporter, merge_staging, parallel_import
+from .artifacts import ArtifactFilter
+from .columnar import ColumnarRecordWriter
+from .power import PowerZoneAccumulator
+from .strokes import StrokeAccumulator, StrokeRecordsMixin
+from .background_writer import BackgroundWriter
+from .record_cache import RecordCache, invalidate_records
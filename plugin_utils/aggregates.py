@@ -0,0 +1,181 @@
+"""Streaming aggregates of record values: count, mean, standard deviation, min, max, and P² quantile estimates."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import math
+
+
+class RunningStats():
+    """Count, mean, variance, min, and max of a stream of values in constant memory, the mean and variance with Welford's method."""
+
+    def __init__(self):
+        """Return a RunningStats instance."""
+        self.count = 0
+        self.mean = None
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+
+    def add(self, value):
+        """Add a value to the stream, None values are skipped."""
+        if value is None:
+            return
+        self.count += 1
+        if self.count == 1:
+            self.mean = self.min = self.max = value
+            return
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    @property
+    def variance(self):
+        """Return the sample variance or None if there are fewer than two values."""
+        return self._m2 / (self.count - 1) if self.count > 1 else None
+
+    @property
+    def stddev(self):
+        """Return the sample standard deviation or None if there are fewer than two values."""
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+
+class P2Quantile():
+    """
+    Estimates a quantile of a stream of values in constant memory with the P² algorithm of Jain and Chlamtac.
+
+    Five markers track the minimum, the quantile, the maximum, and the quantiles half way between them. Each value moves the marker
+    positions and markers that drift from their desired position are adjusted with a piecewise parabolic interpolation. Until five
+    values have been seen the quantile is exact.
+    """
+
+    def __init__(self, quantile):
+        """
+        Return a P2Quantile instance.
+
+        Parameters:
+        ----------
+            quantile (float): the quantile to estimate, between 0 and 1
+
+        """
+        self.quantile = quantile
+        self.count = 0
+        self._heights = []
+        self._positions = [0, 1, 2, 3, 4]
+        self._desired = [0.0, 2 * quantile, 4 * quantile, 2 + 2 * quantile, 4.0]
+        self._increments = [0.0, quantile / 2, quantile, (1 + quantile) / 2, 1.0]
+
+    def add(self, value):
+        """Add a value to the stream, None values are skipped."""
+        if value is None:
+            return
+        self.count += 1
+        heights = self._heights
+        if self.count <= 5:
+            heights.append(value)
+            heights.sort()
+            return
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = 0
+            while value >= heights[cell + 1]:
+                cell += 1
+        positions = self._positions
+        for marker in range(cell + 1, 5):
+            positions[marker] += 1
+        for marker in range(5):
+            self._desired[marker] += self._increments[marker]
+        for marker in range(1, 4):
+            drift = self._desired[marker] - positions[marker]
+            if (drift >= 1 and positions[marker + 1] - positions[marker] > 1) or (drift <= -1 and positions[marker - 1] - positions[marker] < -1):
+                step = 1 if drift > 0 else -1
+                height = self._parabolic(marker, step)
+                if not heights[marker - 1] < height < heights[marker + 1]:
+                    height = heights[marker] + step * (heights[marker + step] - heights[marker]) / (positions[marker + step] - positions[marker])
+                heights[marker] = height
+                positions[marker] += step
+
+    def _parabolic(self, marker, step):
+        heights = self._heights
+        positions = self._positions
+        below = positions[marker] - positions[marker - 1]
+        above = positions[marker + 1] - positions[marker]
+        return heights[marker] + step / (positions[marker + 1] - positions[marker - 1]) * (
+            (below + step) * (heights[marker + 1] - heights[marker]) / above + (above - step) * (heights[marker] - heights[marker - 1]) / below
+        )
+
+    @property
+    def value(self):
+        """Return the quantile estimate or None if no values have been seen."""
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            # exact, linearly interpolated between the closest ranks
+            rank = self.quantile * (self.count - 1)
+            lower = int(rank)
+            upper = min(lower + 1, self.count - 1)
+            return self._heights[lower] + (rank - lower) * (self._heights[upper] - self._heights[lower])
+        return self._heights[2]
+
+
+class SessionAggregator():
+    """
+    Computes session values from an activity's records table rows as they are imported, without reading the records back.
+
+    Aggregates are declared as session column to a (records column, statistic) tuple. The statistic is one of count, mean, stddev,
+    min, or max, or pNN for the NN percentile, p90 for instance.
+    """
+
+    _running_stats = ('count', 'mean', 'stddev', 'min', 'max')
+
+    def __init__(self, aggregates, columns):
+        """
+        Return a SessionAggregator instance.
+
+        Parameters:
+        ----------
+            aggregates (dict): session column name to a (records column name, statistic) tuple
+            columns (list): the records table column names in the order of the rows passed to add()
+
+        """
+        self.aggregates = dict(aggregates)
+        self._accumulators = {}
+        for record_column, statistic in self.aggregates.values():
+            key = self._accumulator_key(record_column, statistic)
+            if key not in self._accumulators:
+                accumulator = RunningStats() if key[1] is None else P2Quantile(key[1])
+                self._accumulators[key] = (columns.index(record_column), accumulator)
+        self._updates = [(index, accumulator.add) for index, accumulator in self._accumulators.values()]
+
+    @classmethod
+    def _accumulator_key(cls, record_column, statistic):
+        if statistic in cls._running_stats:
+            return (record_column, None)
+        if statistic.startswith('p') and statistic[1:].isdigit():
+            return (record_column, int(statistic[1:]) / 100.0)
+        raise ValueError(f'Unknown session aggregate {statistic} of {record_column}')
+
+    def add(self, row):
+        """Add a records table row to the aggregates."""
+        for index, update in self._updates:
+            update(row[index])
+
+    def values(self):
+        """Return a dict of session column to aggregate value, None for columns that had no values."""
+        values = {}
+        for session_column, (record_column, statistic) in self.aggregates.items():
+            key = self._accumulator_key(record_column, statistic)
+            accumulator = self._accumulators[key][1]
+            values[session_column] = accumulator.value if key[1] is not None else getattr(accumulator, statistic)
+        return values
@@ -0,0 +1,60 @@
+"""Streaming detection and correction of beat to beat interval artifacts."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+from collections import deque
+
+
+class ArtifactFilter():
+    """
+    Flags and corrects ectopic beats and dropouts in beat to beat intervals as they stream in.
+
+    An interval is an artifact if it is missing, outside the physiological range, or deviates from the median of the recent in range
+    intervals by more than max_deviation. Artifacts are replaced by that median. The recent intervals are kept in a fixed size ring
+    buffer, so memory use doesn't depend on the length of the activity.
+    """
+
+    def __init__(self, size=11, min_interval=300, max_interval=2000, max_deviation=0.2, min_samples=5):
+        """
+        Return an ArtifactFilter instance.
+
+        Parameters:
+        ----------
+            size (int): the number of recent in range intervals the median is taken over
+            min_interval (int): the shortest physiological interval in ms, 300 ms is 200 bpm
+            max_interval (int): the longest physiological interval in ms, 2000 ms is 30 bpm
+            max_deviation (float): the largest accepted deviation from the median as a fraction of the median
+            min_samples (int): the number of intervals needed in the buffer before deviations are checked
+
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_deviation = max_deviation
+        self.min_samples = min_samples
+        self._recent = deque(maxlen=size)
+
+    def reset(self):
+        """Forget the recent intervals, call when a new recording starts."""
+        self._recent.clear()
+
+    def median(self):
+        """Return the median of the recent in range intervals or None if there are none."""
+        count = len(self._recent)
+        if count == 0:
+            return None
+        ordered = sorted(self._recent)
+        middle = count // 2
+        return ordered[middle] if count % 2 else (ordered[middle - 1] + ordered[middle]) / 2
+
+    def filter(self, interval):
+        """Return a tuple of the cleaned interval, or None if there isn't one, and True if interval is an artifact."""
+        median = self.median()
+        if not interval or interval < self.min_interval or interval > self.max_interval:
+            return (None if median is None else round(median), True)
+        # In range intervals always go into the buffer so that the median follows real changes in heart rate.
+        self._recent.append(interval)
+        if median is not None and len(self._recent) > self.min_samples and abs(interval - median) > self.max_deviation * median:
+            return (round(median), True)
+        return (interval, False)
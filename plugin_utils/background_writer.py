@@ -0,0 +1,141 @@
+"""Write plugin table rows on a dedicated thread so parsing FIT messages and writing rows overlap."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import queue
+import logging
+import threading
+
+
+logger = logging.getLogger(__file__)
+
+
+class BackgroundWriter():
+    """
+    Inserts batches of rows into database tables from a writer thread with its own connection.
+
+    put() queues a batch and returns, blocking only while the queue is full, so a slow database holds back the import instead of
+    the queued rows growing without bound. The writer thread commits every transaction_rows rows and whenever sync() is called. An
+    error in the writer thread rolls back its transaction, the batches queued after it up to the next sync() are dropped, and the error
+    is raised by put() until sync() or close() raises it.
+
+    The writer's connection holds the database's write lock while it has uncommitted rows, so the importing thread must not write to
+    the same SQLite database until sync() returns. RecordWriterMixin calls sync() when an activity's records are flushed, before
+    sessions are written.
+    """
+
+    def __init__(self, engine, queue_size=8, transaction_rows=50000, poll_seconds=1.0):
+        """
+        Return a BackgroundWriter instance and start its thread.
+
+        Parameters:
+        ----------
+            engine (Engine): the engine of the database written to
+            queue_size (int): the number of batches that can be waiting to be written
+            transaction_rows (int): the number of rows written per transaction
+            poll_seconds (float): how often a blocked put() or sync() checks that the writer thread is still running
+
+        """
+        self.engine = engine
+        self.transaction_rows = transaction_rows
+        self.poll_seconds = poll_seconds
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='plugin_writer', daemon=True)
+        self._thread.start()
+
+    def _write(self, connection, transaction, table, rows):
+        if self._error is not None:
+            return transaction, 0
+        try:
+            if transaction is None:
+                transaction = connection.begin()
+            connection.execute(table.insert(), rows)
+            return transaction, len(rows)
+        except Exception as e:
+            logger.error("Background write to %s failed: %s", table.name, e)
+            self._error = e
+            if transaction is not None:
+                transaction.rollback()
+            return None, 0
+
+    def _commit(self, transaction):
+        if transaction is not None and self._error is None:
+            try:
+                transaction.commit()
+            except Exception as e:
+                logger.error("Background commit failed: %s", e)
+                self._error = e
+                transaction.rollback()
+
+    def _run(self):
+        try:
+            self._write_queued()
+        except Exception as e:
+            logger.error("Background writer stopped: %s", e)
+            self._error = e
+
+    def _write_queued(self):
+        transaction = None
+        uncommitted = 0
+        with self.engine.connect() as connection:
+            while True:
+                item = self._queue.get()
+                if item is None or isinstance(item, threading.Event):
+                    self._commit(transaction)
+                    transaction = None
+                    uncommitted = 0
+                    if item is None:
+                        break
+                    item.set()
+                    continue
+                transaction, written = self._write(connection, transaction, *item)
+                uncommitted += written
+                if uncommitted >= self.transaction_rows:
+                    self._commit(transaction)
+                    transaction = None
+                    uncommitted = 0
+
+    def _raise_error(self, clear=True):
+        error = self._error
+        if error is not None:
+            if clear:
+                self._error = None
+            raise RuntimeError(f'Background plugin write failed: {error}') from error
+
+    def _check_alive(self):
+        if not self._thread.is_alive():
+            self._raise_error()
+            raise RuntimeError('The background plugin writer is closed')
+
+    def _put(self, item):
+        # Wait in steps so a writer thread that died doesn't leave the importing thread blocked on a full queue.
+        while True:
+            self._check_alive()
+            try:
+                self._queue.put(item, timeout=self.poll_seconds)
+                return
+            except queue.Full:
+                pass
+
+    def put(self, table, rows):
+        """Queue rows, a list of dicts, to be inserted into table, a SQLAlchemy Table."""
+        self._raise_error(clear=False)
+        self._put((table, rows))
+
+    def sync(self):
+        """Wait until all queued rows are committed, raises the error of a failed write or of the writer thread stopping."""
+        done = threading.Event()
+        self._put(done)
+        while not done.wait(self.poll_seconds):
+            self._check_alive()
+        self._raise_error()
+
+    def close(self):
+        """Commit the queued rows and stop the writer thread, raises the error of a failed write."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
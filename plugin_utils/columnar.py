@@ -0,0 +1,191 @@
+"""Columnar storage of plugin records: one compressed array per activity and column."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import sys
+import zlib
+import time
+import datetime
+import logging
+from array import array
+
+from sqlalchemy import Integer, Float, DateTime, Time, Boolean, String, LargeBinary, ForeignKey
+
+
+logger = logging.getLogger(__file__)
+
+
+columns_table_version = 1
+columns_table_pk = ("activity_id", "name")
+
+
+def columns_tablename(records_tablename):
+    """Return the name of the table that holds the columnar arrays of a records table."""
+    return records_tablename + '_columns'
+
+
+def columns_table_cols():
+    """Return the columns of a table that holds the arrays of a records table, the array data and null mask are zlib compressed."""
+    return {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'name': {'args': [String]},
+        'encoding': {'args': [String]},
+        'typecode': {'args': [String]},
+        'count': {'args': [Integer]},
+        'data': {'args': [LargeBinary]},
+        'nulls': {'args': [LargeBinary]}
+    }
+
+
+# Encodings:
+# plain         the values
+# delta         the first value followed by the differences between successive values
+# datetime      milliseconds since the epoch of naive datetimes, delta encoded
+# time          milliseconds since midnight of datetime.time values
+_epoch = datetime.datetime(1970, 1, 1)
+_millisecond = datetime.timedelta(milliseconds=1)
+
+
+def _datetime_ms(value):
+    return (value - _epoch) // _millisecond
+
+
+def _time_ms(value):
+    return (value.hour * 3600 + value.minute * 60 + value.second) * 1000 + value.microsecond // 1000
+
+
+def column_encoding(name, column_type):
+    """Return the (encoding, array typecode) a records table column is stored with."""
+    if name == 'record':
+        return ('delta', 'q')
+    if isinstance(column_type, DateTime):
+        return ('datetime', 'q')
+    if isinstance(column_type, Time):
+        return ('time', 'i')
+    if isinstance(column_type, Boolean):
+        return ('plain', 'b')
+    if isinstance(column_type, Float):
+        return ('plain', 'd')
+    return ('plain', 'q')
+
+
+def _compress(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return zlib.compress(values.tobytes())
+
+
+def encode_column(values, encoding, typecode):
+    """Return a dict of the count, compressed data, and compressed null mask, or None if no value is None, for a column's values."""
+    nulls = None
+    if any(value is None for value in values):
+        nulls = zlib.compress(bytes(value is None for value in values))
+    if encoding == 'datetime':
+        numbers = [0 if value is None else _datetime_ms(value) for value in values]
+    elif encoding == 'time':
+        numbers = [0 if value is None else _time_ms(value) for value in values]
+    else:
+        numbers = [0 if value is None else value for value in values]
+    if typecode != 'd':
+        numbers = [int(round(number)) for number in numbers]
+    if encoding in ('delta', 'datetime'):
+        numbers = numbers[:1] + [current - previous for previous, current in zip(numbers, numbers[1:])]
+    return {'encoding': encoding, 'typecode': typecode, 'count': len(values), 'data': _compress(array(typecode, numbers)), 'nulls': nulls}
+
+
+class ColumnarRecordWriter():
+    """
+    Collects the record rows of an activity and writes them as one compressed array per column.
+
+    Arrays can't be appended to, so an activity is written once, when its last record has been added, and activities that already
+    have arrays are skipped as a whole.
+    """
+
+    def __init__(self, table, columns_table, columns, stats=None, background=None):
+        """
+        Return a ColumnarRecordWriter instance.
+
+        Parameters:
+        ----------
+            table (DbObject): the plugin records table, its column types select the array encodings
+            columns_table (DbObject): the table the arrays are written to
+            columns (list): the table column names in the order rows are passed to add()
+            stats (PluginStats): optional counters to update
+            background (BackgroundWriter): optional writer thread the inserts are handed to instead of executing them in the session
+
+        """
+        self.table = table
+        self.background = background
+        self.columns_table = columns_table
+        self.columns = tuple(columns)
+        record_columns = table.__table__.columns
+        self.encodings = [column_encoding(name, record_columns[name].type) for name in self.columns]
+        self._activity_id = None
+        self._stored = False
+        self._rows = []
+        self._skipped = 0
+        self.stats = stats
+
+    @property
+    def activity_id(self):
+        """Return the id of the activity whose records are being collected."""
+        return self._activity_id
+
+    def _start_activity(self, session, activity_id):
+        start = time.perf_counter()
+        query = session.query(self.columns_table).filter(self.columns_table.activity_id == activity_id)
+        self._stored = session.query(query.exists()).scalar()
+        self._activity_id = activity_id
+        if self.stats is not None:
+            self.stats.add(activity_id, 'existence_checks')
+            self.stats.add(activity_id, 'existence_check_time', time.perf_counter() - start)
+
+    def add(self, session, row):
+        """Buffer a row, a tuple of values starting with activity_id and record, unless the activity is already stored."""
+        activity_id = row[0]
+        if activity_id != self._activity_id:
+            self.flush(session)
+            self._start_activity(session, activity_id)
+        if self._stored:
+            self._skipped += 1
+        else:
+            self._rows.append(row)
+
+    def flush(self, session):
+        """Write the arrays of the buffered activity in one executemany insert."""
+        if self._skipped and self.stats is not None:
+            self.stats.add(self._activity_id, 'rows_skipped', self._skipped)
+        self._skipped = 0
+        if self._rows:
+            start = time.perf_counter()
+            # activity_id is the same in every row and is the key of the arrays.
+            arrays = [
+                dict(encode_column(values, *encoding), activity_id=self._activity_id, name=name)
+                for name, encoding, values in zip(self.columns[1:], self.encodings[1:], list(zip(*self._rows))[1:])
+            ]
+            logger.debug("%s: inserting %d columns of %d records for %s", self.columns_table.__tablename__, len(arrays), len(self._rows), self._activity_id)
+            if self.background is not None:
+                self.background.put(self.columns_table.__table__, arrays)
+            else:
+                session.execute(self.columns_table.__table__.insert(), arrays)
+            if self.stats is not None:
+                self.stats.add(self._activity_id, 'inserts')
+                self.stats.add(self._activity_id, 'rows_written', len(self._rows))
+                self.stats.add(self._activity_id, 'insert_time', time.perf_counter() - start)
+            self._stored = True
+            self._rows = []
+
+    def finish(self, session):
+        """Write the buffered activity and forget it."""
+        self.flush(session)
+        self._activity_id = None
+        self._stored = False
+
+    def discard(self):
+        """Drop the buffered activity, used when the session it was for rolled back."""
+        self._rows = []
+        self._skipped = 0
+        self._activity_id = None
+        self._stored = False
@@ -0,0 +1,93 @@
+"""Declarative mapping of plugin table columns to FIT message fields."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import operator
+
+
+logger = logging.getLogger(__file__)
+
+
+def _no_field(message_fields):
+    return None
+
+
+def _probe_getter(field_names):
+    def probe(message_fields):
+        for field_name in field_names:
+            if field_name in message_fields:
+                return message_fields[field_name]
+    return probe
+
+
+def _convert_getter(getter, convert):
+    def get_and_convert(message_fields):
+        return convert(getter(message_fields))
+    return get_and_convert
+
+
+class FieldExtractor():
+    """Builds table values from FIT messages with getters resolved for one FIT file."""
+
+    __slots__ = ('columns', 'getters')
+
+    def __init__(self, columns, getters):
+        """Return a FieldExtractor with one getter per column."""
+        self.columns = columns
+        self.getters = getters
+
+    def values(self, message_fields):
+        """Return a tuple of the column values from a message."""
+        return tuple([getter(message_fields) for getter in self.getters])
+
+    def as_dict(self, message_fields):
+        """Return a dict of the column values from a message."""
+        return dict(zip(self.columns, self.values(message_fields)))
+
+
+class FieldMap():
+    """
+    Maps table columns to the FIT message fields they are read from.
+
+    The map is a dict of column name to a dict with a 'fields' list of field names and an optional 'convert' function. The field names
+    are aliases, the app has used different names in different versions, and the first one present in a message is used as with
+    PluginBase._get_field.
+    """
+
+    def __init__(self, fields):
+        """Return a FieldMap instance for a dict of column name to field spec."""
+        self.fields = fields
+        self.columns = tuple(fields)
+
+    @classmethod
+    def _resolve(cls, fit_file, field_names):
+        """Return the aliases that can appear in the FIT file based on its field description messages."""
+        dev_field_names = [field_name for field_name in field_names if field_name.startswith('dev_')]
+        described = [field_name for field_name in dev_field_names if field_name[4:] in fit_file.dev_fields]
+        if dev_field_names and not described:
+            # Dev fields that shadow a native field are named after the native field, keep probing for all names.
+            return field_names
+        return [field_name for field_name in field_names if field_name in described or field_name not in dev_field_names]
+
+    @classmethod
+    def _getter(cls, field_names):
+        if not field_names:
+            return _no_field
+        if len(field_names) == 1:
+            return operator.methodcaller('get', field_names[0])
+        return _probe_getter(field_names)
+
+    def compile(self, fit_file):
+        """Return a FieldExtractor for the messages of fit_file."""
+        getters = []
+        for column, spec in self.fields.items():
+            field_names = self._resolve(fit_file, spec['fields'])
+            logger.debug("%s: column %s read from %r", fit_file.filename, column, field_names)
+            getter = self._getter(field_names)
+            if 'convert' in spec:
+                getter = _convert_getter(getter, spec['convert'])
+            getters.append(getter)
+        return FieldExtractor(self.columns, tuple(getters))
@@ -0,0 +1,168 @@
+"""Heart rate variability metrics computed with NumPy from beat to beat intervals."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import numpy as np
+
+
+def intervals_array(values):
+    """Return a float array of beat to beat intervals in ms with missing (None or zero) intervals as NaN."""
+    intervals = np.array(values, dtype=float)
+    intervals[~(intervals > 0)] = np.nan
+    return intervals
+
+
+def seconds_array(timestamps):
+    """Return a float array of the seconds from the first timestamp to each timestamp."""
+    times = np.array(timestamps, dtype='datetime64[ms]')
+    return (times - times[0]) / np.timedelta64(1, 's')
+
+
+def time_domain(intervals):
+    """
+    Return the time domain HRV metrics of a series of beat to beat intervals.
+
+    Parameters:
+    ----------
+        intervals (ndarray): beat to beat intervals in ms, NaN for missing intervals
+
+    Returns a dict of the number of beats, RMSSD and SDRR in ms, and pNN50 and pNN20 in %. Successive differences are only taken
+    between adjacent intervals that are both present. Metrics that need more intervals than there are are None.
+    """
+    valid = intervals[~np.isnan(intervals)]
+    differences = np.diff(intervals)
+    differences = np.abs(differences[~np.isnan(differences)])
+    metrics = {'beats': len(valid), 'rmssd': None, 'sdrr': None, 'pnn50': None, 'pnn20': None}
+    if len(valid) > 1:
+        metrics['sdrr'] = float(np.std(valid, ddof=1))
+    if len(differences):
+        metrics['rmssd'] = float(np.sqrt(np.mean(differences * differences)))
+        metrics['pnn50'] = float(np.count_nonzero(differences > 50) * 100.0 / len(differences))
+        metrics['pnn20'] = float(np.count_nonzero(differences > 20) * 100.0 / len(differences))
+    return metrics
+
+
+def _prefix_sum(values):
+    return np.concatenate(([0], np.cumsum(values)))
+
+
+def windowed_time_domain(seconds, intervals, window=300, step=None):
+    """
+    Return the time domain HRV metrics of each window of a series of beat to beat intervals.
+
+    Parameters:
+    ----------
+        seconds (ndarray): the time of each interval in seconds, ascending
+        intervals (ndarray): beat to beat intervals in ms, NaN for missing intervals
+        window (float): the window length in seconds
+        step (float): the seconds between window starts, defaults to the window length
+
+    All windows are computed at once from prefix sums, so the cost is linear in the number of intervals whatever the window
+    overlap. Returns a dict of arrays: the window start seconds, the number of beats, RMSSD, SDRR, pNN50, and pNN20, with NaN for
+    metrics a window doesn't have enough intervals for. Windows without intervals are left out.
+    """
+    step = step or window
+    starts = np.arange(seconds[0], seconds[-1] + 1, step, dtype=float)
+    first = np.searchsorted(seconds, starts, 'left')
+    end = np.searchsorted(seconds, starts + window, 'left')
+
+    valid = ~np.isnan(intervals)
+    values = np.where(valid, intervals, 0.0)
+    beats = _prefix_sum(valid)
+    total = _prefix_sum(values)
+    total_squares = _prefix_sum(values * values)
+
+    # Difference i is between intervals i and i + 1, a window holds the differences of its intervals first to end - 1.
+    differences = np.diff(intervals)
+    differences_valid = ~np.isnan(differences)
+    differences = np.abs(np.where(differences_valid, differences, 0.0))
+    difference_counts = _prefix_sum(differences_valid)
+    difference_squares = _prefix_sum(differences * differences)
+    nn50 = _prefix_sum(differences > 50)
+    nn20 = _prefix_sum(differences > 20)
+    difference_end = np.maximum(end - 1, first)
+
+    n = beats[end] - beats[first]
+    keep = n > 0
+    n, first, end, difference_end, starts = n[keep], first[keep], end[keep], difference_end[keep], starts[keep]
+    n_differences = difference_counts[difference_end] - difference_counts[first]
+    window_total = total[end] - total[first]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance = (total_squares[end] - total_squares[first] - window_total * window_total / n) / (n - 1)
+        rmssd = np.sqrt((difference_squares[difference_end] - difference_squares[first]) / n_differences)
+        pnn50 = (nn50[difference_end] - nn50[first]) * 100.0 / n_differences
+        pnn20 = (nn20[difference_end] - nn20[first]) * 100.0 / n_differences
+    sdrr = np.sqrt(np.maximum(variance, 0.0))
+    sdrr[n < 2] = np.nan
+    return {'start': starts, 'beats': n, 'rmssd': rmssd, 'sdrr': sdrr, 'pnn50': pnn50, 'pnn20': pnn20}
+
+
+# Frequency bands in Hz.
+lf_band = (0.04, 0.15)
+hf_band = (0.15, 0.4)
+# The rate the intervals are resampled at before the FFT.
+resample_hz = 4.0
+
+
+def _band_power(frequencies, power, band):
+    in_band = (frequencies >= band[0]) & (frequencies < band[1])
+    return power[..., in_band].sum(axis=-1) * (frequencies[1] - frequencies[0])
+
+
+def _spectra_band_powers(segments, hz):
+    """Return the LF and HF power of each row of a 2D array of evenly sampled intervals, each row linearly detrended and Hann windowed."""
+    samples = segments.shape[-1]
+    x = np.arange(samples) - (samples - 1) / 2.0
+    slope = (segments * x).sum(axis=-1, keepdims=True) / (x * x).sum()
+    detrended = segments - segments.mean(axis=-1, keepdims=True) - slope * x
+    taper = np.hanning(samples)
+    spectrum = np.fft.rfft(detrended * taper, axis=-1)
+    # One sided power spectral density in ms^2/Hz.
+    power = 2.0 * np.abs(spectrum) ** 2 / (hz * (taper * taper).sum())
+    frequencies = np.fft.rfftfreq(samples, 1.0 / hz)
+    return _band_power(frequencies, power, lf_band), _band_power(frequencies, power, hf_band)
+
+
+def windowed_frequency_domain(seconds, intervals, window=300, min_beats_per_second=0.5):
+    """
+    Return the frequency domain HRV metrics of each window of a series of beat to beat intervals.
+
+    Parameters:
+    ----------
+        seconds (ndarray): the time of each interval in seconds, ascending
+        intervals (ndarray): beat to beat intervals in ms, NaN for missing intervals
+        window (float): the window length in seconds, windows start at seconds[0] and don't overlap
+        min_beats_per_second (float): windows with fewer intervals than this are left out
+
+    The unevenly spaced intervals are linearly resampled at resample_hz, and all windows are transformed with one batched FFT. Returns
+    a dict of arrays: the window start seconds, the number of beats, LF power and HF power in ms^2, and the LF/HF ratio. Only whole
+    windows are included.
+    """
+    valid = ~np.isnan(intervals)
+    times = seconds[valid]
+    values = intervals[valid]
+    samples = int(window * resample_hz)
+    count = int((seconds[-1] - seconds[0]) // window) if len(times) > 1 else 0
+    empty = np.empty(0)
+    if count == 0:
+        return {'start': empty, 'beats': empty, 'lf': empty, 'hf': empty, 'lf_hf': empty}
+    grid = seconds[0] + np.arange(count * samples) / resample_hz
+    segments = np.interp(grid, times, values).reshape(count, samples)
+    starts = seconds[0] + np.arange(count) * window
+    beats = np.diff(np.searchsorted(times, np.append(starts, starts[-1] + window), 'left'))
+    keep = beats >= window * min_beats_per_second
+    lf, hf = _spectra_band_powers(segments[keep], resample_hz)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lf_hf = lf / hf
+    return {'start': starts[keep], 'beats': beats[keep], 'lf': lf, 'hf': hf, 'lf_hf': lf_hf}
+
+
+def frequency_domain(windows):
+    """Return the LF and HF power of a whole recording, the mean of its window powers as returned by windowed_frequency_domain, and LF/HF."""
+    if len(windows['lf']) == 0:
+        return {'windows': 0, 'lf': None, 'hf': None, 'lf_hf': None}
+    lf = float(np.mean(windows['lf']))
+    hf = float(np.mean(windows['hf']))
+    return {'windows': len(windows['lf']), 'lf': lf, 'hf': hf, 'lf_hf': lf / hf if hf > 0 else None}
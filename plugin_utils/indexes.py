@@ -0,0 +1,44 @@
+"""Secondary indexes declared by plugins for their tables."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+
+from sqlalchemy import text, inspect
+
+
+logger = logging.getLogger(__file__)
+
+
+def index_prefix(table_name):
+    """Return the prefix of the names of the declared indexes of a table."""
+    return f'{table_name}_ix_'
+
+
+def sync_indexes(connection, table_name, indexes):
+    """
+    Make the indexes on a table match the declared indexes.
+
+    Parameters:
+    ----------
+        connection (Connection): a connection to the database that holds the table
+        table_name (string): the name of the table
+        indexes (dict): index name to the list of indexed columns, the first columns are the index key, later ones make it covering
+
+    Declared indexes that are missing or whose columns changed are (re)created and indexes with the declared name prefix that are no
+    longer declared are dropped, so changing the declaration is all that is needed to version the indexes of a table.
+    """
+    prefix = index_prefix(table_name)
+    existing = {index['name']: index['column_names'] for index in inspect(connection).get_indexes(table_name) if index['name'].startswith(prefix)}
+    declared = {prefix + name: list(columns) for name, columns in indexes.items()}
+    drop_suffix = f' ON {table_name}' if connection.dialect.name == 'mysql' else ''
+    for name, columns in existing.items():
+        if declared.get(name) != columns:
+            logger.info("Dropping index %s %r from %s", name, columns, table_name)
+            connection.execute(text(f'DROP INDEX {name}{drop_suffix}'))
+    for name, columns in declared.items():
+        if existing.get(name) != columns:
+            logger.info("Creating index %s %r on %s", name, columns, table_name)
+            connection.execute(text(f'CREATE INDEX {name} ON {table_name} ({", ".join(columns)})'))
@@ -0,0 +1,28 @@
+"""Conversion of FIT file UTC timestamps to local time."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+
+def local_time_converter(fit_file):
+    """
+    Return a function that converts UTC datetimes from fit_file to local time.
+
+    The result matches fit_file.utc_datetime_to_local. The FIT file has a single UTC offset, so the offset is looked up once and applied
+    with datetime arithmetic instead of a timezone conversion per timestamp. Files with a timezone whose offset changes, like a DST
+    zone, are converted with fit_file.utc_datetime_to_local.
+    """
+    local_tz = getattr(fit_file, 'local_tz', None)
+    if not isinstance(local_tz, datetime.timezone):
+        return fit_file.utc_datetime_to_local
+    offset = local_tz.utcoffset(None)
+    utc = datetime.timezone.utc
+
+    def utc_datetime_to_local(dt):
+        if dt.tzinfo is utc:
+            return dt.replace(tzinfo=None) + offset
+        return dt.replace(tzinfo=None)
+    return utc_datetime_to_local
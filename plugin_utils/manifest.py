@@ -0,0 +1,116 @@
+"""A static manifest of the plugins in a directory for matching FIT files without importing every plugin."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import re
+import ast
+import json
+import importlib
+import logging
+
+
+logger = logging.getLogger(__file__)
+
+
+manifest_filename = 'plugins_manifest.json'
+manifest_version = 1
+
+
+def _literal_application_id(node):
+    """Return the bytes of an `_application_id = bytearray(b'...')` class member or None."""
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'bytearray' and len(node.args) == 1:
+        try:
+            return bytes(ast.literal_eval(node.args[0]))
+        except ValueError:
+            return None
+
+
+def _plugin_entry(plugin_dir, filename):
+    """Return the manifest entry for a plugin file found by parsing, not importing, it."""
+    module_name = filename[:-3]
+    class_name = re.match(r"(\S+)_plugin\.py$", filename).group(1)
+    with open(os.path.join(plugin_dir, filename), encoding='utf-8') as file:
+        tree = ast.parse(file.read(), filename)
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == class_name:
+            entry = {'module': module_name, 'class': class_name, 'application_id': None}
+            for member in node.body:
+                if isinstance(member, ast.Assign) and any(isinstance(target, ast.Name) and target.id == '_application_id' for target in member.targets):
+                    application_id = _literal_application_id(member.value)
+                    if application_id is not None:
+                        entry['application_id'] = application_id.hex()
+            return entry
+    logger.warning("Plugin file %s has no class %s", filename, class_name)
+
+
+def build_manifest(plugin_dir):
+    """Return a manifest dict for the *_plugin.py files in plugin_dir."""
+    plugins = []
+    for filename in sorted(os.listdir(plugin_dir)):
+        if re.match(r"(\S+)_plugin\.py$", filename):
+            entry = _plugin_entry(plugin_dir, filename)
+            if entry:
+                plugins.append(entry)
+    return {'version': manifest_version, 'plugins': plugins}
+
+
+def write_manifest(plugin_dir, output_dir=None):
+    """Write the manifest for the plugins in plugin_dir to output_dir and return its path."""
+    path = os.path.join(output_dir or plugin_dir, manifest_filename)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(build_manifest(plugin_dir), file, indent=4)
+        file.write('\n')
+    return path
+
+
+class PluginManifest():
+    """Matches FIT files to plugins by application id with a dict lookup and imports plugins only when they match."""
+
+    def __init__(self, manifest):
+        """Return a PluginManifest for a manifest dict."""
+        if manifest.get('version') != manifest_version:
+            raise ValueError(f"Unsupported plugin manifest version {manifest.get('version')}")
+        self.plugins = manifest['plugins']
+        self.by_application_id = {}
+        # Plugins that match on sport or dev fields are always candidates.
+        self.unkeyed = []
+        for entry in self.plugins:
+            if entry['application_id']:
+                self.by_application_id.setdefault(bytes.fromhex(entry['application_id']), []).append(entry)
+            else:
+                self.unkeyed.append(entry)
+
+    @classmethod
+    def load(cls, plugin_dir):
+        """Return the PluginManifest published in plugin_dir or None if there isn't one."""
+        path = os.path.join(plugin_dir, manifest_filename)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as file:
+            return cls(json.load(file))
+
+    def candidates(self, plugin_names, fit_file):
+        """Return the plugin_names that could match fit_file, plugins the manifest doesn't list are always candidates."""
+        listed = {entry['class'] for entry in self.plugins}
+        matching = {entry['class'] for entry in self.entries_for_file(fit_file)}
+        return [name for name in plugin_names if name in matching or name not in listed]
+
+    def entries_for_application_ids(self, application_ids):
+        """Return the manifest entries of the plugins that could match a file with the given dev_data_id application ids."""
+        entries = list(self.unkeyed)
+        for application_id in application_ids:
+            if application_id is not None:
+                entries.extend(self.by_application_id.get(bytes(application_id), []))
+        return entries
+
+    def entries_for_file(self, fit_file):
+        """Return the manifest entries of the plugins that could match fit_file."""
+        return self.entries_for_application_ids(fit_file.dev_application_ids)
+
+    @classmethod
+    def import_plugin_class(cls, entry):
+        """Import the plugin module of a manifest entry and return the plugin class."""
+        return getattr(importlib.import_module(entry['module']), entry['class'])
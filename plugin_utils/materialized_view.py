@@ -0,0 +1,125 @@
+"""Activity views backed by tables that are updated incrementally."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+
+from sqlalchemy import text, inspect
+from sqlalchemy.orm import Query
+
+
+logger = logging.getLogger(__file__)
+
+
+class MaterializedView():
+    """
+    A plugin activity view whose rows are stored in a table indexed on activity_id and start_time.
+
+    The table holds the rows of the join view the plugin would otherwise create, and the view becomes a plain select from the table,
+    so queries don't re-join the activities table. Triggers on the sessions and activities tables rebuild an activity's row whenever
+    either of its rows is inserted, updated, or deleted, so the table stays current through imports, later Garmin Connect updates of
+    activities, and reprocessing, without scanning the tables when the database is opened. The table is filled when it or its
+    triggers are created. The triggers are SQLite's, on other databases the plain join view is created instead.
+    """
+
+    views = {}
+
+    def __init__(self, view_name, sessions_table, selectable):
+        """
+        Return a MaterializedView instance.
+
+        Parameters:
+        ----------
+            view_name (string): the name of the activity view
+            sessions_table (DbObject): the plugin sessions table, joined to its activities_table
+            selectable (list): the view's columns, all labeled, including activity_id and start_time
+
+        """
+        self.view_name = view_name
+        self.table_name = view_name + '_table'
+        self.sessions_table = sessions_table
+        self.selectable = selectable
+
+    def _source_query(self, session):
+        return str(Query(self.selectable, session=session).join(self.sessions_table.activities_table))
+
+    def _insert_missing(self, session):
+        session.execute(text(f'INSERT INTO {self.table_name} SELECT * FROM ({self._source_query(session)}) AS source '
+                             f'WHERE source.activity_id NOT IN (SELECT activity_id FROM {self.table_name})'))
+
+    def _triggers(self, session):
+        """Return trigger name to the SQL that creates it, for the triggers that keep the table's rows current."""
+        source = self._source_query(session)
+
+        def refresh(row):
+            return (f'DELETE FROM {self.table_name} WHERE activity_id = {row}.activity_id; '
+                    f'INSERT INTO {self.table_name} SELECT * FROM ({source}) AS source WHERE source.activity_id = {row}.activity_id;')
+        delete = f'DELETE FROM {self.table_name} WHERE activity_id = OLD.activity_id;'
+        bodies = {'insert': refresh('NEW'), 'update': delete + ' ' + refresh('NEW'), 'delete': delete}
+        triggers = {}
+        for source_table in (self.sessions_table.__tablename__, self.sessions_table.activities_table.__tablename__):
+            for event, body in bodies.items():
+                name = f'{self.table_name}_{source_table}_{event}'
+                triggers[name] = f'CREATE TRIGGER {name} AFTER {event.upper()} ON {source_table} BEGIN {body} END'
+        return triggers
+
+    def _sync_triggers(self, session):
+        """Create the triggers that are missing or changed and return True if any were."""
+        result = session.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN (:sessions, :activities)"),
+                                 {'sessions': self.sessions_table.__tablename__, 'activities': self.sessions_table.activities_table.__tablename__})
+        existing = {name: sql for name, sql in result}
+        changed = False
+        for name, sql in self._triggers(session).items():
+            if existing.get(name) != sql:
+                logger.info("Creating trigger %s for materialized view %s", name, self.view_name)
+                session.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+                session.execute(text(sql))
+                changed = True
+        return changed
+
+    def create(self, db):
+        """Create the table, the view over it, and the triggers that keep it current if needed, and fill the table if any were created."""
+        if db.engine.dialect.name != 'sqlite':
+            logger.warning("Materialized view %s needs a SQLite database, creating a join view on %s instead", self.view_name, db.engine.dialect.name)
+            activities_table = self.sessions_table.activities_table
+            self.sessions_table.create_join_view(db, self.view_name, self.selectable, activities_table, order_by=activities_table.start_time.desc())
+            return
+        with db.managed_session() as session:
+            inspector = inspect(session.bind)
+            if not inspector.has_table(self.table_name):
+                logger.info("Creating table %s for materialized view %s", self.table_name, self.view_name)
+                session.execute(text(f'CREATE TABLE {self.table_name} AS SELECT * FROM ({self._source_query(session)}) AS source WHERE 1 = 0'))
+                session.execute(text(f'CREATE UNIQUE INDEX {self.table_name}_activity_id ON {self.table_name} (activity_id)'))
+                session.execute(text(f'CREATE INDEX {self.table_name}_start_time ON {self.table_name} (start_time)'))
+            view_definition = inspector.get_view_definition(self.view_name) if self.view_name in inspector.get_view_names() else None
+            if view_definition is None or self.table_name not in view_definition:
+                logger.info("Creating view %s of table %s", self.view_name, self.table_name)
+                session.execute(text(f'DROP VIEW IF EXISTS {self.view_name}'))
+                session.execute(text(f'CREATE VIEW {self.view_name} AS SELECT * FROM {self.table_name} ORDER BY start_time DESC'))
+            if self._sync_triggers(session):
+                # Rows may have changed while the triggers were missing or different.
+                session.execute(text(f'DELETE FROM {self.table_name}'))
+                self._insert_missing(session)
+        self.views[self.view_name] = self
+
+    def refresh(self, db, activity_ids=None):
+        """
+        Rebuild the rows for activity_ids, or all rows if activity_ids is None, from the activities and sessions tables.
+
+        The triggers keep the rows current, this is only needed after the tables were changed while the triggers were missing.
+        """
+        with db.managed_session() as session:
+            if activity_ids is None:
+                session.execute(text(f'DELETE FROM {self.table_name}'))
+            else:
+                for activity_id in activity_ids:
+                    session.execute(text(f'DELETE FROM {self.table_name} WHERE activity_id = :activity_id'), {'activity_id': activity_id})
+            self._insert_missing(session)
+
+    @classmethod
+    def refresh_all(cls, db):
+        """Rebuild all materialized views created in this process."""
+        for view in cls.views.values():
+            view.refresh(db)
@@ -0,0 +1,261 @@
+"""Import the plugin tables of many activity FIT files with a pool of worker processes."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import logging
+import tempfile
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+
+import fitfile
+from idbutils import DbParams
+from garmindb import PluginManager
+from garmindb.garmindb import ActivitiesDb, Activities, File
+
+from .indexes import sync_indexes
+from .manifest import PluginManifest
+from .background_writer import BackgroundWriter
+from .record_cache import invalidate_records
+
+
+logger = logging.getLogger(__file__)
+
+
+# The plugin handler the GarminDb activity importer calls after a session entry, by sport or, for fitness equipment, by sub sport.
+sport_handlers = {
+    'running'                   : 'write_steps_entry',
+    'walking'                   : 'write_steps_entry',
+    'hiking'                    : 'write_steps_entry',
+    'cycling'                   : 'write_cycle_entry',
+    'rock_climbing'             : 'write_rock_climbing_entry',
+    'stand_up_paddleboarding'   : 'write_paddle_entry',
+    'rowing'                    : 'write_paddle_entry',
+}
+
+
+def load_activity_plugins(plugin_dir, db_params):
+    """Return the activity FIT file plugins in plugin_dir with their tables initialized."""
+    plugins = PluginManager(plugin_dir, db_params).plugins.get('ActivityFit', {})
+    for plugin in plugins.values():
+        plugin.init_activity(ActivitiesDb, Activities)
+    return plugins
+
+
+def imported_activity_ids(plugin, activity_db_session):
+    """Return the set of ids of the activities the plugin already has rows for."""
+    table = plugin._tables.get('session', plugin._tables.get('record'))
+    if table is None:
+        return frozenset()
+    return frozenset(row[0] for row in activity_db_session.query(table.activity_id).distinct())
+
+
+class PluginImporter():
+    """
+    Sends the messages of activity FIT files to the matching plugins the way the GarminDb activity importer does.
+
+    Only the plugins' tables are written, the GarminDb tables are left to the GarminDb import.
+    """
+
+    def __init__(self, plugins, db_params, imported=None, measurement_system=fitfile.field_enums.DisplayMeasure.metric, background_writes=False,
+                 manifest=None):
+        """
+        Return a PluginImporter instance.
+
+        Parameters:
+        ----------
+            plugins (dict): plugin name to plugin instance, with tables initialized
+            db_params (DbParams): the activities database to write to
+            imported (dict): plugin name to the set of ids of activities the plugin is skipped for
+            measurement_system (DisplayMeasure): the units to parse the FIT files with
+            background_writes (bool): write the plugins' records from a writer thread while the next messages are parsed
+            manifest (PluginManifest): only plugins the manifest lists for a file's application ids are asked if they match it
+
+        """
+        self.plugins = plugins
+        self.manifest = manifest
+        self.imported = imported or {}
+        self.measurement_system = measurement_system
+        # All plugin tables are registered, so one database instance serves every file.
+        self.act_db = ActivitiesDb(db_params)
+        self.background_writer = BackgroundWriter(self.act_db.engine) if background_writes else None
+        for plugin in plugins.values():
+            plugin.background_writer = self.background_writer
+
+    def _dispatch(self, plugins, handler_name, *args):
+        for plugin in plugins:
+            function = getattr(plugin, handler_name, None)
+            if function:
+                function(*args)
+
+    def _write_session(self, plugins, activity_db_session, fit_file, activity_id, message_fields):
+        self._dispatch(plugins, 'write_session_entry', activity_db_session, fit_file, activity_id, message_fields)
+        sport = message_fields.get('sport')
+        sub_sport = message_fields.get('sub_sport')
+        if sport is not None:
+            sport_name = sub_sport.name if sport.name == 'fitness_equipment' and sub_sport is not None else sport.name
+            handler_name = sport_handlers.get(sport_name)
+            if handler_name:
+                self._dispatch(plugins, handler_name, activity_db_session, fit_file, activity_id, sub_sport, message_fields)
+
+    def import_file(self, filename):
+        """Write the plugin data from a FIT file and return the names of the plugins that matched."""
+        fit_file = fitfile.File(filename, self.measurement_system)
+        activity_id = File.id_from_path(filename)
+        candidates = self.plugins if self.manifest is None else self.manifest.candidates(self.plugins, fit_file)
+        names = [name for name in candidates if activity_id not in self.imported.get(name, ()) and self.plugins[name].matches_activity_file(fit_file)]
+        if not names:
+            return names
+        plugins = [self.plugins[name] for name in names]
+        completed = False
+        try:
+            with self.act_db.managed_session() as activity_db_session:
+                for message_type in fit_file.message_types:
+                    messages = fit_file[message_type]
+                    if message_type is fitfile.MessageType.record:
+                        for record_num, message in enumerate(messages):
+                            self._dispatch(plugins, 'write_record_entry', activity_db_session, fit_file, activity_id, message.fields, record_num)
+                    elif message_type is fitfile.MessageType.lap:
+                        for lap_num, message in enumerate(messages):
+                            self._dispatch(plugins, 'write_lap_entry', activity_db_session, fit_file, activity_id, message.fields, lap_num)
+                    elif message_type is fitfile.MessageType.session:
+                        for message in messages:
+                            self._write_session(plugins, activity_db_session, fit_file, activity_id, message.fields)
+            completed = True
+        finally:
+            if not completed:
+                # Nothing of the file was committed, the rows the plugins queued for it must not be written with the next file.
+                self._dispatch(plugins, '_discard_records')
+        return names
+
+    def close(self):
+        """Stop the background writer, if there is one, after it committed the queued rows."""
+        if self.background_writer is not None:
+            self.background_writer.close()
+
+
+def merge_table(table, staging_session, activity_db_session, chunk_size=10000):
+    """
+    Insert the rows of a plugin table in a staging database that the activities database doesn't have.
+
+    Rows are compared on the table's primary key, one activity at a time, so (activity_id, record) stays unique when several
+    stores hold the same activity. Returns a tuple of the number of rows inserted and skipped. Tables whose primary key doesn't
+    include activity_id are computed across activities, their rows collide between stores and they are rebuilt instead, see
+    _derived_table_keys.
+    """
+    pk = [column.name for column in table.__table__.primary_key.columns]
+    if 'activity_id' not in pk:
+        raise ValueError(f'{table.__tablename__} is not keyed by activity, rebuild it instead of merging it')
+    pk_columns = [getattr(table, name) for name in pk]
+    inserted = skipped = 0
+    for (activity_id,) in staging_session.query(table.activity_id).distinct().all():
+        existing = frozenset(tuple(row) for row in activity_db_session.query(*pk_columns).filter(table.activity_id == activity_id))
+        rows = []
+        for row in staging_session.query(table.__table__).filter(table.activity_id == activity_id):
+            if tuple(getattr(row, name) for name in pk) in existing:
+                skipped += 1
+            else:
+                rows.append(dict(row._mapping))
+        for start in range(0, len(rows), chunk_size):
+            activity_db_session.execute(table.__table__.insert(), rows[start:start + chunk_size])
+        if rows:
+            invalidate_records(table.__tablename__, [activity_id])
+        inserted += len(rows)
+    return (inserted, skipped)
+
+
+def merge_staging(act_db, staging_db_params, tables):
+    """Merge the plugin tables of a staging activities database into act_db and return table name to (inserted, skipped) counts."""
+    staging_db = ActivitiesDb(staging_db_params)
+    results = {}
+    with staging_db.managed_session() as staging_session, act_db.managed_session() as activity_db_session:
+        for table in tables:
+            results[table.__tablename__] = merge_table(table, staging_session, activity_db_session)
+    staging_db.engine.dispose()
+    return results
+
+
+_worker_importer = None
+
+
+def _close_at_exit(importer):
+    """Close a worker process's importer when the process exits, so its background writer commits before the staging database is merged."""
+    Finalize(importer, importer.close, exitpriority=10)
+
+
+def _init_worker(plugin_dir, staging_dir, imported, measurement_system, background_writes):
+    """Give the worker process its own plugin instances and its own staging database."""
+    global _worker_importer
+    db_params = DbParams(db_type='sqlite', db_path=tempfile.mkdtemp(prefix='worker_', dir=staging_dir))
+    _worker_importer = PluginImporter(load_activity_plugins(plugin_dir, db_params), db_params, imported, measurement_system, background_writes,
+                                      PluginManifest.load(plugin_dir))
+    _close_at_exit(_worker_importer)
+
+
+def _import_file(filename):
+    try:
+        return (filename, _worker_importer.import_file(filename), None)
+    except Exception as e:
+        logger.error("Failed to import plugin data from %s: %s", filename, e)
+        return (filename, [], str(e))
+
+
+def parallel_import(db_params, plugin_dir, filenames, workers=None, staging_dir=None, measurement_system=fitfile.field_enums.DisplayMeasure.metric,
+                    background_writes=False):
+    """
+    Import the plugin data of activity FIT files in parallel and merge it into the activities database.
+
+    Parameters:
+    ----------
+        db_params (DbParams): the activities database, must be SQLite
+        plugin_dir (string): the directory to load the plugins from
+        filenames (list): the FIT files to import
+        workers (int): the number of worker processes, defaults to the number of CPUs
+        staging_dir (string): where the workers' staging databases are created, defaults to the system temp directory
+        measurement_system (DisplayMeasure): the units to parse the FIT files with
+        background_writes (bool): have each worker write records from a writer thread while it parses, see BackgroundWriter
+
+    Each worker process parses files and writes the plugin rows into its own SQLite staging database, so plugin instances, their
+    class level tables, and database sessions are never shared between processes. Activities the plugins already have rows for are
+    skipped. The plugin manifest in plugin_dir, if there is one, narrows the plugins asked to match each file. Once all files are parsed the staging databases are merged into the activities database one at a time. A later GarminDb
+    import of the same files skips the plugin writes for the merged activities. SQLite doesn't enforce the plugin tables' foreign keys,
+    so the plugin rows can be merged before GarminDb imports the activities. Tables computed across activities, like the session
+    rollups, are rebuilt after the merge.
+
+    Returns a dict with the files imported, the files that failed with their errors, and the per table merge counts.
+    """
+    if db_params.db_type != 'sqlite':
+        raise ValueError(f'Parallel plugin import needs a SQLite activities database, not {db_params.db_type}')
+    plugins = load_activity_plugins(plugin_dir, db_params)
+    act_db = ActivitiesDb(db_params)
+    # Tables computed across activities, like rollups, have rows with the same keys in different workers, they are rebuilt instead.
+    derived = {name: plugin._derived_table_keys() if hasattr(plugin, '_derived_table_keys') else [] for name, plugin in plugins.items()}
+    tables = [table for name, plugin in plugins.items() for key, table in plugin._tables.items() if key not in derived[name]]
+    with act_db.managed_session() as activity_db_session:
+        imported = {name: imported_activity_ids(plugin, activity_db_session) for name, plugin in plugins.items()}
+        for plugin in plugins.values():
+            if 'record' in plugin._tables:
+                sync_indexes(activity_db_session.connection(), plugin._tables['record'].__tablename__, getattr(plugin, '_records_indexes', {}))
+    results = {'imported': {}, 'failed': {}, 'tables': {table.__tablename__: [0, 0] for table in tables}}
+    with tempfile.TemporaryDirectory(prefix='plugin_staging_', dir=staging_dir) as staging_root:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(plugin_dir, staging_root, imported, measurement_system, background_writes)) as executor:
+            for filename, names, error in executor.map(_import_file, filenames, chunksize=4):
+                if error:
+                    results['failed'][filename] = error
+                elif names:
+                    results['imported'][filename] = names
+        for worker_dir in sorted(os.listdir(staging_root)):
+            logger.info("Merging plugin data from %s", worker_dir)
+            staging_db_params = DbParams(db_type='sqlite', db_path=os.path.join(staging_root, worker_dir))
+            for table_name, counts in merge_staging(act_db, staging_db_params, tables).items():
+                results['tables'][table_name][0] += counts[0]
+                results['tables'][table_name][1] += counts[1]
+    if results['imported']:
+        with act_db.managed_session() as activity_db_session:
+            for name, plugin in plugins.items():
+                if derived[name]:
+                    plugin.rebuild_derived_tables(activity_db_session)
+    logger.info("Imported plugin data from %d files, %d failed: %r", len(results['imported']), len(results['failed']), results['tables'])
+    return results
@@ -0,0 +1,257 @@
+"""Export plugin records and sessions tables to Parquet datasets partitioned by date or activity, streaming rows in chunks."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import json
+import shutil
+import logging
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, Boolean, Integer, Float, DateTime, Date, Time, LargeBinary
+
+from garmindb.garmindb import ActivitiesDb
+
+from .columnar import column_encoding
+from .record_arrays import read_record_arrays
+from .parallel_import import load_activity_plugins
+
+
+logger = logging.getLogger(__file__)
+
+
+state_filename = '_export_state.json'
+state_version = 1
+partitions = ('date', 'activity')
+# The partition directory of rows without a timestamp, the name Hive and Arrow use for null partition values.
+null_partition = '__HIVE_DEFAULT_PARTITION__'
+
+
+def arrow_type(column_type):
+    """Return the Arrow type that a SQLAlchemy column type is exported as."""
+    for sql_type, pa_type in ((Boolean, pa.bool_()), (Integer, pa.int64()), (Float, pa.float64()), (DateTime, pa.timestamp('ms')),
+                              (Date, pa.date32()), (Time, pa.time64('us')), (LargeBinary, pa.binary())):
+        if isinstance(column_type, sql_type):
+            return pa_type
+    return pa.string()
+
+
+def arrow_schema(table):
+    """Return the Arrow schema of a plugin table, with the tables's column types and order."""
+    return pa.schema([(column.name, arrow_type(column.type)) for column in table.__table__.columns])
+
+
+def _arrow_array(values, pa_type, encoding):
+    """Return an Arrow array of a column read by read_record_arrays, with the type the records table column is exported as."""
+    if values.dtype.kind == 'M':
+        mask = np.isnat(values)
+    elif values.dtype.kind == 'f':
+        mask = np.isnan(values)
+    else:
+        mask = None
+    if encoding == 'time':
+        # Columnar time columns are milliseconds since midnight.
+        return pa.array(np.nan_to_num(values * 1000).astype(np.int64), type=pa_type, mask=mask)
+    return pa.array(values, mask=mask).cast(pa_type)
+
+
+def _partition_key(partition, activity_id, timestamp):
+    # The partition is named activity, not activity_id, so the files keep their activity_id column and a Hive partitioned read of
+    # the directory doesn't have two activity_id columns.
+    if partition == 'activity':
+        return f'activity={activity_id}'
+    return f'date={timestamp.date().isoformat()}' if timestamp is not None else f'date={null_partition}'
+
+
+class ParquetTableExport():
+    """
+    Exports a plugin table to a directory of Parquet files, one subdirectory per date or per activity.
+
+    Activities are exported in batches. Each batch's rows are read from the database in chunks and each chunk is split by partition
+    and appended to that partition's file of the batch, so memory stays bounded by the chunk size whatever the size of the table. Files
+    are named part-<export run>-<batch>.parquet, so an incremental export adds files next to the ones of earlier runs. The exported
+    activities and the files written are recorded in the directory's state file after each batch. Files that aren't in the state file
+    are left over from an export that was stopped and are deleted before the next export.
+    """
+
+    def __init__(self, table, output_dir, partition='date', chunk_size=50000, activities_table=None):
+        """
+        Return a ParquetTableExport instance.
+
+        Parameters:
+        ----------
+            table (DbObject): the plugin table, it must have activity_id and timestamp columns
+            output_dir (string): the directory the table's directory is created in
+            partition (string): 'date' to partition the rows by the date of their timestamp, 'activity' by activity_id
+            chunk_size (int): the number of rows read from the database and written at a time
+            activities_table (DbObject): the table the activities to export are listed from, defaults to table
+
+        """
+        if partition not in partitions:
+            raise ValueError(f'Unknown partition {partition}, expected one of {partitions}')
+        self.table = table
+        self.activities_table = table if activities_table is None else activities_table
+        self.partition = partition
+        self.chunk_size = chunk_size
+        self.schema = arrow_schema(table)
+        self.table_dir = os.path.join(output_dir, table.__tablename__)
+
+    def _state_path(self):
+        return os.path.join(self.table_dir, state_filename)
+
+    def _read_state(self):
+        if os.path.exists(self._state_path()):
+            with open(self._state_path(), encoding='utf-8') as file:
+                state = json.load(file)
+            if state.get('version') != state_version or state.get('partition') != self.partition:
+                raise ValueError(f'The export in {self.table_dir} has a different version or partition, run a full export instead')
+            return state
+        return {'version': state_version, 'partition': self.partition, 'runs': 0, 'activities': [], 'files': []}
+
+    def _write_state(self, state):
+        temp_path = self._state_path() + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(state, file)
+        os.replace(temp_path, self._state_path())
+
+    def _remove_unrecorded_files(self, state):
+        recorded = set(state['files'])
+        for directory, _, filenames in os.walk(self.table_dir):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(directory, filename), self.table_dir)
+                if filename.endswith('.parquet') and path not in recorded:
+                    logger.info("Removing %s left over from a stopped export", path)
+                    os.remove(os.path.join(self.table_dir, path))
+
+    def _row_batches(self, activity_db_session, activity_ids):
+        """Yield Arrow record batches of the table's rows of activity_ids, read from the cursor chunk_size rows at a time."""
+        columns = self.table.__table__.columns
+        statement = select(self.table.__table__).where(columns['activity_id'].in_(activity_ids))
+        pk = list(self.table.__table__.primary_key.columns)
+        result = activity_db_session.execute(statement.order_by(*pk).execution_options(yield_per=self.chunk_size))
+        for rows in result.partitions():
+            yield pa.RecordBatch.from_arrays([pa.array(values, type=field.type) for field, values in zip(self.schema, zip(*rows))], schema=self.schema)
+
+    def _write_batch(self, writers, batch_dir_files, batch, part_name):
+        activity_ids = batch.column('activity_id').to_pylist()
+        timestamps = batch.column('timestamp').to_pylist() if self.partition == 'date' else activity_ids
+        keys = [_partition_key(self.partition, activity_id, timestamp) for activity_id, timestamp in zip(activity_ids, timestamps)]
+        start = 0
+        for index in range(1, len(keys) + 1):
+            if index == len(keys) or keys[index] != keys[start]:
+                writer = writers.get(keys[start])
+                if writer is None:
+                    os.makedirs(os.path.join(self.table_dir, keys[start]), exist_ok=True)
+                    path = os.path.join(keys[start], part_name)
+                    writer = writers[keys[start]] = pq.ParquetWriter(os.path.join(self.table_dir, path), self.schema)
+                    batch_dir_files.append(path)
+                writer.write_batch(batch.slice(start, index - start))
+                start = index
+
+    def export(self, activity_db_session, record_batches=None, incremental=True, batch_size=100):
+        """
+        Export the table's activities that weren't exported yet, or all activities, and return the number of rows written.
+
+        Parameters:
+        ----------
+            activity_db_session (Session): a session on the activities database
+            record_batches (callable): called with the session and a list of activity ids, returns the Arrow record batches of their
+                rows, defaults to reading the table's rows
+            incremental (bool): only export the activities added since the last export, otherwise replace the table's directory
+            batch_size (int): the number of activities exported per batch, with one file per partition per batch
+
+        """
+        if not incremental and os.path.exists(self.table_dir):
+            shutil.rmtree(self.table_dir)
+        os.makedirs(self.table_dir, exist_ok=True)
+        state = self._read_state()
+        self._remove_unrecorded_files(state)
+        exported = set(state['activities'])
+        query = activity_db_session.query(self.activities_table.activity_id).distinct()
+        activity_ids = sorted(row[0] for row in query if row[0] not in exported)
+        record_batches = record_batches or self._row_batches
+        state['runs'] += 1
+        rows = 0
+        for batch_number, start in enumerate(range(0, len(activity_ids), batch_size)):
+            batch_ids = activity_ids[start:start + batch_size]
+            writers = {}
+            files = []
+            part_name = f'part-{state["runs"]:05d}-{batch_number:05d}.parquet'
+            try:
+                for batch in record_batches(activity_db_session, batch_ids):
+                    self._write_batch(writers, files, batch, part_name)
+                    rows += batch.num_rows
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            state['activities'].extend(batch_ids)
+            state['files'].extend(files)
+            self._write_state(state)
+        self._write_state(state)
+        logger.info("Exported %d rows of %d activities from %s to %s", rows, len(activity_ids), self.table.__tablename__, self.table_dir)
+        return rows
+
+
+def columnar_record_batches(plugin, schema):
+    """Return a record_batches callable for ParquetTableExport that reads a plugin's columnar records an activity at a time."""
+    record_columns = plugin._tables['record'].__table__.columns
+
+    def record_batches(activity_db_session, activity_ids):
+        for activity_id in activity_ids:
+            arrays = read_record_arrays(activity_db_session, plugin, activity_id)
+            count = len(arrays.get('record', []))
+            if count == 0:
+                continue
+            columns = []
+            for field in schema:
+                if field.name == 'activity_id':
+                    columns.append(pa.array([activity_id] * count, type=field.type))
+                else:
+                    columns.append(_arrow_array(arrays[field.name], field.type, column_encoding(field.name, record_columns[field.name].type)[0]))
+            yield pa.RecordBatch.from_arrays(columns, schema=schema)
+    return record_batches
+
+
+def export_plugin(act_db, plugin, output_dir, partition='date', incremental=True, batch_size=100, chunk_size=50000):
+    """
+    Export a plugin's records and sessions tables to Parquet and return table name to the number of rows written.
+
+    Parameters:
+    ----------
+        act_db (ActivitiesDb): the activities database
+        plugin (RecordWriterMixin): the plugin, with tables initialized
+        output_dir (string): the directory the tables' directories are created in
+        partition (string): 'date' or 'activity', see ParquetTableExport
+        incremental (bool): only export the activities added since the last export
+        batch_size (int): the number of activities exported per batch
+        chunk_size (int): the number of rows read from the database and written at a time
+
+    Columnar records are exported with the columns and types of the records table, as if they had been written to it.
+    """
+    results = {}
+    for key in ('record', 'session'):
+        table = plugin._tables.get(key)
+        if table is None:
+            continue
+        # The records table of a columnar plugin is empty, its activities are listed from the arrays table.
+        columns_table = plugin._tables.get('record_columns') if key == 'record' else None
+        table_export = ParquetTableExport(table, output_dir, partition, chunk_size, columns_table)
+        record_batches = columnar_record_batches(plugin, table_export.schema) if columns_table is not None else None
+        with act_db.managed_session() as activity_db_session:
+            results[table.__tablename__] = table_export.export(activity_db_session, record_batches, incremental, batch_size)
+    return results
+
+
+def export_plugins(db_params, plugin_dir, output_dir, partition='date', incremental=True, batch_size=100, chunk_size=50000):
+    """Export the records and sessions tables of every plugin in plugin_dir to Parquet, return table name to rows written."""
+    plugins = load_activity_plugins(plugin_dir, db_params)
+    act_db = ActivitiesDb(db_params)
+    results = {}
+    for plugin in plugins.values():
+        if hasattr(plugin, '_tables'):
+            results.update(export_plugin(act_db, plugin, output_dir, partition, incremental, batch_size, chunk_size))
+    return results
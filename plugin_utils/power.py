@@ -0,0 +1,85 @@
+"""Streaming power summaries: time in power zones, mean power, normalized power, and work."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+from collections import deque
+
+
+class PowerZoneAccumulator():
+    """
+    Accumulates a power summary one sample at a time.
+
+    Each sample counts for the time since the previous sample, capped at max_sample_seconds so pauses aren't counted. Normalized power
+    is the fourth root of the mean of the fourth power of the 30 sample rolling average, kept in a fixed size ring buffer.
+    """
+
+    def __init__(self, zone_limits, max_sample_seconds=5, rolling_samples=30):
+        """
+        Return a PowerZoneAccumulator instance.
+
+        Parameters:
+        ----------
+            zone_limits (list): ascending power in Watts where each zone above the first starts, n limits make n + 1 zones
+            max_sample_seconds (float): the most time a single sample counts for
+            rolling_samples (int): the number of samples in the normalized power rolling average
+
+        """
+        self.zone_limits = list(zone_limits)
+        self.max_sample_seconds = max_sample_seconds
+        self.zone_seconds = [0.0] * (len(self.zone_limits) + 1)
+        self.seconds = 0.0
+        self.work = 0.0
+        self.max_power = None
+        self._previous = None
+        self._rolling = deque(maxlen=rolling_samples)
+        self._rolling_sum = 0.0
+        self._fourth_powers = 0.0
+        self._rolling_count = 0
+
+    def _zone(self, power):
+        for zone, limit in enumerate(self.zone_limits):
+            if power < limit:
+                return zone
+        return len(self.zone_limits)
+
+    def add(self, timestamp, power):
+        """Add a power sample in Watts taken at timestamp, a datetime. Samples without power are skipped."""
+        if power is None:
+            return
+        seconds = 1.0 if self._previous is None else min((timestamp - self._previous).total_seconds(), self.max_sample_seconds)
+        self._previous = timestamp
+        self.seconds += seconds
+        self.work += power * seconds
+        self.zone_seconds[self._zone(power)] += seconds
+        if self.max_power is None or power > self.max_power:
+            self.max_power = power
+        if len(self._rolling) == self._rolling.maxlen:
+            self._rolling_sum -= self._rolling[0]
+        self._rolling.append(power)
+        self._rolling_sum += power
+        if len(self._rolling) == self._rolling.maxlen:
+            self._fourth_powers += (self._rolling_sum / self._rolling.maxlen) ** 4
+            self._rolling_count += 1
+
+    @property
+    def avg_power(self):
+        """Return the time weighted mean power in Watts."""
+        return self.work / self.seconds if self.seconds else None
+
+    @property
+    def normalized_power(self):
+        """Return the normalized power in Watts or None if there are fewer samples than the rolling average needs."""
+        return (self._fourth_powers / self._rolling_count) ** 0.25 if self._rolling_count else None
+
+    def summary(self):
+        """Return a dict of the mean, max, and normalized power in Watts, the work in kJ, and the seconds in each zone."""
+        summary = {
+            'avg_power'         : self.avg_power,
+            'max_power'         : self.max_power,
+            'normalized_power'  : self.normalized_power,
+            'work'              : self.work / 1000.0,
+        }
+        summary.update({f'zone_{zone + 1}_seconds': seconds for zone, seconds in enumerate(self.zone_seconds)})
+        return summary
@@ -0,0 +1,53 @@
+"""Mean maximal power curves computed with NumPy prefix sums."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import numpy as np
+
+
+# The durations in seconds the power curve is computed for, from 1 s to 5 hours.
+power_curve_durations = [1, 2, 3, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200, 1800, 2400, 3600, 5400, 7200, 10800,
+                         14400, 18000]
+
+
+def power_series(timestamps, power):
+    """
+    Return a 1 second power series from samples that may be irregular.
+
+    Parameters:
+    ----------
+        timestamps (ndarray): datetime64 sample times, ascending
+        power (ndarray): power in Watts, NaN for missing samples
+
+    Each sample is placed at its whole second after the first sample. Seconds without a sample, pauses and dropouts, are 0 W, so an
+    effort can't span a gap with more power than was produced.
+    """
+    seconds = ((timestamps - timestamps[0]) // np.timedelta64(1, 's')).astype(np.int64)
+    series = np.zeros(int(seconds[-1]) + 1)
+    series[seconds] = np.nan_to_num(power.astype(np.float64))
+    return series
+
+
+def mean_max_power(series, durations=None):
+    """
+    Return the best mean power for each duration of a 1 second power series.
+
+    Parameters:
+    ----------
+        series (ndarray): power in Watts, one value per second, see power_series
+        durations (list): ascending durations in seconds, defaults to power_curve_durations
+
+    Every window of a duration is summed at once as the difference of two prefix sums, O(n) per duration. Returns a list of
+    (duration, power, start second) tuples for the durations that fit in the series.
+    """
+    prefix = np.concatenate(([0.0], np.cumsum(series)))
+    curve = []
+    for duration in durations or power_curve_durations:
+        if duration > len(series):
+            break
+        sums = prefix[duration:] - prefix[:-duration]
+        start = int(np.argmax(sums))
+        curve.append((duration, float(sums[start] / duration), start))
+    return curve
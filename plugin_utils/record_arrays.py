@@ -0,0 +1,91 @@
+"""Read plugin records into NumPy arrays from either records tables or columnar arrays."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import zlib
+
+import numpy as np
+from sqlalchemy import select
+
+from .columnar import column_encoding
+
+
+# NumPy dtypes of the little endian array typecodes the columnar arrays are stored with.
+_dtypes = {'b': '<i1', 'i': '<i4', 'q': '<i8', 'd': '<f8'}
+
+
+def decode_column(encoding, typecode, count, data, nulls=None):
+    """
+    Return a NumPy array of a column stored by encode_column.
+
+    Datetime columns are returned as datetime64[ms], time columns as milliseconds, and other columns in their stored type. Columns with
+    missing values are returned as float64 with NaN for the missing values, or NaT for datetimes.
+    """
+    values = np.frombuffer(bytearray(zlib.decompress(data)), dtype=_dtypes[typecode], count=count)
+    if encoding in ('delta', 'datetime'):
+        values = np.cumsum(values)
+    if encoding == 'datetime':
+        values = values.astype('datetime64[ms]')
+    if nulls is not None:
+        missing = np.frombuffer(zlib.decompress(nulls), dtype=np.uint8, count=count).astype(bool)
+        values = values.astype('datetime64[ms]' if encoding == 'datetime' else np.float64)
+        values[missing] = np.datetime64('NaT') if encoding == 'datetime' else np.nan
+    return values
+
+
+def _column_array(values, encoding):
+    if encoding == 'datetime':
+        return np.array(values, dtype='datetime64[ms]')
+    if encoding == 'time':
+        values = [None if value is None else (value.hour * 3600 + value.minute * 60 + value.second) * 1000 + value.microsecond // 1000 for value in values]
+    if any(value is None for value in values):
+        return np.array(values, dtype=np.float64)
+    return np.array(values)
+
+
+def fetch_arrays(activity_db_session, statement, encodings, chunk_size=10000):
+    """
+    Return a dict of column name to NumPy array of the rows of a select statement, fetched from the cursor chunk_size rows at a time.
+
+    Each chunk is converted to arrays as it is fetched, so no more than chunk_size rows are held as Python objects. encodings is the
+    columnar encoding of each of the statement's columns, in order, see column_encoding.
+    """
+    names = list(statement.selected_columns.keys())
+    chunks = {name: [] for name in names}
+    result = activity_db_session.execute(statement.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        for name, encoding, values in zip(names, encodings, zip(*rows)):
+            chunks[name].append(_column_array(list(values), encoding))
+    return {name: np.concatenate(chunks[name]) if chunks[name] else _column_array([], encoding) for name, encoding in zip(names, encodings)}
+
+
+def read_record_arrays(activity_db_session, plugin, activity_id, columns=None, chunk_size=10000):
+    """
+    Return a dict of column name to NumPy array of an activity's records, ordered by record number.
+
+    Parameters:
+    ----------
+        activity_db_session (Session): a session on the activities database
+        plugin (RecordWriterMixin): the plugin whose records are read
+        activity_id (string): the activity to read
+        columns (list): the columns to read, defaults to all columns except activity_id
+        chunk_size (int): the number of records table rows fetched and converted at a time
+
+    Plugins with columnar records are read with one query that returns one compressed array per column. Records tables are read with
+    one query whose rows are fetched in chunks, see fetch_arrays. Both return the same arrays, see decode_column.
+    """
+    record_table = plugin._tables['record']
+    if columns is None:
+        columns = [column.name for column in record_table.__table__.columns if column.name != 'activity_id']
+    columns_table = plugin._tables.get('record_columns')
+    if columns_table is not None:
+        query = activity_db_session.query(columns_table.name, columns_table.encoding, columns_table.typecode, columns_table.count, columns_table.data,
+                                          columns_table.nulls)
+        query = query.filter(columns_table.activity_id == activity_id, columns_table.name.in_(columns))
+        arrays = {row[0]: decode_column(*row[1:]) for row in query}
+        return {name: arrays[name] for name in columns if name in arrays}
+    record_columns = record_table.__table__.columns
+    statement = select(*[record_columns[name] for name in columns]).where(record_columns['activity_id'] == activity_id).order_by(record_columns['record'])
+    return fetch_arrays(activity_db_session, statement, [column_encoding(name, record_columns[name].type)[0] for name in columns], chunk_size)
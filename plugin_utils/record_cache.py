@@ -0,0 +1,97 @@
+"""A size bounded LRU cache of activities' record arrays, invalidated when records are written."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import weakref
+import collections
+
+
+logger = logging.getLogger(__file__)
+
+
+# The caches that are told about records written in this process.
+_caches = weakref.WeakSet()
+
+
+def invalidate_records(tablename, activity_ids=None):
+    """Drop the cached records of activity_ids, or of all activities, of a records table from every cache in this process."""
+    for cache in list(_caches):
+        cache.invalidate(tablename, activity_ids)
+
+
+class RecordCache():
+    """
+    Keeps the record arrays of the most recently read activities up to a total size in bytes.
+
+    Entries are keyed by (records table name, activity_id), where the table is the one the records are read from, the records table or
+    its columnar arrays table. Writing records for an activity in this process, through RecordWriterMixin, retention, reprocessing,
+    or a parallel import merge, drops its entry. Records written by other processes are not seen, call clear() after those.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        Return a RecordCache instance.
+
+        Parameters:
+        ----------
+            max_bytes (int): the total size of the cached arrays, activities larger than that aren't cached
+
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        _caches.add(self)
+
+    @classmethod
+    def _size(cls, arrays):
+        return sum(getattr(values, 'nbytes', 0) for values in arrays.values())
+
+    def get(self, key):
+        """Return the cached arrays for key, a (tablename, activity_id) tuple, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, arrays):
+        """Cache the arrays, a dict of column name to array, of key and evict the least recently read entries to stay under max_bytes."""
+        self._drop(key)
+        size = self._size(arrays)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (arrays, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            evicted, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            logger.debug("Evicted %r from the records cache", evicted)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def invalidate(self, tablename, activity_ids=None):
+        """Drop the entries of activity_ids, or of all activities, of a records table."""
+        if activity_ids is None:
+            keys = [key for key in self._entries if key[0] == tablename]
+        else:
+            keys = [(tablename, activity_id) for activity_id in activity_ids]
+        for key in keys:
+            self._drop(key)
+
+    def clear(self):
+        """Drop all entries."""
+        self._entries.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
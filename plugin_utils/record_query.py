@@ -0,0 +1,140 @@
+"""Read plugin records of whole activities or of time ranges across activities as NumPy arrays or Arrow tables."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+
+import numpy as np
+from sqlalchemy import select, exists
+
+from garmindb.garmindb import Activities
+
+from .columnar import column_encoding
+from .record_arrays import read_record_arrays, fetch_arrays
+from .record_cache import RecordCache
+
+
+logger = logging.getLogger(__file__)
+
+
+def to_arrow(arrays):
+    """Return a pyarrow Table of a dict of column name to NumPy array, with NaN and NaT as nulls. Needs pyarrow."""
+    import pyarrow as pa
+    return pa.table({name: pa.array(values, from_pandas=True) for name, values in arrays.items()})
+
+
+class RecordQuery():
+    """
+    Reads a plugin's records as column arrays, keeping recently read activities in a RecordCache.
+
+    Whole activities are read with read_record_arrays and cached with all of their columns, so reading other columns of the same
+    activity doesn't query again. Cached arrays are read only, copy them before changing them. Time ranges of records tables are read
+    with one query whose rows are fetched in chunks, time ranges of columnar records are read an activity at a time through the cache.
+    """
+
+    def __init__(self, plugin, cache=None, chunk_size=10000):
+        """
+        Return a RecordQuery instance.
+
+        Parameters:
+        ----------
+            plugin (RecordWriterMixin): the plugin whose records are read, with tables initialized
+            cache (RecordCache): the cache of activities' arrays, can be shared between plugins, defaults to a new 256 MB cache
+            chunk_size (int): the number of records table rows fetched and converted at a time
+
+        """
+        self.plugin = plugin
+        self.cache = RecordCache() if cache is None else cache
+        self.chunk_size = chunk_size
+        self.record_table = plugin._tables['record']
+        self.columns_table = plugin._tables.get('record_columns')
+        self.tablename = (self.columns_table or self.record_table).__tablename__
+
+    def _columns(self, columns):
+        return [column.name for column in self.record_table.__table__.columns if column.name != 'activity_id'] if columns is None else list(columns)
+
+    def _result(self, arrays, arrow):
+        return to_arrow(arrays) if arrow else arrays
+
+    def _activity_arrays(self, activity_db_session, activity_id):
+        key = (self.tablename, activity_id)
+        arrays = self.cache.get(key)
+        if arrays is None:
+            arrays = read_record_arrays(activity_db_session, self.plugin, activity_id, chunk_size=self.chunk_size)
+            for values in arrays.values():
+                values.flags.writeable = False
+            self.cache.put(key, arrays)
+        return arrays
+
+    def activity(self, activity_db_session, activity_id, columns=None, arrow=False):
+        """
+        Return an activity's records ordered by record number.
+
+        Parameters:
+        ----------
+            activity_db_session (Session): a session on the activities database
+            activity_id (string): the activity to read
+            columns (list): the columns to return, defaults to all columns except activity_id
+            arrow (bool): return a pyarrow Table instead of a dict of column name to NumPy array
+
+        """
+        arrays = self._activity_arrays(activity_db_session, activity_id)
+        return self._result({name: arrays[name] for name in self._columns(columns) if name in arrays}, arrow)
+
+    def _range_activity_ids(self, activity_db_session, start, end, activity_ids):
+        query = activity_db_session.query(Activities.activity_id).filter(Activities.start_time < end, Activities.stop_time >= start)
+        query = query.filter(exists().where(self.columns_table.activity_id == Activities.activity_id))
+        if activity_ids is not None:
+            query = query.filter(Activities.activity_id.in_(activity_ids))
+        return [row[0] for row in query.order_by(Activities.start_time)]
+
+    def _columnar_range(self, activity_db_session, start, end, columns, activity_ids):
+        start64 = np.datetime64(start, 'ms')
+        end64 = np.datetime64(end, 'ms')
+        chunks = []
+        for activity_id in self._range_activity_ids(activity_db_session, start, end, activity_ids):
+            arrays = self._activity_arrays(activity_db_session, activity_id)
+            timestamps = arrays.get('timestamp')
+            if timestamps is None:
+                continue
+            selected = (timestamps >= start64) & (timestamps < end64)
+            if selected.any():
+                chunk = {'activity_id': np.full(np.count_nonzero(selected), activity_id)}
+                chunk.update({name: arrays[name][selected] for name in columns if name in arrays})
+                chunks.append(chunk)
+        if not chunks:
+            dtypes = {'activity_id': str, 'timestamp': 'datetime64[ms]'}
+            return {name: np.array([], dtype=dtypes.get(name, np.float64)) for name in ['activity_id'] + columns}
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+
+    def time_range(self, activity_db_session, start, end, columns=None, activity_ids=None, arrow=False):
+        """
+        Return the records, of all activities, with timestamps from start up to end, ordered by timestamp.
+
+        Parameters:
+        ----------
+            activity_db_session (Session): a session on the activities database
+            start (datetime): the first time to return records for
+            end (datetime): the time after the last records returned
+            columns (list): the columns to return, defaults to all columns, activity_id and timestamp are always returned
+            activity_ids (list): limit the records to these activities
+            arrow (bool): return a pyarrow Table instead of a dict of column name to NumPy array
+
+        Columnar records are looked up through the activities table's start and stop times.
+        """
+        columns = ['timestamp'] + [name for name in self._columns(columns) if name not in ('activity_id', 'timestamp')]
+        if self.columns_table is not None:
+            arrays = self._columnar_range(activity_db_session, start, end, columns, activity_ids)
+            order = np.argsort(arrays['timestamp'], kind='stable')
+            return self._result({name: values[order] for name, values in arrays.items()}, arrow)
+        record_columns = self.record_table.__table__.columns
+        names = ['activity_id'] + columns
+        statement = select(*[record_columns[name] for name in names]).where(record_columns['timestamp'] >= start, record_columns['timestamp'] < end)
+        if activity_ids is not None:
+            statement = statement.where(record_columns['activity_id'].in_(activity_ids))
+        statement = statement.order_by(record_columns['timestamp'], record_columns['activity_id'], record_columns['record'])
+        arrays = fetch_arrays(activity_db_session, statement, [column_encoding(name, record_columns[name].type)[0] for name in names], self.chunk_size)
+        logger.debug("%s: read %d records from %s to %s", self.tablename, len(arrays['timestamp']), start, end)
+        return self._result(arrays, arrow)
@@ -0,0 +1,45 @@
+"""Tables of plugin records downsampled into fixed length buckets with the min, mean, and max of each column."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+from sqlalchemy import Integer, Float, DateTime, String, ForeignKey
+
+
+tier_table_pk = ("activity_id", "bucket")
+tier_statistics = ('min', 'mean', 'max')
+
+
+def tier_tablename(records_tablename, seconds):
+    """Return the name of the table that holds a records table downsampled into buckets of seconds."""
+    return f'{records_tablename}_{seconds}s'
+
+
+def tier_columns(records_cols, names):
+    """Return the records table columns of names that are summarized in the tiers, the numeric ones."""
+    return [name for name in names if records_cols[name]['args'][0] in (Integer, Float)]
+
+
+def tier_table_cols(records_cols, names):
+    """
+    Return the columns of a tier table.
+
+    Parameters:
+    ----------
+        records_cols (dict): the records table column declarations
+        names (list): the records table columns to summarize, see tier_columns
+
+    Each bucket has the time of its start, the number of records in it, and the min, mean, and max of each column.
+    """
+    cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'bucket': {'args': [Integer]},
+        'timestamp': {'args': [DateTime]},
+        'samples': {'args': [Integer]}
+    }
+    for name in names:
+        units = {'units': records_cols[name]['units']} if 'units' in records_cols[name] else {}
+        for statistic in tier_statistics:
+            cols[f'{name}_{statistic}'] = dict({'args': [Float]}, **units)
+    return cols
@@ -0,0 +1,351 @@
+"""Buffered bulk writing of plugin records tables."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import time
+
+from sqlalchemy import event
+
+from .field_map import FieldMap
+from .local_time import local_time_converter
+from .stats import PluginStats
+from .indexes import sync_indexes
+from .aggregates import SessionAggregator
+from .rollups import SessionRollups, rollup_periods, rollup_tablename, rollup_table_version, rollup_table_cols
+from .record_tiers import tier_tablename, tier_table_pk, tier_columns, tier_table_cols
+from .record_cache import invalidate_records
+from .columnar import ColumnarRecordWriter, columns_tablename, columns_table_version, columns_table_pk, columns_table_cols
+
+
+logger = logging.getLogger(__file__)
+
+
+class RecordWriter():
+    """Collects the record rows of an activity and writes the new ones with a single bulk insert."""
+
+    def __init__(self, table, columns, flush_size=10000, stats=None, background=None):
+        """
+        Return a RecordWriter instance.
+
+        Parameters:
+        ----------
+            table (DbObject): the plugin records table with an (activity_id, record) primary key
+            columns (list): the table column names in the order rows are passed to add()
+            flush_size (int): the number of buffered rows that forces a write
+            stats (PluginStats): optional counters to update
+            background (BackgroundWriter): optional writer thread the inserts are handed to instead of executing them in the session
+
+        """
+        self.table = table
+        self.background = background
+        self.columns = tuple(columns)
+        self.flush_size = flush_size
+        self._activity_id = None
+        self._existing = frozenset()
+        self._rows = []
+        self._skipped = 0
+        self.stats = stats
+
+    @property
+    def activity_id(self):
+        """Return the id of the activity whose records are being collected."""
+        return self._activity_id
+
+    def _start_activity(self, session, activity_id):
+        """Load the record numbers already stored for the activity with one query."""
+        start = time.perf_counter()
+        query = session.query(self.table.record).filter(self.table.activity_id == activity_id)
+        self._existing = frozenset(row[0] for row in query)
+        self._activity_id = activity_id
+        if self.stats is not None:
+            self.stats.add(activity_id, 'existence_checks')
+            self.stats.add(activity_id, 'existence_check_time', time.perf_counter() - start)
+        logger.debug("%s: %d records already stored for %s", self.table.__tablename__, len(self._existing), activity_id)
+
+    def add(self, session, row):
+        """Buffer a row, a tuple of values starting with activity_id and record, if it isn't already stored."""
+        activity_id = row[0]
+        if activity_id != self._activity_id:
+            self.flush(session)
+            self._start_activity(session, activity_id)
+        if row[1] in self._existing:
+            self._skipped += 1
+        else:
+            self._rows.append(row)
+            if len(self._rows) >= self.flush_size:
+                self.flush(session)
+
+    def flush(self, session):
+        """Write all buffered rows in one executemany insert."""
+        if self._skipped and self.stats is not None:
+            self.stats.add(self._activity_id, 'rows_skipped', self._skipped)
+        self._skipped = 0
+        if self._rows:
+            logger.debug("%s: inserting %d records for %s", self.table.__tablename__, len(self._rows), self._activity_id)
+            start = time.perf_counter()
+            rows = [dict(zip(self.columns, row)) for row in self._rows]
+            if self.background is not None:
+                self.background.put(self.table.__table__, rows)
+            else:
+                session.execute(self.table.__table__.insert(), rows)
+            if self.stats is not None:
+                self.stats.add(self._activity_id, 'inserts')
+                self.stats.add(self._activity_id, 'rows_written', len(self._rows))
+                self.stats.add(self._activity_id, 'insert_time', time.perf_counter() - start)
+            self._rows = []
+
+    def finish(self, session):
+        """Write the buffered rows and forget the current activity."""
+        self.flush(session)
+        self._activity_id = None
+        self._existing = frozenset()
+
+    def discard(self):
+        """Drop the buffered rows and forget the current activity, used when the session they were for rolled back."""
+        self._rows = []
+        self._skipped = 0
+        self._activity_id = None
+        self._existing = frozenset()
+
+
+class RecordWriterMixin():
+    """
+    Mixin for activity plugins that write their records table through a RecordWriter.
+
+    Plugins declare the FIT fields their record and session columns are read from in _records_fields and _sessions_fields, see
+    FieldMap. The records table must start with activity_id, record, and timestamp columns. Records table columns the plugin computes
+    instead of reading them from the message are listed in _records_computed, an overridden _record_row appends their values.
+
+    An activity counts as imported once its sessions table row exists, or for plugins without a sessions table, once it has records.
+    Plugins skip all record and session writes for imported activities.
+
+    Queued record rows are written when the plugin flushes them before writing a session, when the records of another activity
+    start, and before the session they were queued in commits, which GarminDb does at the end of each file, so files without a
+    session message keep their records. Queued rows are dropped if the session rolls back.
+
+    Secondary indexes on the records table are declared in _records_indexes as index name to column list and are created, or updated
+    when the declaration changes, before the first record is written.
+
+    Session columns can be computed from the records as they are imported, declared in _sessions_aggregates as session column to
+    (records column, statistic), see SessionAggregator. They fill in session columns the session message didn't have a value for.
+
+    Sessions table metrics listed in _sessions_rollups are rolled up per day and per week in <sessions table>_daily and
+    <sessions table>_weekly tables as sessions are written with _write_session, see SessionRollups.
+
+    Plugins that list bucket lengths in seconds in _records_tiers get a <records table>_<seconds>s table for each, that holds the
+    min, mean, and max of the numeric records columns per bucket. Set _records_raw_days to have plugin_utils.retention replace the
+    records of activities older than that with the tiers.
+
+    Plugins that set _records_columnar store each activity's records as one compressed array per column in a <records table>_columns
+    table instead of one row per record, see ColumnarRecordWriter. The records table is still created, and is left empty.
+
+    An importer that only writes plugin tables can set the plugin's background_writer to a BackgroundWriter, the records inserts are
+    then made on the writer's thread while the next records are parsed, and synced before sessions are written.
+
+    The plugin's database work is counted in stats, see PluginStats. Set log_records to log every record row written.
+    """
+
+    log_records = False
+    _records_computed = ()
+    _records_columnar = False
+    _sessions_aggregates = {}
+    _sessions_rollups = ()
+    _records_tiers = ()
+    _records_raw_days = None
+
+    @classmethod
+    def init_activity(cls, act_db_class, activities_table):
+        """Initialize the plugin tables, including the columnar records table if the plugin stores records as arrays."""
+        super().init_activity(act_db_class, activities_table)
+        if cls._records_columnar and 'record_columns' not in cls._tables:
+            cls._tables['record_columns'] = activities_table.create(columns_tablename(cls._records_tablename), act_db_class, columns_table_version,
+                                                                    columns_table_pk, columns_table_cols())
+        names = tier_columns(cls._records_cols, tuple(cls._records_fields) + tuple(cls._records_computed)) if cls._records_tiers else []
+        for seconds in cls._records_tiers:
+            if f'tier_{seconds}' not in cls._tables:
+                cls._tables[f'tier_{seconds}'] = activities_table.create(tier_tablename(cls._records_tablename, seconds), act_db_class, cls._records_version,
+                                                                         tier_table_pk, tier_table_cols(cls._records_cols, names))
+        if cls._sessions_rollups:
+            for period in rollup_periods:
+                if f'{period}_rollup' not in cls._tables:
+                    cls._tables[f'{period}_rollup'] = activities_table.create(rollup_tablename(cls._sessions_tablename, period), act_db_class,
+                                                                              rollup_table_version, cols=rollup_table_cols())
+
+    @property
+    def stats(self):
+        """Return the PluginStats for the plugin's database work."""
+        stats = vars(self).get('_stats')
+        if stats is None:
+            stats = self._stats = PluginStats()
+        return stats
+
+    def _activity_imported(self, activity_db_session, activity_id):
+        """Return True if an earlier import already stored the activity, checked once per activity."""
+        checked = vars(self).get('_checked_activity')
+        if checked is None or checked[0] != activity_id:
+            start = time.perf_counter()
+            if 'session' in self._tables:
+                imported = self._tables['session'].s_exists(activity_db_session, {'activity_id' : activity_id})
+            else:
+                record_table = self._tables.get('record_columns', self._tables['record'])
+                query = activity_db_session.query(record_table).filter(record_table.activity_id == activity_id)
+                imported = activity_db_session.query(query.exists()).scalar()
+            self.stats.add(activity_id, 'existence_checks')
+            self.stats.add(activity_id, 'existence_check_time', time.perf_counter() - start)
+            if imported:
+                self.stats.add(activity_id, 'activities_skipped')
+            logger.debug("%s: activity %s imported %s", self.__class__.__name__, activity_id, imported)
+            checked = self._checked_activity = (activity_id, imported)
+        return checked[1]
+
+    def _mark_activity_imported(self, activity_id):
+        """Record that all of the activity's plugin data has been written."""
+        self._checked_activity = (activity_id, True)
+
+    @property
+    def rollups(self):
+        """Return the SessionRollups of the sessions table or None if the plugin doesn't roll up session metrics."""
+        if not self._sessions_rollups:
+            return None
+        return SessionRollups({period: self._tables[f'{period}_rollup'] for period in rollup_periods}, self._sessions_rollups)
+
+    def _write_session(self, activity_db_session, session):
+        """Add a sessions table entry, update the rollups with it, and mark the activity imported."""
+        activity_db_session.add(self._tables['session'](**session))
+        rollups = self.rollups
+        if rollups is not None:
+            rollups.add(activity_db_session, session)
+        self._mark_activity_imported(session['activity_id'])
+
+    def rebuild_rollups(self, activity_db_session):
+        """Recompute the session rollups from the sessions table, after sessions were changed outside of an import."""
+        rollups = self.rollups
+        if rollups is not None:
+            rollups.rebuild(activity_db_session, self._tables['session'])
+
+    def _derived_table_keys(self):
+        """Return the keys of the tables computed across activities from the plugin's other tables, like the session rollups."""
+        return [f'{period}_rollup' for period in rollup_periods] if self._sessions_rollups else []
+
+    def rebuild_derived_tables(self, activity_db_session):
+        """Recompute the tables computed across activities, called after rows were merged in from another database."""
+        self.rebuild_rollups(activity_db_session)
+
+    def _file_cache(self, fit_file):
+        """Return a dict for data derived from fit_file, reset when the plugin sees a new file."""
+        file_cache = vars(self).get('_file_cache_entry')
+        if file_cache is None or file_cache[0] != fit_file.filename:
+            file_cache = self._file_cache_entry = (fit_file.filename, {})
+        return file_cache[1]
+
+    def _field_extractor(self, fit_file, name):
+        """Return the FieldExtractor for the _records_fields or _sessions_fields map compiled for fit_file."""
+        file_cache = self._file_cache(fit_file)
+        extractor = file_cache.get(name)
+        if extractor is None:
+            extractor = file_cache[name] = FieldMap(getattr(self, f'_{name}_fields')).compile(fit_file)
+        return extractor
+
+    def _local_time(self, fit_file):
+        """Return the UTC to local time conversion function for fit_file."""
+        file_cache = self._file_cache(fit_file)
+        utc_datetime_to_local = file_cache.get('local_time')
+        if utc_datetime_to_local is None:
+            utc_datetime_to_local = file_cache['local_time'] = local_time_converter(fit_file)
+        return utc_datetime_to_local
+
+    def _records_columns(self):
+        return ('activity_id', 'record', 'timestamp') + tuple(self._records_fields) + tuple(self._records_computed)
+
+    def _session_aggregator(self, fit_file):
+        """Return the SessionAggregator for the records of fit_file or None if the plugin doesn't declare session aggregates."""
+        if not self._sessions_aggregates:
+            return None
+        file_cache = self._file_cache(fit_file)
+        aggregator = file_cache.get('session_aggregator')
+        if aggregator is None:
+            aggregator = file_cache['session_aggregator'] = SessionAggregator(self._sessions_aggregates, self._records_columns())
+        return aggregator
+
+    def _record_row(self, fit_file, activity_id, record_num, message_fields):
+        """Return a records table row for a record message."""
+        values = self._field_extractor(fit_file, 'records').values(message_fields)
+        return (activity_id, record_num, self._local_time(fit_file)(message_fields.timestamp)) + values
+
+    def _session_entry(self, fit_file, activity_id, message_fields):
+        """Return a sessions table entry for a session message."""
+        session = {'activity_id': activity_id, 'timestamp': self._local_time(fit_file)(message_fields.timestamp)}
+        session.update(self._field_extractor(fit_file, 'sessions').as_dict(message_fields))
+        aggregator = self._session_aggregator(fit_file)
+        if aggregator is not None:
+            for name, value in aggregator.values().items():
+                if session.get(name) is None:
+                    session[name] = value
+        return session
+
+    def _record_writer(self, activity_db_session):
+        writer = vars(self).get('_records_writer')
+        if writer is None:
+            record_table = self._tables['record']
+            sync_indexes(activity_db_session.connection(), record_table.__tablename__, getattr(self, '_records_indexes', {}))
+            columns = self._records_columns()
+            background = vars(self).get('background_writer')
+            if 'record_columns' in self._tables:
+                writer = self._records_writer = ColumnarRecordWriter(record_table, self._tables['record_columns'], columns, stats=self.stats,
+                                                                     background=background)
+            else:
+                writer = self._records_writer = RecordWriter(record_table, columns, stats=self.stats, background=background)
+        return writer
+
+    def _track_records_session(self, activity_db_session):
+        """Have the session write the queued record rows before it commits and drop them if it rolls back."""
+        if vars(self).get('_records_session') is not activity_db_session:
+            self._records_session = activity_db_session
+            event.listen(activity_db_session, 'before_commit', self._flush_records)
+            event.listen(activity_db_session, 'after_rollback', self._discard_records)
+
+    def _discard_records(self, activity_db_session=None):
+        """Drop the queued record rows and the data derived from their file, nothing of it was committed."""
+        writer = vars(self).get('_records_writer')
+        if writer is not None:
+            writer.discard()
+        self._checked_activity = None
+        self._file_cache_entry = None
+
+    def _write_record(self, activity_db_session, row):
+        """Queue a records table row as returned by _record_row."""
+        self._record_writer(activity_db_session).add(activity_db_session, row)
+
+    def _import_record(self, activity_db_session, fit_file, activity_id, record_num, message_fields):
+        """Queue the records table row for a record message unless the activity was already imported."""
+        self._track_records_session(activity_db_session)
+        writer = vars(self).get('_records_writer')
+        if writer is not None and writer.activity_id not in (None, activity_id):
+            # The previous activity's file had no session message to flush its records.
+            self._flush_records(activity_db_session)
+        if self._activity_imported(activity_db_session, activity_id):
+            self.stats.add(activity_id, 'rows_skipped')
+            return
+        row = self._record_row(fit_file, activity_id, record_num, message_fields)
+        if self.log_records:
+            logger.info("writing %s record %r for %s", self.__class__.__name__, row, fit_file.filename)
+        aggregator = self._session_aggregator(fit_file)
+        if aggregator is not None:
+            aggregator.add(row)
+        self._write_record(activity_db_session, row)
+
+    def _flush_records(self, activity_db_session):
+        """Write the queued record rows, called once the records of an activity have all been seen."""
+        writer = vars(self).get('_records_writer')
+        if writer is not None:
+            activity_id = writer.activity_id
+            writer.finish(activity_db_session)
+            background = vars(self).get('background_writer')
+            if background is not None:
+                background.sync()
+            if activity_id is not None:
+                invalidate_records(self._tables.get('record_columns', self._tables['record']).__tablename__, [activity_id])
+                logger.info("%s: activity %s: %s", self.__class__.__name__, activity_id, self.stats.format(self.stats.activity(activity_id)))
@@ -0,0 +1,248 @@
+"""Upgrade plugin tables in place after a table version change and reprocess the affected activities with a pool of worker processes."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import fitfile
+from sqlalchemy import create_engine, inspect, text, String, Boolean
+from idbutils import DbParams
+from garmindb.garmindb import ActivitiesDb, Activities, File
+
+from .indexes import sync_indexes
+from .record_cache import invalidate_records
+from .manifest import PluginManifest
+from .parallel_import import PluginImporter, load_activity_plugins, _close_at_exit
+
+
+logger = logging.getLogger(__file__)
+
+
+checkpoint_tablename = 'plugin_reprocess'
+checkpoint_table_version = 1
+checkpoint_table_pk = ("plugin", "activity_id")
+checkpoint_table_cols = {
+    'plugin': {'args': [String]},
+    'activity_id': {'args': [String]},
+    'done': {'args': [Boolean]}
+}
+_checkpoint_table = None
+
+
+def checkpoint_table():
+    """Return the table that holds the activities waiting to be reprocessed by each plugin."""
+    global _checkpoint_table
+    if _checkpoint_table is None:
+        _checkpoint_table = Activities.create(checkpoint_tablename, ActivitiesDb, checkpoint_table_version, checkpoint_table_pk, checkpoint_table_cols)
+    return _checkpoint_table
+
+
+def _derived_keys(plugin):
+    return plugin._derived_table_keys() if hasattr(plugin, '_derived_table_keys') else []
+
+
+def _activity_tables(plugin):
+    """Return the plugin's tables with rows per activity, the ones computed across activities are rebuilt instead."""
+    derived = _derived_keys(plugin)
+    return [table for key, table in plugin._tables.items() if key not in derived]
+
+
+def _derived_tables(plugin):
+    """Return the plugin's tables computed across activities."""
+    return [plugin._tables[key] for key in _derived_keys(plugin) if key in plugin._tables]
+
+
+def _plugin_activity_ids(connection, plugin):
+    table = plugin._tables.get('session', plugin._tables.get('record_columns', plugin._tables.get('record')))
+    return [row[0] for row in connection.execute(text(f'SELECT DISTINCT activity_id FROM {table.__tablename__}'))]
+
+
+def _upgrade_table(connection, inspector, table):
+    """Add the columns the table gained to the database table, returns the names of the columns added."""
+    existing = {column['name'] for column in inspector.get_columns(table.__tablename__)}
+    pk = set(inspector.get_pk_constraint(table.__tablename__)['constrained_columns'])
+    if pk != {column.name for column in table.__table__.primary_key.columns}:
+        raise RuntimeError(f'The primary key of {table.__tablename__} changed, it can\'t be upgraded in place. Please rebuild the activities DB.')
+    added = []
+    for column in table.__table__.columns:
+        if column.name not in existing:
+            connection.execute(text(f'ALTER TABLE {table.__tablename__} ADD COLUMN {column.name} {column.type.compile(dialect=connection.dialect)}'))
+            added.append(column.name)
+    return added
+
+
+def upgrade_tables(db_params, plugins):
+    """
+    Upgrade the plugin tables whose version changed and queue the plugins' activities for reprocessing.
+
+    Parameters:
+    ----------
+        db_params (DbParams): the activities database, must be SQLite
+        plugins (dict): plugin name to plugin instance, with tables initialized
+
+    Columns a table gained are added, columns it lost are left in place, and the table's version in the database is updated, so
+    GarminDb opens the database again. All of the activities of a plugin with a changed table are added to the checkpoint table. Tables
+    computed across activities, see _derived_table_keys, are dropped and created empty instead, for rebuild_derived_tables to refill,
+    and don't queue activities. All of that happens in one transaction. Returns plugin name to the names of the tables upgraded.
+    """
+    engine = create_engine(ActivitiesDb._sqlite_url(db_params))
+    upgraded = {}
+    try:
+        with engine.begin() as connection:
+            inspector = inspect(connection)
+            if not inspector.has_table('_attributes'):
+                return upgraded
+            checkpoints = checkpoint_table()
+            checkpoints.__table__.create(connection, checkfirst=True)
+            for name, plugin in plugins.items():
+                derived = _derived_tables(plugin)
+                reprocess_activities = False
+                for table in _activity_tables(plugin) + derived:
+                    version_key = f'{table.__tablename__}.version'
+                    stored = connection.execute(text('SELECT value FROM _attributes WHERE key = :key'), {'key': version_key}).scalar()
+                    if stored is None or int(stored) == table.table_version:
+                        continue
+                    if table in derived:
+                        connection.execute(text(f'DROP TABLE {table.__tablename__}'))
+                        table.__table__.create(connection)
+                        logger.info("Recreated %s for version %d from version %s", table.__tablename__, table.table_version, stored)
+                    else:
+                        added = _upgrade_table(connection, inspector, table)
+                        logger.info("Upgraded %s from version %s to %d, added columns %r", table.__tablename__, stored, table.table_version, added)
+                        reprocess_activities = True
+                    connection.execute(text('UPDATE _attributes SET value = :value WHERE key = :key'), {'key': version_key, 'value': str(table.table_version)})
+                    upgraded.setdefault(name, []).append(table.__tablename__)
+                if reprocess_activities:
+                    queued = {row[0] for row in connection.execute(text(f'SELECT activity_id FROM {checkpoint_tablename} WHERE plugin = :plugin'), {'plugin': name})}
+                    rows = [{'plugin': name, 'activity_id': activity_id, 'done': False} for activity_id in _plugin_activity_ids(connection, plugin) if activity_id not in queued]
+                    if rows:
+                        connection.execute(checkpoints.__table__.insert(), rows)
+                    logger.info("Queued %d activities for reprocessing by %s", len(rows), name)
+    finally:
+        engine.dispose()
+    return upgraded
+
+
+def replace_activities(activity_db_session, staging_db_params, tables, activity_ids):
+    """Replace the rows of activity_ids in plugin tables with the rows in a staging database, and empty the staging tables."""
+    staging_db = ActivitiesDb(staging_db_params)
+    with staging_db.managed_session() as staging_session:
+        for table in tables:
+            activity_db_session.query(table).filter(table.activity_id.in_(activity_ids)).delete(synchronize_session=False)
+            rows = [dict(row._mapping) for row in staging_session.query(table.__table__).filter(table.activity_id.in_(activity_ids))]
+            if rows:
+                activity_db_session.execute(table.__table__.insert(), rows)
+            staging_session.query(table).delete()
+            invalidate_records(table.__tablename__, activity_ids)
+    staging_db.engine.dispose()
+
+
+_worker_importer = None
+_worker_staging_dir = None
+
+
+def _init_worker(plugin_dir, staging_dir, measurement_system, background_writes):
+    """Give the worker process its own plugin instances and its own staging database."""
+    global _worker_importer, _worker_staging_dir
+    _worker_staging_dir = tempfile.mkdtemp(prefix='worker_', dir=staging_dir)
+    db_params = DbParams(db_type='sqlite', db_path=_worker_staging_dir)
+    _worker_importer = PluginImporter(load_activity_plugins(plugin_dir, db_params), db_params, None, measurement_system, background_writes,
+                                      PluginManifest.load(plugin_dir))
+    _close_at_exit(_worker_importer)
+
+
+def _reprocess_file(job):
+    filename, names = job
+    try:
+        # Only the plugins reprocessing the activity are given the file.
+        _worker_importer.imported = {name: frozenset([File.id_from_path(filename)]) for name in _worker_importer.plugins if name not in names}
+        return (filename, _worker_importer.import_file(filename), None, _worker_staging_dir)
+    except Exception as e:
+        logger.error("Failed to reprocess %s: %s", filename, e)
+        return (filename, [], str(e), _worker_staging_dir)
+
+
+def reprocess(db_params, plugin_dir, filenames, workers=None, staging_dir=None, batch_size=200, measurement_system=fitfile.field_enums.DisplayMeasure.metric,
+              background_writes=False):
+    """
+    Upgrade plugin tables whose version changed and reprocess the affected activities' FIT files through the changed plugins.
+
+    Parameters:
+    ----------
+        db_params (DbParams): the activities database, must be SQLite
+        plugin_dir (string): the directory to load the plugins from
+        filenames (list): the activity FIT files, the ones of activities that aren't waiting to be reprocessed are skipped
+        workers (int): the number of worker processes, defaults to the number of CPUs
+        staging_dir (string): where the workers' staging databases are created, defaults to the system temp directory
+        batch_size (int): the number of files reprocessed between checkpoints
+        measurement_system (DisplayMeasure): the units to parse the FIT files with
+        background_writes (bool): have each worker write records from a writer thread while it parses, see BackgroundWriter
+
+    The workers write the reprocessed rows into their own staging databases. After each batch the rows of the batch's activities are
+    replaced in the activities database and the activities are checked off in the plugin_reprocess table, in one transaction, so a
+    stopped run picks up at the last batch. Activities whose file failed or wasn't given stay queued. Once a plugin's activities are
+    all done, its tables computed across activities are rebuilt and its checkpoints removed. Tables computed across activities that
+    were recreated for a new version are rebuilt even when none of the plugin's activities are queued.
+
+    Returns a dict with plugin name to activities reprocessed, the files that failed with their errors, and plugin name to the number
+    of queued activities no file was given for.
+    """
+    if db_params.db_type != 'sqlite':
+        raise ValueError(f'Reprocessing needs a SQLite activities database, not {db_params.db_type}')
+    plugins = load_activity_plugins(plugin_dir, db_params)
+    upgraded = upgrade_tables(db_params, plugins)
+    recreated = {name for name, plugin in plugins.items() if set(upgraded.get(name, [])) & {table.__tablename__ for table in _derived_tables(plugin)}}
+    checkpoints = checkpoint_table()
+    act_db = ActivitiesDb(db_params)
+    with act_db.managed_session() as activity_db_session:
+        pending = {}
+        for plugin_name, activity_id in activity_db_session.query(checkpoints.plugin, checkpoints.activity_id).filter(checkpoints.done.is_(False)):
+            pending.setdefault(activity_id, []).append(plugin_name)
+        for plugin in plugins.values():
+            if 'record' in plugin._tables:
+                sync_indexes(activity_db_session.connection(), plugin._tables['record'].__tablename__, getattr(plugin, '_records_indexes', {}))
+    jobs = [(filename, pending[File.id_from_path(filename)]) for filename in filenames if File.id_from_path(filename) in pending]
+    results = {'reprocessed': {name: 0 for name in plugins}, 'failed': {}, 'missing': {}}
+    with tempfile.TemporaryDirectory(prefix='plugin_reprocess_', dir=staging_dir) as staging_root:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(plugin_dir, staging_root, measurement_system, background_writes)) as executor:
+            for start in range(0, len(jobs), batch_size):
+                done = []
+                replaced = {}
+                for filename, names, error, worker_dir in executor.map(_reprocess_file, jobs[start:start + batch_size]):
+                    if error:
+                        results['failed'][filename] = error
+                        continue
+                    activity_id = File.id_from_path(filename)
+                    for plugin_name in pending[activity_id]:
+                        # Plugins that no longer match the file keep their rows.
+                        if plugin_name in names:
+                            replaced.setdefault((worker_dir, plugin_name), []).append(activity_id)
+                            results['reprocessed'][plugin_name] += 1
+                    done.append(activity_id)
+                with act_db.managed_session() as activity_db_session:
+                    for (worker_dir, plugin_name), activity_ids in replaced.items():
+                        staging_db_params = DbParams(db_type='sqlite', db_path=worker_dir)
+                        replace_activities(activity_db_session, staging_db_params, _activity_tables(plugins[plugin_name]), activity_ids)
+                    query = activity_db_session.query(checkpoints).filter(checkpoints.activity_id.in_(done))
+                    query.update({checkpoints.done: True}, synchronize_session=False)
+                logger.info("Reprocessed %d of %d files", min(start + batch_size, len(jobs)), len(jobs))
+    with act_db.managed_session() as activity_db_session:
+        for plugin_name, plugin in plugins.items():
+            queued = activity_db_session.query(checkpoints).filter(checkpoints.plugin == plugin_name)
+            if queued.count() == 0:
+                if plugin_name in recreated:
+                    plugin.rebuild_derived_tables(activity_db_session)
+                continue
+            remaining = queued.filter(checkpoints.done.is_(False)).count()
+            if remaining:
+                results['missing'][plugin_name] = remaining
+                continue
+            if hasattr(plugin, 'rebuild_derived_tables'):
+                plugin.rebuild_derived_tables(activity_db_session)
+            queued.delete()
+    logger.info("Reprocessed plugin data: %r, %d failed, still queued: %r", results['reprocessed'], len(results['failed']), results['missing'])
+    return results
@@ -0,0 +1,189 @@
+"""Replace the records of old activities with downsampled tiers, and downsample records for plots with LTTB."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+
+import numpy as np
+from sqlalchemy import exists
+
+from garmindb.garmindb import ActivitiesDb
+
+from .record_arrays import read_record_arrays
+from .record_tiers import tier_columns
+from .record_cache import invalidate_records
+from .parallel_import import load_activity_plugins
+
+
+logger = logging.getLogger(__file__)
+
+
+def _none_for_nan(values):
+    return [None if value != value else value for value in values.tolist()]
+
+
+def bucket_summaries(timestamps, columns, seconds):
+    """
+    Return the tier table rows of an activity's records, without activity_id.
+
+    Parameters:
+    ----------
+        timestamps (ndarray): datetime64 record times
+        columns (dict): column name to ndarray of values, NaN for missing values
+        seconds (int): the bucket length, buckets start at the first record
+
+    Records without a timestamp are left out. Buckets without records are not returned.
+    """
+    valid = ~np.isnat(timestamps)
+    order = np.argsort(timestamps[valid], kind='stable')
+    timestamps = timestamps[valid][order]
+    if len(timestamps) == 0:
+        return []
+    buckets = (timestamps - timestamps[0]) // np.timedelta64(seconds, 's')
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    rows = {
+        'bucket'    : buckets[starts].tolist(),
+        'timestamp' : (timestamps[0] + buckets[starts] * np.timedelta64(seconds, 's')).astype('datetime64[ms]').tolist(),
+        'samples'   : np.diff(np.append(starts, len(timestamps))).tolist(),
+    }
+    for name, values in columns.items():
+        values = values.astype(np.float64)[valid][order]
+        present = ~np.isnan(values)
+        counts = np.add.reduceat(present, starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rows[f'{name}_mean'] = _none_for_nan(np.add.reduceat(np.where(present, values, 0.0), starts) / counts)
+        rows[f'{name}_min'] = _none_for_nan(np.fmin.reduceat(values, starts))
+        rows[f'{name}_max'] = _none_for_nan(np.fmax.reduceat(values, starts))
+    return [dict(zip(rows, values)) for values in zip(*rows.values())]
+
+
+def lttb(x, y, points):
+    """
+    Return the indices of the points picked by the Largest Triangle Three Buckets algorithm to plot y over x with points points.
+
+    The first and last points are kept. The points between are split into equal buckets and from each bucket the point that makes the
+    largest triangle with the point picked from the previous bucket and the mean of the next bucket is picked.
+    """
+    count = len(y)
+    if points >= count or points < 3:
+        return np.arange(count)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    every = (count - 2) / (points - 2)
+    indices = np.empty(points, dtype=np.int64)
+    indices[0] = picked = 0
+    for bucket in range(points - 2):
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, count)
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        areas = np.abs((x[picked] - next_x) * (y[start:end] - y[picked]) - (x[picked] - x[start:end]) * (next_y - y[picked]))
+        picked = indices[bucket + 1] = start + int(np.argmax(areas))
+    indices[-1] = count - 1
+    return indices
+
+
+def plot_series(activity_db_session, plugin, activity_id, column, points=1000):
+    """
+    Return (timestamps, values) arrays of a records column of an activity downsampled with LTTB to at most points points.
+
+    The records are used while the activity still has them, after that the means of the plugin's shortest tier.
+    """
+    arrays = read_record_arrays(activity_db_session, plugin, activity_id, ['timestamp', column])
+    timestamps = arrays.get('timestamp', np.array([], dtype='datetime64[ms]'))
+    values = arrays.get(column, np.array([])).astype(np.float64)
+    if len(timestamps) == 0 and plugin._records_tiers:
+        table = plugin._tables[f'tier_{min(plugin._records_tiers)}']
+        rows = activity_db_session.query(table.timestamp, getattr(table, f'{column}_mean')).filter(table.activity_id == activity_id).order_by(table.bucket).all()
+        timestamps = np.array([row[0] for row in rows], dtype='datetime64[ms]')
+        values = np.array([np.nan if row[1] is None else row[1] for row in rows], dtype=np.float64)
+    valid = ~np.isnat(timestamps) & ~np.isnan(values)
+    timestamps = timestamps[valid]
+    values = values[valid]
+    indices = lttb((timestamps - timestamps[:1]).astype(np.int64) if len(timestamps) else timestamps, values, points)
+    return timestamps[indices], values[indices]
+
+
+class RecordRetention():
+    """
+    Replaces the records of a plugin's activities that are older than the raw retention period with the plugin's tiers.
+
+    Activities are picked by their session timestamp and whether they still have records, so each run only reads the activities that
+    became older than the retention period since the last run, and a run that is stopped picks up where it stopped. The activities are
+    downsampled and their records deleted in batches, one transaction per batch.
+    """
+
+    def __init__(self, plugin, raw_days=None):
+        """
+        Return a RecordRetention instance.
+
+        Parameters:
+        ----------
+            plugin (RecordWriterMixin): a plugin with tables initialized that declares _records_tiers and has a sessions table
+            raw_days (int): the days to keep records for, defaults to the plugin's _records_raw_days
+
+        """
+        self.plugin = plugin
+        self.raw_days = plugin._records_raw_days if raw_days is None else raw_days
+        if self.raw_days is None:
+            raise ValueError(f'{plugin.__class__.__name__} has no records retention period')
+        if 'session' not in plugin._tables or not plugin._records_tiers:
+            # Without a sessions row an activity whose records were deleted would look like it was never imported.
+            raise ValueError(f'{plugin.__class__.__name__} needs a sessions table and records tiers for records retention')
+        self.tiers = {seconds: plugin._tables[f'tier_{seconds}'] for seconds in plugin._records_tiers}
+        self.columns = tier_columns(plugin._records_cols, tuple(plugin._records_fields) + tuple(plugin._records_computed))
+
+    def _raw_table(self):
+        return self.plugin._tables.get('record_columns', self.plugin._tables['record'])
+
+    def pending_activities(self, activity_db_session, cutoff):
+        """Return the ids of the activities with sessions before cutoff that still have records."""
+        session_table = self.plugin._tables['session']
+        raw_table = self._raw_table()
+        query = activity_db_session.query(session_table.activity_id).filter(session_table.timestamp < cutoff)
+        query = query.filter(exists().where(raw_table.activity_id == session_table.activity_id))
+        return [row[0] for row in query.order_by(session_table.timestamp)]
+
+    def downsample_activity(self, activity_db_session, activity_id, drop_records=True):
+        """Write the tier rows of an activity from its records, and delete the records unless drop_records is False."""
+        arrays = read_record_arrays(activity_db_session, self.plugin, activity_id, ['timestamp'] + self.columns)
+        timestamps = arrays.pop('timestamp', np.array([], dtype='datetime64[ms]'))
+        for seconds, table in self.tiers.items():
+            activity_db_session.query(table).filter(table.activity_id == activity_id).delete()
+            rows = [dict(row, activity_id=activity_id) for row in bucket_summaries(timestamps, arrays, seconds)]
+            if rows:
+                activity_db_session.execute(table.__table__.insert(), rows)
+        if drop_records:
+            raw_table = self._raw_table()
+            activity_db_session.query(raw_table).filter(raw_table.activity_id == activity_id).delete()
+            invalidate_records(raw_table.__tablename__, [activity_id])
+        return len(timestamps)
+
+    def run(self, db, now=None, batch_size=50):
+        """Downsample the activities that are older than the retention period and return the number of activities downsampled."""
+        cutoff = (now or datetime.datetime.now()) - datetime.timedelta(days=self.raw_days)
+        with db.managed_session() as activity_db_session:
+            activity_ids = self.pending_activities(activity_db_session, cutoff)
+        for start in range(0, len(activity_ids), batch_size):
+            records = 0
+            with db.managed_session() as activity_db_session:
+                for activity_id in activity_ids[start:start + batch_size]:
+                    records += self.downsample_activity(activity_db_session, activity_id)
+            logger.info("%s: replaced %d records of %d activities before %s with tiers", self.plugin.__class__.__name__, records,
+                        len(activity_ids[start:start + batch_size]), cutoff)
+        return len(activity_ids)
+
+
+def run_retention(db_params, plugin_dir, now=None, batch_size=50):
+    """Run the records retention of every plugin in plugin_dir that sets a retention period, return plugin name to activities downsampled."""
+    plugins = load_activity_plugins(plugin_dir, db_params)
+    act_db = ActivitiesDb(db_params)
+    return {
+        name: RecordRetention(plugin).run(act_db, now, batch_size)
+        for name, plugin in plugins.items() if getattr(plugin, '_records_raw_days', None) is not None
+    }
+
@@ -0,0 +1,131 @@
+"""Per day and per week rollups of plugin session metrics, updated as sessions are written."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+
+from sqlalchemy import Integer, Float, Date, String
+
+
+logger = logging.getLogger(__file__)
+
+
+rollup_table_version = 1
+rollup_periods = ('day', 'week')
+
+
+def rollup_tablename(sessions_tablename, period):
+    """Return the name of the table that holds the per period rollups of a sessions table."""
+    return f'{sessions_tablename}_{"daily" if period == "day" else "weekly"}'
+
+
+def rollup_table_cols():
+    """Return the columns of a rollup table, keyed by the first day of the period and the metric."""
+    return {
+        'period_start': {'args': [Date], 'kwargs': {'primary_key': True}},
+        'metric': {'args': [String], 'kwargs': {'primary_key': True}},
+        'count': {'args': [Integer]},
+        'total': {'args': [Float]},
+        'min': {'args': [Float]},
+        'max': {'args': [Float]},
+        'mean': {'args': [Float]}
+    }
+
+
+def period_start(timestamp, period):
+    """Return the date of the first day of the period, weeks start on Monday, that timestamp, a datetime or date, is in."""
+    day = timestamp.date() if isinstance(timestamp, datetime.datetime) else timestamp
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    return day
+
+
+class SessionRollups():
+    """
+    Keeps per day and per week count, total, min, max, and mean of a sessions table's metrics.
+
+    Sessions are added to their day and week rows as they are written, so trend queries read one row per period and metric instead
+    of the whole sessions table. The period is that of the session's local timestamp. rebuild() recomputes all rows from the sessions
+    table in one pass, for after sessions were updated or deleted, or rows were merged in from elsewhere.
+    """
+
+    def __init__(self, tables, metrics):
+        """
+        Return a SessionRollups instance.
+
+        Parameters:
+        ----------
+            tables (dict): period, day or week, to the rollup table
+            metrics (list): the sessions table columns to roll up, numeric
+
+        """
+        self.tables = tables
+        self.metrics = list(metrics)
+
+    @classmethod
+    def _add_value(cls, row, value):
+        row.count += 1
+        row.total += value
+        row.min = min(row.min, value)
+        row.max = max(row.max, value)
+        row.mean = row.total / row.count
+
+    def add(self, activity_db_session, session):
+        """Add a sessions table entry, a dict with a timestamp and the metrics, to the day and week rows it falls in."""
+        timestamp = session.get('timestamp')
+        if timestamp is None:
+            return
+        for period, table in self.tables.items():
+            start = period_start(timestamp, period)
+            for metric in self.metrics:
+                value = session.get(metric)
+                if value is None:
+                    continue
+                row = activity_db_session.get(table, (start, metric))
+                if row is None:
+                    activity_db_session.add(table(period_start=start, metric=metric, count=1, total=value, min=value, max=value, mean=value))
+                else:
+                    self._add_value(row, value)
+
+    def rebuild(self, activity_db_session, sessions_table):
+        """Recompute all rollup rows from the sessions table and return the number of rows written."""
+        columns = [getattr(sessions_table, metric) for metric in self.metrics]
+        rollups = {period: {} for period in self.tables}
+        for timestamp, *values in activity_db_session.query(sessions_table.timestamp, *columns).filter(sessions_table.timestamp.isnot(None)).yield_per(10000):
+            for period, rows in rollups.items():
+                start = period_start(timestamp, period)
+                for metric, value in zip(self.metrics, values):
+                    if value is None:
+                        continue
+                    row = rows.get((start, metric))
+                    if row is None:
+                        rows[(start, metric)] = {'period_start': start, 'metric': metric, 'count': 1, 'total': value, 'min': value, 'max': value}
+                    else:
+                        row['count'] += 1
+                        row['total'] += value
+                        row['min'] = min(row['min'], value)
+                        row['max'] = max(row['max'], value)
+        written = 0
+        for period, table in self.tables.items():
+            activity_db_session.query(table).delete()
+            rows = list(rollups[period].values())
+            for row in rows:
+                row['mean'] = row['total'] / row['count']
+            if rows:
+                activity_db_session.execute(table.__table__.insert(), rows)
+            written += len(rows)
+        logger.info("Rebuilt %d rollup rows of %s", written, sessions_table.__tablename__)
+        return written
+
+    def trend(self, activity_db_session, metric, period='week', start=None, end=None):
+        """Return a metric's rows as (period start, count, mean, min, max) tuples ordered by period, from the period start is in to end."""
+        table = self.tables[period]
+        query = activity_db_session.query(table.period_start, table.count, table.mean, table.min, table.max).filter(table.metric == metric)
+        if start is not None:
+            query = query.filter(table.period_start >= period_start(start, period))
+        if end is not None:
+            query = query.filter(table.period_start < (end.date() if isinstance(end, datetime.datetime) else end))
+        return [tuple(row) for row in query.order_by(table.period_start)]
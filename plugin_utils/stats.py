@@ -0,0 +1,42 @@
+"""Counters and timers for the database work done by plugins."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+
+class PluginStats():
+    """Counters and cumulative timers (in seconds) for a plugin's database work, as totals and per activity."""
+
+    names = ('rows_written', 'rows_skipped', 'activities_skipped', 'existence_checks', 'existence_check_time', 'inserts', 'insert_time')
+
+    def __init__(self):
+        """Return a PluginStats instance with all counters at zero."""
+        self.reset()
+
+    def reset(self):
+        """Set all counters to zero and forget the per activity counters."""
+        self.totals = dict.fromkeys(self.names, 0)
+        self.activities = {}
+
+    def add(self, activity_id, name, value=1):
+        """Add value to the counter name for activity_id and to the totals."""
+        self.totals[name] += value
+        activity = self.activities.get(activity_id)
+        if activity is None:
+            activity = self.activities[activity_id] = dict.fromkeys(self.names, 0)
+        activity[name] += value
+
+    def activity(self, activity_id):
+        """Return a dict of the counters for activity_id."""
+        return self.activities.get(activity_id, dict.fromkeys(self.names, 0))
+
+    @classmethod
+    def format(cls, counters):
+        """Return a one line summary of a dict of counters."""
+        return (f"{counters['rows_written']} rows written in {counters['inserts']} inserts ({counters['insert_time']:.3f}s), "
+                f"{counters['rows_skipped']} rows skipped, {counters['existence_checks']} existence checks ({counters['existence_check_time']:.3f}s)")
+
+    def __str__(self):
+        """Return a string representation of the totals."""
+        return f'{self.__class__.__name__}({len(self.activities)} activities: {self.format(self.totals)})'
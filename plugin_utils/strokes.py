@@ -0,0 +1,234 @@
+"""Streaming paddle stroke summaries: time at each stroke rate and per interval stroke counts, rates, and distances."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import logging
+import datetime
+import operator
+
+from sqlalchemy import Integer, Float, DateTime, String, ForeignKey
+
+from .record_writer import RecordWriterMixin
+
+
+logger = logging.getLogger(__file__)
+
+
+stroke_tables_version = 1
+stroke_rates_table_pk = ("activity_id", "stroke_rate")
+stroke_intervals_table_pk = ("activity_id", "interval")
+
+
+def stroke_rates_tablename(records_tablename):
+    """Return the name of the table that holds the stroke rate histograms of a records table's activities."""
+    return f'{records_tablename}_stroke_rates'
+
+
+def stroke_intervals_tablename(records_tablename):
+    """Return the name of the table that holds the per interval stroke summaries of a records table's activities."""
+    return f'{records_tablename}_intervals'
+
+
+def stroke_rates_table_cols():
+    """Return the columns of a stroke rate histogram table, the seconds spent in each stroke rate bin keyed by the bin's lowest rate."""
+    return {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'stroke_rate': {'args': [Integer], 'units': 'spm'},
+        'seconds': {'args': [Float], 'units': 'Seconds'}
+    }
+
+
+def stroke_intervals_table_cols():
+    """Return the columns of a stroke intervals table, one row per fixed length interval from the start of the activity."""
+    return {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'interval': {'args': [Integer]},
+        'timestamp': {'args': [DateTime]},
+        'seconds': {'args': [Float], 'units': 'Seconds'},
+        'strokes': {'args': [Integer]},
+        'avg_stroke_rate': {'args': [Float], 'units': 'spm'},
+        'max_stroke_rate': {'args': [Integer], 'units': 'spm'},
+        'avg_stroke_distance': {'args': [Float]}
+    }
+
+
+class StrokeAccumulator():
+    """
+    Accumulates a stroke rate histogram and per interval stroke summaries one record at a time.
+
+    Each record counts for the time since the previous record, capped at max_sample_seconds so pauses aren't counted. Only the current
+    interval is open, completed intervals are kept as rows. Strokes are counted from the app's running stroke count when the records
+    have one, otherwise they are estimated from the stroke rate and time.
+    """
+
+    def __init__(self, bin_spm=5, max_spm=150, interval_seconds=60, max_sample_seconds=5):
+        """
+        Return a StrokeAccumulator instance.
+
+        Parameters:
+        ----------
+            bin_spm (int): the width of the histogram bins in strokes per minute
+            max_spm (int): the lowest rate of the last histogram bin, which holds all higher rates
+            interval_seconds (int): the length of the intervals
+            max_sample_seconds (float): the most time a single record counts for
+
+        """
+        self.bin_spm = bin_spm
+        self.interval_seconds = interval_seconds
+        self.max_sample_seconds = max_sample_seconds
+        self.bin_seconds = [0.0] * (max_spm // bin_spm + 1)
+        self.intervals = []
+        self.rate_seconds = 0.0
+        self.rate_total = 0.0
+        self.max_stroke_rate = None
+        self.stroke_count = None
+        self.estimated_strokes = 0.0
+        self.stroke_distance_total = 0.0
+        self.stroke_distance_count = 0
+        self._start = None
+        self._previous = None
+        self._interval = None
+        self._interval_start_count = 0
+
+    def _bin(self, stroke_rate):
+        return min(int(stroke_rate // self.bin_spm), len(self.bin_seconds) - 1)
+
+    def _close_interval(self):
+        interval = self._interval
+        if interval is None:
+            return
+        if interval['count'] is not None:
+            # A running count that went down was restarted by the app.
+            strokes = interval['count'] - self._interval_start_count if interval['count'] >= self._interval_start_count else interval['count']
+            self._interval_start_count = interval['count']
+        else:
+            strokes = round(interval['rate_total'] / 60.0)
+        self.intervals.append({
+            'interval'              : interval['interval'],
+            'timestamp'             : self._start + datetime.timedelta(seconds=interval['interval'] * self.interval_seconds),
+            'seconds'               : interval['seconds'],
+            'strokes'               : strokes,
+            'avg_stroke_rate'       : interval['rate_total'] / interval['rate_seconds'] if interval['rate_seconds'] else None,
+            'max_stroke_rate'       : interval['max_stroke_rate'],
+            'avg_stroke_distance'   : interval['distance_total'] / interval['distance_count'] if interval['distance_count'] else None,
+        })
+        self._interval = None
+
+    def add(self, timestamp, stroke_rate, strokes=None, stroke_distance=None):
+        """Add a record taken at timestamp, a datetime, with its stroke rate, running stroke count, and stroke distance, any can be None."""
+        if timestamp is None:
+            return
+        if self._start is None:
+            self._start = timestamp
+        seconds = 1.0 if self._previous is None else min(max((timestamp - self._previous).total_seconds(), 0.0), self.max_sample_seconds)
+        self._previous = timestamp
+        index = int((timestamp - self._start).total_seconds() // self.interval_seconds)
+        if self._interval is None or self._interval['interval'] != index:
+            self._close_interval()
+            self._interval = {'interval': index, 'seconds': 0.0, 'rate_seconds': 0.0, 'rate_total': 0.0, 'max_stroke_rate': None, 'count': None,
+                              'distance_total': 0.0, 'distance_count': 0}
+        interval = self._interval
+        interval['seconds'] += seconds
+        if stroke_rate is not None:
+            self.bin_seconds[self._bin(stroke_rate)] += seconds
+            self.rate_seconds += seconds
+            self.rate_total += stroke_rate * seconds
+            self.estimated_strokes += stroke_rate * seconds / 60.0
+            interval['rate_seconds'] += seconds
+            interval['rate_total'] += stroke_rate * seconds
+            if interval['max_stroke_rate'] is None or stroke_rate > interval['max_stroke_rate']:
+                interval['max_stroke_rate'] = stroke_rate
+            if self.max_stroke_rate is None or stroke_rate > self.max_stroke_rate:
+                self.max_stroke_rate = stroke_rate
+        if strokes is not None:
+            interval['count'] = strokes
+            self.stroke_count = strokes
+        if stroke_distance is not None:
+            self.stroke_distance_total += stroke_distance
+            self.stroke_distance_count += 1
+            interval['distance_total'] += stroke_distance
+            interval['distance_count'] += 1
+
+    def histogram(self):
+        """Return the stroke rate histogram as (lowest stroke rate of the bin, seconds) tuples for the bins with time in them."""
+        return [(index * self.bin_spm, seconds) for index, seconds in enumerate(self.bin_seconds) if seconds > 0]
+
+    def interval_rows(self):
+        """Close the current interval and return the intervals as dicts of the stroke intervals table columns without activity_id."""
+        self._close_interval()
+        return self.intervals
+
+    def summary(self):
+        """Return a dict of the time weighted mean and the max stroke rate, the strokes, and the mean stroke distance."""
+        return {
+            'avg_stroke_rate'       : self.rate_total / self.rate_seconds if self.rate_seconds else None,
+            'max_stroke_rate'       : self.max_stroke_rate,
+            'strokes'               : self.stroke_count if self.stroke_count is not None else (round(self.estimated_strokes) if self.rate_seconds else None),
+            'avg_stroke_distance'   : self.stroke_distance_total / self.stroke_distance_count if self.stroke_distance_count else None,
+        }
+
+
+class StrokeRecordsMixin(RecordWriterMixin):
+    """
+    Mixin for paddle plugins that summarize the strokes in their records as the records are imported.
+
+    The records table can have stroke_rate, strokes, the app's running stroke count, and stroke_distance columns. Each activity gets
+    a histogram of the time spent at each stroke rate, _stroke_rate_bin strokes per minute wide, in <records table>_stroke_rates, and a
+    row per _stroke_interval_seconds of the activity with the interval's strokes, mean and max stroke rate, and mean stroke distance in
+    <records table>_intervals, see StrokeAccumulator. Plugins call _write_strokes with the sessions table entry before writing it.
+    """
+
+    _stroke_rate_bin = 5
+    _stroke_interval_seconds = 60
+    _stroke_columns = ('timestamp', 'stroke_rate', 'strokes', 'stroke_distance')
+
+    @classmethod
+    def init_activity(cls, act_db_class, activities_table):
+        """Initialize the plugin tables, including the stroke rate histogram and stroke intervals tables."""
+        super().init_activity(act_db_class, activities_table)
+        if 'stroke_rates' not in cls._tables:
+            cls._tables['stroke_rates'] = activities_table.create(stroke_rates_tablename(cls._records_tablename), act_db_class, stroke_tables_version,
+                                                                  stroke_rates_table_pk, stroke_rates_table_cols())
+        if 'stroke_intervals' not in cls._tables:
+            cls._tables['stroke_intervals'] = activities_table.create(stroke_intervals_tablename(cls._records_tablename), act_db_class,
+                                                                      stroke_tables_version, stroke_intervals_table_pk, stroke_intervals_table_cols())
+
+    def _stroke_accumulator(self, fit_file):
+        file_cache = self._file_cache(fit_file)
+        accumulator = file_cache.get('strokes')
+        if accumulator is None:
+            accumulator = file_cache['strokes'] = StrokeAccumulator(self._stroke_rate_bin, interval_seconds=self._stroke_interval_seconds)
+        return accumulator
+
+    def _stroke_values(self):
+        """Return a getter of the _stroke_columns values from a records row with None appended, for the columns the records don't have."""
+        cls = type(self)
+        getter = cls.__dict__.get('_stroke_values_getter')
+        if getter is None:
+            columns = self._records_columns()
+            getter = operator.itemgetter(*[columns.index(name) if name in columns else len(columns) for name in self._stroke_columns])
+            cls._stroke_values_getter = getter
+        return getter
+
+    def _record_row(self, fit_file, activity_id, record_num, message_fields):
+        """Return a records table row and add its strokes to the activity's stroke summaries."""
+        row = super()._record_row(fit_file, activity_id, record_num, message_fields)
+        self._stroke_accumulator(fit_file).add(*self._stroke_values()(row + (None,)))
+        return row
+
+    def _write_strokes(self, activity_db_session, fit_file, session):
+        """Write the stroke rate histogram and stroke intervals of a session's activity and fill in the session's missing stroke columns."""
+        activity_id = session['activity_id']
+        accumulator = self._stroke_accumulator(fit_file)
+        histogram = [{'activity_id': activity_id, 'stroke_rate': stroke_rate, 'seconds': seconds} for stroke_rate, seconds in accumulator.histogram()]
+        if histogram:
+            activity_db_session.execute(self._tables['stroke_rates'].__table__.insert(), histogram)
+        intervals = [dict(row, activity_id=activity_id) for row in accumulator.interval_rows()]
+        if intervals:
+            activity_db_session.execute(self._tables['stroke_intervals'].__table__.insert(), intervals)
+        logger.debug("%s: %d stroke rate bins and %d intervals for %s", self.__class__.__name__, len(histogram), len(intervals), activity_id)
+        for name, value in accumulator.summary().items():
+            if name in self._sessions_cols and session.get(name) is None:
+                session[name] = value
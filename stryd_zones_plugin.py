@@ -10,9 +10,34 @@ from sqlalchemy import Integer, Float, DateTime, String, ForeignKey, Time
 
 from garmindb import ActivityFitPluginBase
 
+from plugin_utils import RecordWriterMixin, MaterializedView, PowerZoneAccumulator
+try:
+    from plugin_utils.record_arrays import read_record_arrays
+    from plugin_utils.power_curve import power_series, mean_max_power
+except ImportError:
+    # NumPy is needed for power curves, without it they aren't computed.
+    mean_max_power = None
+
 
 logger = logging.getLogger(__file__)
 
+columnar_records = False
+materialize_activity_view = False
+raw_record_days = None
+
+# Your Stryd critical power in Watts, the power zones are fractions of it.
+critical_power = 250
+# Where Stryd zones 2 to 5 (moderate, threshold, interval, and repetition) start as a fraction of critical power, zone 1 is easy.
+power_zones = [0.8, 0.9, 1.0, 1.15]
+if power_zones != sorted(power_zones):
+    logger.error("stryd_zones power_zones must be in ascending order, using them sorted: %r", power_zones)
+    power_zones = sorted(power_zones)
+
+
+def zone_columns():
+    """Return the names of the session columns that hold the seconds spent in each power zone, one more than power_zones."""
+    return [f'zone_{zone}_seconds' for zone in range(1, len(power_zones) + 2)]
+
 
 def ms_to_dt_time(time_ms):
     """Convert time in milli seconds to a datetime object."""
@@ -20,39 +45,40 @@ def ms_to_dt_time(time_ms):
         return (datetime.datetime.min + datetime.timedelta(milliseconds=time_ms)).time()
 
 
-# @classmethod
-# def create_activity_view(cls, act_db):
-#     """Create a database view for the Stryd Zones plugin data."""
-#     view_selectable = [
-#         cls.activity_id.label('activity_id'),
-#         cls.activities_table.name.label('name'),
-#         cls.activities_table.description.label('description'),
-#         cls.activities_table.sub_sport.label('sub_sport'),
-#         cls.activities_table.start_time.label('start_time'),
-#         cls.activities_table.stop_time.label('stop_time'),
-#         cls.activities_table.elapsed_time.label('elapsed_time'),
-#         cls.activities_table.avg_hr.label('avg_hr'),
-#         cls.activities_table.max_hr.label('max_hr'),
-#         cls.activities_table.avg_rr.label('avg_rr'),
-#         cls.activities_table.max_rr.label('max_rr'),
-#         cls.round_ext_col(cls.activities_table, 'calories'),
-#         cls.round_ext_col(cls.activities_table, 'avg_temperature'),
-#         cls.activities_table.avg_cadence.label('avg_rpms'),
-#         cls.activities_table.max_cadence.label('max_rpms'),
-#         cls.round_ext_col(cls.activities_table, 'avg_speed'),
-#         cls.round_ext_col(cls.activities_table, 'max_speed'),
-#         cls.stance_time.label('stance_time'),
-#         cls.round_col('avg_vertical_oscillation'),
-#         cls.round_col('power'),
-#         cls.activities_table.training_effect.label('training_effect'),
-#         cls.activities_table.anaerobic_training_effect.label('anaerobic_training_effect')
-#     ]
-#     view_name = 'stryd_zones_activities'
-#     logger.info("Creating view %s of %s and %s if needed.", view_name, cls, cls.activities_table)
-#     cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
-
-
-class stryd_zones(ActivityFitPluginBase):
+@classmethod
+def create_activity_view(cls, act_db):
+    """Create a database view for the Stryd Zones plugin data."""
+    view_selectable = [
+        cls.activities_table.activity_id.label('activity_id'),
+        cls.activities_table.name.label('name'),
+        cls.activities_table.description.label('description'),
+        cls.activities_table.sub_sport.label('sub_sport'),
+        cls.activities_table.start_time.label('start_time'),
+        cls.activities_table.stop_time.label('stop_time'),
+        cls.activities_table.elapsed_time.label('elapsed_time'),
+        cls.activities_table.avg_hr.label('avg_hr'),
+        cls.activities_table.max_hr.label('max_hr'),
+        cls.round_ext_col(cls.activities_table, 'calories'),
+        cls.activities_table.avg_cadence.label('avg_rpms'),
+        cls.round_ext_col(cls.activities_table, 'avg_speed'),
+        cls.critical_power.label('critical_power'),
+        cls.round_col('avg_power'),
+        cls.round_col('max_power'),
+        cls.round_col('normalized_power'),
+        cls.round_col('work'),
+        *[getattr(cls, name).label(name) for name in zone_columns()],
+        cls.activities_table.training_effect.label('training_effect'),
+        cls.activities_table.anaerobic_training_effect.label('anaerobic_training_effect')
+    ]
+    view_name = 'stryd_zones_activities'
+    logger.info("Creating view %s of %s and %s if needed.", view_name, cls, cls.activities_table)
+    if materialize_activity_view:
+        MaterializedView(view_name, cls, view_selectable).create(act_db)
+    else:
+        cls.create_join_view(act_db, view_name, view_selectable, cls.activities_table, order_by=cls.activities_table.start_time.desc())
+
+
+class stryd_zones(RecordWriterMixin, ActivityFitPluginBase):
     """Plugin for processing for the IQ data field stryd zones."""
 
     _application_id = bytearray(b'\x18\xfb,\xf0\x1aKC\r\xadf\x98\x8c\x84t!\xf4')
@@ -72,29 +98,203 @@ class stryd_zones(ActivityFitPluginBase):
         'form_power': {'args': [Float], 'units': 'Watts'},
         'leg_spring_stiffness': {'args': [Float], 'units': 'kN/m'}
     }
+    _records_columnar = columnar_records
+    _records_indexes = {
+        'timestamp': ['timestamp'],
+        'activity_timestamp': ['activity_id', 'timestamp']
+    }
+    _records_fields = {
+        'power': {'fields': ['dev_Power', 'power']},
+        'cadence': {'fields': ['dev_cadence']},
+        'stance_time': {'fields': ['dev_stance_time'], 'convert': ms_to_dt_time},
+        'avg_vertical_oscillation': {'fields': ['dev_avg_vertical_oscillation']},
+        'elevation': {'fields': ['dev_Elevation']},
+        'form_power': {'fields': ['dev_Form Power']},
+        'leg_spring_stiffness': {'fields': ['dev_Leg Spring Stiffness']}
+    }
+
+    _records_tiers = (10, 60)
+    _records_raw_days = raw_record_days
+
+    _sessions_tablename = 'stryd_zones_sessions'
+    _sessions_version = 1
+    _sessions_cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')], 'kwargs': {'primary_key': True}},
+        'timestamp': {'args': [DateTime]},
+        'critical_power': {'args': [Integer], 'units': 'Watts'},
+        'avg_power': {'args': [Float], 'units': 'Watts'},
+        'max_power': {'args': [Float], 'units': 'Watts'},
+        'normalized_power': {'args': [Float], 'units': 'Watts'},
+        'work': {'args': [Float], 'units': 'kJ'},
+        **{name: {'args': [Float], 'units': 'Seconds'} for name in zone_columns()}
+    }
+    # The session values are computed from the records.
+    _sessions_fields = {}
+
+    _power_curve_tablename = 'stryd_power_curve'
+    _power_curve_version = 1
+    _power_curve_pk = ("activity_id", "duration")
+    _power_curve_cols = {
+        'activity_id': {'args': [String, ForeignKey('activities.activity_id')]},
+        'duration': {'args': [Integer], 'units': 'Seconds'},
+        'power': {'args': [Float], 'units': 'Watts'},
+        'timestamp': {'args': [DateTime]}
+    }
+    _power_curve_best_tablename = 'stryd_power_curve_best'
+    _power_curve_best_version = 1
+    _power_curve_best_cols = {
+        'duration': {'args': [Integer], 'kwargs': {'primary_key': True}, 'units': 'Seconds'},
+        'power': {'args': [Float], 'units': 'Watts'},
+        'activity_id': {'args': [String]},
+        'timestamp': {'args': [DateTime]}
+    }
+
+    _sessions_rollups = ('avg_power', 'normalized_power', 'work')
 
     _tables = {}
-    # _views = {'activity_view': create_activity_view}
+    _views = {'activity_view': create_activity_view}
+
+    @classmethod
+    def init_activity(cls, act_db_class, activities_table):
+        """Initialize the plugin tables, including the power curve tables."""
+        super().init_activity(act_db_class, activities_table)
+        if 'power_curve' not in cls._tables:
+            cls._tables['power_curve'] = activities_table.create(cls._power_curve_tablename, act_db_class, cls._power_curve_version, cls._power_curve_pk,
+                                                                 cls._power_curve_cols)
+        if 'power_curve_best' not in cls._tables:
+            cls._tables['power_curve_best'] = activities_table.create(cls._power_curve_best_tablename, act_db_class, cls._power_curve_best_version,
+                                                                      cols=cls._power_curve_best_cols)
+
+    def _merge_best_power_curve(self, activity_db_session, curve):
+        """Update the all time best power curve with the rows of an activity's power curve where it is better."""
+        best_table = self._tables['power_curve_best']
+        best = {row.duration: row for row in activity_db_session.query(best_table)}
+        for row in curve:
+            current = best.get(row['duration'])
+            if current is None:
+                best[row['duration']] = best_table(**row)
+                activity_db_session.add(best[row['duration']])
+            elif row['power'] > current.power:
+                current.update_from_dict(row)
+
+    def _update_power_curve(self, activity_db_session, activity_id):
+        """Compute, cache, and merge into the all time best the power curve of an activity from its stored records."""
+        arrays = read_record_arrays(activity_db_session, self, activity_id, ['timestamp', 'power'])
+        if len(arrays.get('power', ())) == 0 or not (arrays['power'] > 0).any():
+            return
+        timestamps = arrays['timestamp']
+        start_time = timestamps[0].astype(datetime.datetime)
+        curve = [
+            {
+                'activity_id'   : activity_id,
+                'duration'      : duration,
+                'power'         : power,
+                'timestamp'     : start_time + datetime.timedelta(seconds=start),
+            }
+            for duration, power, start in mean_max_power(power_series(timestamps, arrays['power']))
+        ]
+        curve_table = self._tables['power_curve']
+        activity_db_session.query(curve_table).filter(curve_table.activity_id == activity_id).delete()
+        activity_db_session.execute(curve_table.__table__.insert(), curve)
+        self._merge_best_power_curve(activity_db_session, curve)
+
+    def update_power_curves(self, activity_db_session, activity_ids=None):
+        """
+        Compute the power curves of already imported activities.
+
+        Parameters:
+        ----------
+            activity_db_session (Session): a session on the activities database
+            activity_ids (list): the activities to update, defaults to the activities that have records but no power curve
+
+        Returns the number of activities updated.
+        """
+        if mean_max_power is None:
+            raise RuntimeError('Computing power curves needs NumPy')
+        if activity_ids is None:
+            record_table = self._tables.get('record_columns', self._tables['record'])
+            cached = activity_db_session.query(self._tables['power_curve'].activity_id)
+            activity_ids = [row[0] for row in activity_db_session.query(record_table.activity_id).filter(record_table.activity_id.not_in(cached)).distinct()]
+        for activity_id in activity_ids:
+            self._update_power_curve(activity_db_session, activity_id)
+        logger.info("Updated the power curves of %d activities", len(activity_ids))
+        return len(activity_ids)
+
+    def rebuild_best_power_curve(self, activity_db_session):
+        """Rebuild the all time best power curve from the cached activity power curves, after activities were deleted for instance."""
+        activity_db_session.query(self._tables['power_curve_best']).delete()
+        curve_table = self._tables['power_curve']
+        curve = [{name: getattr(row, name) for name in ('activity_id', 'duration', 'power', 'timestamp')} for row in activity_db_session.query(curve_table)]
+        self._merge_best_power_curve(activity_db_session, curve)
+
+    def _derived_table_keys(self):
+        """Return the keys of the tables computed across activities, including the all time best power curve keyed on duration."""
+        return super()._derived_table_keys() + ['power_curve_best']
+
+    def rebuild_derived_tables(self, activity_db_session):
+        """Recompute the tables computed across activities, including the all time best power curve."""
+        super().rebuild_derived_tables(activity_db_session)
+        self.rebuild_best_power_curve(activity_db_session)
+
+    def best_power_curve(self, activity_db_session, start=None, end=None):
+        """
+        Return the best power curve as a dict of duration to a (power, activity_id, timestamp) tuple.
+
+        Without a date range the all time best is read from its table, otherwise it is taken from the cached activity curves whose best
+        efforts started from start up to, but not including, end.
+        """
+        if start is None and end is None:
+            best_table = self._tables['power_curve_best']
+            return {row.duration: (row.power, row.activity_id, row.timestamp) for row in activity_db_session.query(best_table)}
+        curve_table = self._tables['power_curve']
+        query = activity_db_session.query(curve_table.duration, curve_table.power, curve_table.activity_id, curve_table.timestamp)
+        if start is not None:
+            query = query.filter(curve_table.timestamp >= start)
+        if end is not None:
+            query = query.filter(curve_table.timestamp < end)
+        best = {}
+        for duration, power, activity_id, timestamp in query.order_by(curve_table.duration, curve_table.power.desc()):
+            best.setdefault(duration, (power, activity_id, timestamp))
+        return best
+
+    def _power_accumulator(self, fit_file):
+        file_cache = self._file_cache(fit_file)
+        accumulator = file_cache.get('power')
+        if accumulator is None:
+            accumulator = file_cache['power'] = PowerZoneAccumulator([critical_power * fraction for fraction in power_zones])
+        return accumulator
+
+    def _record_row(self, fit_file, activity_id, record_num, message_fields):
+        """Return a records table row and add its power to the activity's power summary."""
+        row = super()._record_row(fit_file, activity_id, record_num, message_fields)
+        # power follows the activity_id, record, and timestamp columns.
+        self._power_accumulator(fit_file).add(row[2], row[3])
+        return row
 
     def write_record_entry(self, activity_db_session, fit_file, activity_id, message_fields, record_num):
         """Write a record message into the plugin records table."""
         record = {
             'cadence': message_fields.get('dev_cadence')
         }
-        record_table = self._tables['record']
-        if not record_table.s_exists(activity_db_session, {'activity_id' : activity_id, 'record' : record_num}):
-            plugin_record = {
-                'activity_id'                   : activity_id,
-                'record'                        : record_num,
-                'timestamp'                     : fit_file.utc_datetime_to_local(message_fields.timestamp),
-                # 'power'                         : message_fields.get('dev_Power'),
-                'stance_time'                   : ms_to_dt_time(message_fields.get('dev_stance_time')),
-                'avg_vertical_oscillation'      : message_fields.get('dev_avg_vertical_oscillation'),
-                'elevation'                     : message_fields.get('dev_Elevation'),
-                'form_power'                    : message_fields.get('dev_Form Power'),
-                'leg_spring_stiffness'          : message_fields.get('dev_Leg Spring Stiffness')
-            }
-            plugin_record.update(record)
-            logger.info("writing %s record %r for %s", self.__class__.__name__, plugin_record, fit_file.filename)
-            activity_db_session.add(record_table(**plugin_record))
+        self._import_record(activity_db_session, fit_file, activity_id, record_num, message_fields)
         return record
+
+    def write_session_entry(self, activity_db_session, fit_file, activity_id, message_fields):
+        """Write the buffered records and the power summary accumulated from them into the plugin sessions table."""
+        self._flush_records(activity_db_session)
+        if not self._activity_imported(activity_db_session, activity_id):
+            session = self._session_entry(fit_file, activity_id, message_fields)
+            summary = self._power_accumulator(fit_file).summary()
+            session.update({
+                'critical_power'    : critical_power,
+                'avg_power'         : summary['avg_power'],
+                'max_power'         : summary['max_power'],
+                'normalized_power'  : summary['normalized_power'],
+                'work'              : summary['work'],
+            })
+            session.update({name: summary[name] for name in zone_columns()})
+            logger.debug("writing %s session %r for %s", self.__class__.__name__, session, fit_file.filename)
+            if mean_max_power is not None:
+                self._update_power_curve(activity_db_session, activity_id)
+            self._write_session(activity_db_session, session)
+        return {}
@@ -0,0 +1,91 @@
+"""Shared fixtures for the plugin tests."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import sys
+import datetime
+
+import pytest
+import fitfile
+from fitfile.data_message import MessageFields
+from idbutils import DbParams
+from garmindb import PluginManager
+from garmindb.garmindb import ActivitiesDb, Activities
+
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+
+class FakeFitFile():
+    """The parts of a parsed fitfile.File that the plugins use."""
+
+    utc_datetime_to_local = fitfile.File.utc_datetime_to_local
+
+    def __init__(self, activity_id, application_id, dev_fields, utc_offset=-4 * 3600):
+        self.filename = f'/activities/{activity_id}.fit'
+        self.dev_application_ids = [application_id]
+        self.dev_fields = {name: {} for name in dev_fields}
+        self.local_tz = datetime.timezone(datetime.timedelta(seconds=utc_offset))
+
+
+def record_messages(start, count, **fields):
+    """Return count record message fields a second apart from start, field values can be functions of the record number."""
+    return [MessageFields(timestamp=start + datetime.timedelta(seconds=index), **{name: value(index) if callable(value) else value for name, value in fields.items()})
+            for index in range(count)]
+
+
+class Message():
+    """A parsed FIT message."""
+
+    def __init__(self, fields):
+        self.fields = fields
+
+
+class FailingMessage():
+    """A FIT message that fails to parse."""
+
+    @property
+    def fields(self):
+        raise ValueError('corrupt message')
+
+
+def dozen_run_file(plugin, activity_id, fail_after=None, records=20):
+    """Return a Dozen Run activity file with records records, the record after fail_after fails to parse."""
+    start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('eE', 'rE', 'tpRE'))
+    record_list = [Message(fields) for fields in record_messages(start, records, dev_eE=10.0, dev_rE=1.0, dev_tpRE=2.0)]
+    if fail_after is not None:
+        record_list[fail_after] = FailingMessage()
+    messages = {
+        fitfile.MessageType.record: record_list,
+        fitfile.MessageType.session: [Message(MessageFields(timestamp=start, sport=fitfile.Sport.running, dev_aE=1.0, dev_tS=100))]
+    }
+    fit_file.message_types = list(messages)
+    fit_file.__class__ = type('FakeActivityFile', (FakeFitFile,), {'__getitem__': lambda self, message_type: messages[message_type]})
+    return fit_file
+
+
+@pytest.fixture(scope='session')
+def plugins(tmp_path_factory):
+    """Return the repository's activity plugins with their tables initialized."""
+    db_params = DbParams(db_type='sqlite', db_path=str(tmp_path_factory.mktemp('plugins')))
+    plugins = PluginManager(repo_dir, db_params).plugins.get('ActivityFit', {})
+    for plugin in plugins.values():
+        plugin.init_activity(ActivitiesDb, Activities)
+    return plugins
+
+
+@pytest.fixture
+def db_params(tmp_path):
+    """Return the parameters of an activities database in a temporary directory."""
+    return DbParams(db_type='sqlite', db_path=str(tmp_path))
+
+
+@pytest.fixture
+def act_db(plugins, db_params):
+    """Return an empty activities database with the plugin tables."""
+    return ActivitiesDb(db_params)
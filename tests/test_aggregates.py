@@ -0,0 +1,76 @@
+"""Tests of the streaming record aggregates."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import random
+
+import pytest
+
+from plugin_utils.aggregates import RunningStats, P2Quantile, SessionAggregator
+
+
+np = pytest.importorskip('numpy')
+
+
+def test_running_stats():
+    values = [random.Random(1).gauss(100, 15) for _ in range(1000)]
+    stats = RunningStats()
+    for value in values + [None]:
+        stats.add(value)
+    assert stats.count == 1000
+    assert stats.mean == pytest.approx(np.mean(values))
+    assert stats.stddev == pytest.approx(np.std(values, ddof=1))
+    assert (stats.min, stats.max) == (min(values), max(values))
+
+
+def test_running_stats_few_values():
+    stats = RunningStats()
+    assert (stats.count, stats.mean, stats.stddev) == (0, None, None)
+    stats.add(3)
+    assert (stats.mean, stats.min, stats.max, stats.stddev) == (3, 3, 3, None)
+
+
+@pytest.mark.parametrize('quantile', [0.1, 0.5, 0.9, 0.99])
+def test_p2_quantile_matches_percentile(quantile):
+    generator = random.Random(1)
+    values = np.array([generator.gauss(100, 15) for _ in range(20000)])
+    estimator = P2Quantile(quantile)
+    for value in values:
+        estimator.add(value)
+    # P² has no error bound, but once markers settle the estimate's rank is within a percent of the quantile.
+    assert estimator.value == pytest.approx(np.percentile(values, quantile * 100), abs=0.5)
+    assert (values < estimator.value).mean() == pytest.approx(quantile, abs=0.01)
+
+
+def test_p2_quantile_skewed_stream():
+    generator = random.Random(3)
+    values = [generator.expovariate(0.01) for _ in range(20000)]
+    estimator = P2Quantile(0.9)
+    for value in values:
+        estimator.add(value)
+    assert estimator.value == pytest.approx(np.percentile(values, 90), rel=0.02)
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 4, 5])
+def test_p2_quantile_exact_for_few_values(count):
+    values = [7.0, 1.0, 4.0, 9.0, 2.0][:count]
+    estimator = P2Quantile(0.75)
+    for value in values:
+        estimator.add(value)
+    assert estimator.value == pytest.approx(np.percentile(values, 75))
+
+
+def test_session_aggregator():
+    aggregator = SessionAggregator({'avg_power': ('power', 'mean'), 'max_power': ('power', 'max'), 'power_p50': ('power', 'p50'),
+                                    'avg_cadence': ('cadence', 'mean')}, ['activity_id', 'record', 'power', 'cadence'])
+    for record in range(101):
+        aggregator.add(('1', record, float(record), None))
+    values = aggregator.values()
+    assert values == {'avg_power': pytest.approx(50.0), 'max_power': 100.0, 'power_p50': pytest.approx(50.0, abs=1), 'avg_cadence': None}
+
+
+def test_session_aggregator_unknown_statistic():
+    with pytest.raises(ValueError):
+        SessionAggregator({'power_median': ('power', 'median')}, ['activity_id', 'record', 'power'])
@@ -0,0 +1,65 @@
+"""Tests of the streaming beat to beat interval artifact filter."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import random
+
+import pytest
+
+from plugin_utils import ArtifactFilter
+
+
+def test_out_of_range_intervals_are_artifacts():
+    artifact_filter = ArtifactFilter()
+    assert artifact_filter.filter(250) == (None, True)
+    assert artifact_filter.filter(2500) == (None, True)
+    for interval in (800, 820, 810):
+        assert artifact_filter.filter(interval) == (interval, False)
+    assert artifact_filter.filter(299) == (810, True)
+    assert artifact_filter.filter(2001) == (810, True)
+    assert artifact_filter.filter(300) == (300, False)
+    assert artifact_filter.filter(2000) == (2000, False)
+
+
+@pytest.mark.parametrize('dropout', [None, 0])
+def test_dropouts_are_replaced_by_the_median(dropout):
+    artifact_filter = ArtifactFilter()
+    assert artifact_filter.filter(dropout) == (None, True)
+    for interval in (800, 900):
+        artifact_filter.filter(interval)
+    assert artifact_filter.filter(dropout) == (850, True)
+    # Dropouts don't go into the buffer.
+    assert artifact_filter.median() == 850
+
+
+def test_deviation_checked_once_min_samples_reached():
+    artifact_filter = ArtifactFilter(min_samples=5)
+    for interval in (800, 800, 800):
+        artifact_filter.filter(interval)
+    # Too few intervals to trust the median yet.
+    assert artifact_filter.filter(1200) == (1200, False)
+    artifact_filter.reset()
+    for interval in (800, 800, 800, 800, 800):
+        artifact_filter.filter(interval)
+    assert artifact_filter.filter(1200) == (800, True)
+    assert artifact_filter.filter(959) == (959, False)
+    assert artifact_filter.filter(641) == (641, False)
+    assert artifact_filter.filter(639) == (800, True)
+
+
+def test_median_follows_heart_rate_changes():
+    artifact_filter = ArtifactFilter(size=5, min_samples=3)
+    flagged = [artifact_filter.filter(interval)[1] for interval in [1000] * 5 + [600] * 10]
+    # The lower intervals are flagged until they are the majority of the buffer.
+    assert flagged == [False] * 5 + [True] * 3 + [False] * 7
+
+
+def test_buffer_is_bounded():
+    artifact_filter = ArtifactFilter(size=11)
+    generator = random.Random(1)
+    for _ in range(100000):
+        artifact_filter.filter(generator.choice([None, 0, 100, 5000, generator.gauss(800, 50)]))
+    assert len(artifact_filter._recent) == 11
+    assert artifact_filter._recent.maxlen == 11
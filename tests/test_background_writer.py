@@ -0,0 +1,42 @@
+"""Tests of the background plugin writer thread."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import pytest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, select, func
+
+from plugin_utils.background_writer import BackgroundWriter
+
+
+class FailingEngine():
+    """An engine whose connections can't be opened."""
+
+    def connect(self):
+        raise OSError('database is gone')
+
+
+def test_rows_committed_on_sync(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/writer.db')
+    table = Table('rows', MetaData(), Column('value', Integer))
+    table.create(engine)
+    writer = BackgroundWriter(engine, transaction_rows=3)
+    for value in range(5):
+        writer.put(table, [{'value': value}, {'value': value + 10}])
+    writer.sync()
+    with engine.connect() as connection:
+        assert connection.execute(select(func.count()).select_from(table)).scalar() == 10
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.put(table, [{'value': 1}])
+
+
+def test_sync_raises_when_writer_thread_stopped():
+    writer = BackgroundWriter(FailingEngine(), queue_size=1, poll_seconds=0.05)
+    writer._thread.join(5)
+    with pytest.raises(RuntimeError, match='database is gone'):
+        writer.sync()
+    with pytest.raises(RuntimeError, match='closed'):
+        writer.sync()
+    writer.close()
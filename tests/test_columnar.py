@@ -0,0 +1,105 @@
+"""Tests of the columnar records storage and the records array reads."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+import pytest
+from fitfile.data_message import MessageFields
+from sqlalchemy import Integer, Float, DateTime, Time, Boolean
+from garmindb.garmindb import ActivitiesDb, Activities
+
+from plugin_utils.columnar import column_encoding, encode_column
+
+from conftest import FakeFitFile, record_messages
+
+
+np = pytest.importorskip('numpy')
+record_arrays = pytest.importorskip('plugin_utils.record_arrays')
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def round_trip(values, encoding, typecode):
+    encoded = encode_column(values, encoding, typecode)
+    assert (encoded['nulls'] is None) == (None not in values)
+    return record_arrays.decode_column(encoded['encoding'], encoded['typecode'], encoded['count'], encoded['data'], encoded['nulls'])
+
+
+@pytest.mark.parametrize('name, column_type, encoding', [
+    ('record', Integer(), ('delta', 'q')), ('timestamp', DateTime(), ('datetime', 'q')), ('time', Time(), ('time', 'i')),
+    ('flag', Boolean(), ('plain', 'b')), ('speed', Float(), ('plain', 'd')), ('count', Integer(), ('plain', 'q'))
+])
+def test_column_encoding(name, column_type, encoding):
+    assert column_encoding(name, column_type) == encoding
+
+
+def test_delta_round_trip():
+    values = [0, 1, 2, 5, 100, 99, -3]
+    decoded = round_trip(values, 'delta', 'q')
+    assert decoded.dtype == np.int64 and list(decoded) == values
+
+
+def test_datetime_round_trip():
+    values = [datetime.datetime(2023, 3, 12, 1, 59, 59, 999000) + datetime.timedelta(seconds=index * 1.5) for index in range(5)]
+    decoded = round_trip(values, 'datetime', 'q')
+    assert list(decoded) == [np.datetime64(value, 'ms') for value in values]
+    decoded = round_trip(values[:2] + [None] + values[3:], 'datetime', 'q')
+    assert np.isnat(decoded[2]) and decoded[3] == np.datetime64(values[3], 'ms')
+
+
+def test_time_round_trip():
+    values = [datetime.time(0, 0, 1), None, datetime.time(1, 2, 3, 4000)]
+    assert np.array_equal(round_trip(values, 'time', 'i'), [1000.0, np.nan, 3723004.0], equal_nan=True)
+    assert list(round_trip([datetime.time(23, 59, 59)], 'time', 'i')) == [86399000]
+
+
+def test_bool_and_float_round_trip():
+    assert list(round_trip([True, False, True], 'plain', 'b')) == [1, 0, 1]
+    assert np.array_equal(round_trip([True, None, False], 'plain', 'b'), [1.0, np.nan, 0.0], equal_nan=True)
+    assert list(round_trip([1.5, -2.25, 1e300], 'plain', 'd')) == [1.5, -2.25, 1e300]
+    assert np.array_equal(round_trip([None, 0.0, 3.75], 'plain', 'd'), [np.nan, 0.0, 3.75], equal_nan=True)
+    assert np.array_equal(round_trip([None, None], 'plain', 'q'), [np.nan, np.nan], equal_nan=True)
+    assert len(round_trip([], 'delta', 'q')) == 0
+
+
+def import_paddle(plugin, act_db, activity_id):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('Strk', 'Srd'))
+    with act_db.managed_session() as activity_db_session:
+        messages = record_messages(start, 50, cadence=lambda index: 30 + index % 7, dev_Strk=lambda index: index // 2,
+                                   dev_Srd=lambda index: None if index % 10 == 3 else 4.5 + index / 100)
+        for record_num, message_fields in enumerate(messages):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, MessageFields(timestamp=start))
+
+
+def test_columnar_records_read_like_records_table(plugins, db_params, monkeypatch):
+    plugin = plugins['fbb_paddle_plus']
+    act_db = ActivitiesDb(db_params)
+    import_paddle(plugin, act_db, '9301')
+    with act_db.managed_session() as activity_db_session:
+        rows = record_arrays.read_record_arrays(activity_db_session, plugin, '9301', chunk_size=7)
+
+    plugin_class = type(plugin)
+    monkeypatch.setattr(plugin_class, '_records_columnar', True)
+    monkeypatch.setattr(plugin_class, '_tables', dict(plugin_class._tables))
+    monkeypatch.setattr(plugin, '_records_writer', None)
+    plugin_class.init_activity(ActivitiesDb, Activities)
+    act_db = ActivitiesDb(db_params)
+    import_paddle(plugin, act_db, '9302')
+    with act_db.managed_session() as activity_db_session:
+        assert activity_db_session.query(plugin._tables['record']).filter_by(activity_id='9302').count() == 0
+        assert activity_db_session.query(plugin._tables['record_columns']).filter_by(activity_id='9302').count() == 5
+        columns = record_arrays.read_record_arrays(activity_db_session, plugin, '9302')
+        selected = record_arrays.read_record_arrays(activity_db_session, plugin, '9302', ['timestamp', 'stroke_distance'])
+
+    assert list(rows) == list(columns) == ['record', 'timestamp', 'stroke_rate', 'strokes', 'stroke_distance']
+    for name, values in rows.items():
+        assert values.dtype == columns[name].dtype, name
+        assert np.array_equal(values, columns[name], equal_nan=values.dtype.kind == 'f'), name
+    assert list(selected) == ['timestamp', 'stroke_distance']
+    assert np.isnan(columns['stroke_distance'][3]) and columns['stroke_distance'][4] == pytest.approx(4.54)
+    assert columns['timestamp'][0] == np.datetime64('2023-03-12T01:00:00')
@@ -0,0 +1,43 @@
+"""Tests of the plugin column to FIT field mappings."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+from fitfile.data_message import MessageFields
+
+from plugin_utils import FieldMap
+
+from conftest import FakeFitFile
+
+
+fields = {
+    'energy_expenditure' : {'fields': ['dev_eE', 'dev_EE']},
+    'power'              : {'fields': ['dev_Power', 'power']},
+    'cadence'            : {'fields': ['dev_cadence'], 'convert': lambda value: value * 2 if value is not None else None}
+}
+
+
+def test_described_aliases():
+    extractor = FieldMap(fields).compile(FakeFitFile('5001', 'app', ('EE', 'Power', 'cadence')))
+    # Only the described dev field is read, native fields are always read.
+    assert extractor.as_dict(MessageFields(dev_eE=1.0, dev_EE=2.0, dev_Power=300, dev_cadence=40)) == {'energy_expenditure': 2.0, 'power': 300, 'cadence': 80}
+    assert extractor.values(MessageFields(dev_eE=1.0, power=250)) == (None, 250, None)
+
+
+def test_first_alias_present():
+    extractor = FieldMap(fields).compile(FakeFitFile('5002', 'app', ('eE', 'EE', 'Power')))
+    assert extractor.values(MessageFields(dev_EE=2.0, dev_Power=300, power=250)) == (2.0, 300, None)
+    assert extractor.values(MessageFields(dev_eE=1.0, dev_EE=2.0, power=250)) == (1.0, 250, None)
+
+
+def test_undescribed_dev_field_shadowing_native_field():
+    # A dev field named after a native field has no description of its own, all of the aliases are probed.
+    extractor = FieldMap(fields).compile(FakeFitFile('5003', 'app', ()))
+    assert extractor.as_dict(MessageFields(dev_EE=2.0, dev_Power=300, power=250)) == {'energy_expenditure': 2.0, 'power': 300, 'cadence': None}
+    assert extractor.as_dict(MessageFields(power=250, dev_cadence=30)) == {'energy_expenditure': None, 'power': 250, 'cadence': 60}
+
+
+def test_no_fields():
+    extractor = FieldMap({'unused': {'fields': []}}).compile(FakeFitFile('5004', 'app', ()))
+    assert extractor.as_dict(MessageFields(power=250)) == {'unused': None}
@@ -0,0 +1,201 @@
+"""Tests of the HRV metrics computed from beat to beat intervals."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import math
+import random
+import datetime
+
+import pytest
+from fitfile.data_message import MessageFields
+
+from conftest import FakeFitFile, record_messages
+
+
+np = pytest.importorskip('numpy')
+hrv = pytest.importorskip('plugin_utils.hrv')
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def naive_time_domain(values):
+    """The time domain metrics computed one interval at a time, values are intervals or None."""
+    present = [value for value in values if value is not None]
+    differences = [abs(second - first) for first, second in zip(values, values[1:]) if first is not None and second is not None]
+    metrics = {'beats': len(present), 'rmssd': None, 'sdrr': None, 'pnn50': None, 'pnn20': None}
+    if len(present) > 1:
+        mean = sum(present) / len(present)
+        metrics['sdrr'] = math.sqrt(sum((value - mean) ** 2 for value in present) / (len(present) - 1))
+    if differences:
+        metrics['rmssd'] = math.sqrt(sum(difference ** 2 for difference in differences) / len(differences))
+        metrics['pnn50'] = 100.0 * sum(difference > 50 for difference in differences) / len(differences)
+        metrics['pnn20'] = 100.0 * sum(difference > 20 for difference in differences) / len(differences)
+    return metrics
+
+
+def random_intervals(count, seed, missing=0.05):
+    generator = random.Random(seed)
+    return [None if generator.random() < missing else generator.gauss(850, 40) for _ in range(count)]
+
+
+def assert_metrics(metrics, expected):
+    assert metrics.keys() == expected.keys()
+    for name, value in expected.items():
+        assert metrics[name] == (None if value is None else pytest.approx(value)), name
+
+
+def test_intervals_array_marks_dropouts_missing():
+    intervals = hrv.intervals_array([800, None, 0, 900])
+    assert intervals[0] == 800 and intervals[3] == 900
+    assert np.isnan(intervals[1]) and np.isnan(intervals[2])
+
+
+def test_time_domain_matches_naive():
+    values = random_intervals(2000, 1)
+    assert_metrics(hrv.time_domain(hrv.intervals_array(values)), naive_time_domain(values))
+
+
+def test_time_domain_skips_differences_across_gaps():
+    metrics = hrv.time_domain(hrv.intervals_array([800, None, 900, 960, None, 700]))
+    assert_metrics(metrics, {'beats': 4, 'rmssd': 60.0, 'sdrr': pytest.approx(np.std([800, 900, 960, 700], ddof=1)), 'pnn50': 100.0, 'pnn20': 100.0})
+
+
+@pytest.mark.parametrize('values, beats', [([], 0), ([None, 0], 0), ([812], 1)])
+def test_time_domain_too_few_intervals(values, beats):
+    assert hrv.time_domain(hrv.intervals_array(values)) == {'beats': beats, 'rmssd': None, 'sdrr': None, 'pnn50': None, 'pnn20': None}
+
+
+@pytest.mark.parametrize('window, step', [(60, None), (60, 15), (300, 100)])
+def test_windowed_time_domain_matches_slices(window, step):
+    values = random_intervals(1500, 2)
+    # A gap longer than a window leaves windows without intervals out.
+    seconds = np.array([index + (400 if index >= 700 else 0) for index in range(len(values))], dtype=float)
+    windows = hrv.windowed_time_domain(seconds, hrv.intervals_array(values), window, step)
+    expected_starts = [start for start in np.arange(0, seconds[-1] + 1, step or window) if ((seconds >= start) & (seconds < start + window)).any()]
+    assert list(windows['start']) == expected_starts
+    for index, window_start in enumerate(windows['start']):
+        # A window holds the intervals from its start up to, not including, its end.
+        in_window = [value for value, second in zip(values, seconds) if window_start <= second < window_start + window]
+        expected = naive_time_domain(in_window)
+        for name in ('beats', 'rmssd', 'sdrr', 'pnn50', 'pnn20'):
+            value = windows[name][index]
+            if expected[name] is None:
+                assert np.isnan(value), (window_start, name)
+            else:
+                assert value == pytest.approx(expected[name]), (window_start, name)
+
+
+def hrv_intervals(count):
+    """Smooth intervals with one dropout, which the artifact filter flags."""
+    return [0 if index == 50 else round(800 + 30 * math.sin(index / 3.0)) for index in range(count)]
+
+
+def import_hrv(plugin, act_db, activity_id, values, **session_fields):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('hrv_s', 'hrv_btb', 'hrv_hr', 'hrv_rmssd'))
+    with act_db.managed_session() as activity_db_session:
+        messages = record_messages(start, len(values), dev_hrv_btb=lambda index: values[index], dev_hrv_hr=lambda index: 60 + index % 5)
+        for record_num, message_fields in enumerate(messages):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, MessageFields(timestamp=start, **session_fields))
+
+
+def expected_session(values, window=300):
+    values = [None if not value else value for value in values]
+    session = naive_time_domain(values)
+    return {
+        'min_hr'        : 60,
+        'hrv_rmssd'     : round(session['rmssd']),
+        'hrv_sdrr_f'    : round(naive_time_domain(values[:window])['sdrr']),
+        'hrv_sdrr_l'    : round(naive_time_domain(values[len(values) - window:])['sdrr']),
+        'hrv_pnn50'     : round(session['pnn50']),
+        'hrv_pnn20'     : round(session['pnn20']),
+    }
+
+
+def test_plugin_fills_only_missing_session_fields(plugins, act_db):
+    plugin = plugins['fbb_hrv']
+    values = hrv_intervals(400)
+    import_hrv(plugin, act_db, '9001', values, dev_hrv_rmssd=42)
+    expected = dict(expected_session(values), hrv_rmssd=42)
+    with act_db.managed_session() as activity_db_session:
+        session = activity_db_session.get(plugin._tables['session'], '9001')
+        assert {name: getattr(session, name) for name in expected} == expected
+        windows = activity_db_session.query(plugin._tables['window']).filter_by(activity_id='9001').order_by('window').all()
+        assert [(row.window, row.beats) for row in windows] == [(0, 299), (1, 100)]
+
+
+def test_update_hrv_metrics(plugins, act_db):
+    plugin = plugins['fbb_hrv']
+    values = hrv_intervals(400)
+    import_hrv(plugin, act_db, '9002', values, dev_hrv_rmssd=42)
+    with act_db.managed_session() as activity_db_session:
+        activity_db_session.get(plugin._tables['session'], '9002').hrv_pnn20 = None
+        activity_db_session.query(plugin._tables['window']).filter_by(activity_id='9002').delete()
+    with act_db.managed_session() as activity_db_session:
+        assert plugin.update_hrv_metrics(activity_db_session) == 1
+    with act_db.managed_session() as activity_db_session:
+        session = activity_db_session.get(plugin._tables['session'], '9002')
+        assert (session.hrv_rmssd, session.hrv_pnn20) == (42, expected_session(values)['hrv_pnn20'])
+        assert activity_db_session.query(plugin._tables['window']).filter_by(activity_id='9002').count() == 2
+        assert plugin.update_hrv_metrics(activity_db_session) == 0
+
+
+def sinusoid_beats(seconds, frequency, amplitude=50.0, mean=1000.0):
+    """Return the times and intervals of beats whose interval oscillates at frequency Hz."""
+    times = [0.0]
+    intervals = []
+    while times[-1] < seconds:
+        interval = mean + amplitude * math.sin(2 * math.pi * frequency * times[-1])
+        intervals.append(interval)
+        times.append(times[-1] + interval / 1000.0)
+    return np.array(times[:-1]), np.array(intervals)
+
+
+@pytest.mark.parametrize('frequency, dominant', [(0.1, 'lf'), (0.25, 'hf')])
+def test_frequency_domain_band_of_sinusoid(frequency, dominant):
+    seconds, intervals = sinusoid_beats(910, frequency)
+    windows = hrv.windowed_frequency_domain(seconds, intervals, 300)
+    assert list(windows['start']) == [0.0, 300.0, 600.0]
+    weak = 'hf' if dominant == 'lf' else 'lf'
+    assert np.all(windows[dominant] > 100 * windows[weak])
+    # A sinusoid of amplitude A has power A^2 / 2, less what the linear resampling of four to ten beats a cycle smooths away.
+    assert np.all((windows[dominant] > 0.6 * 50.0 ** 2 / 2) & (windows[dominant] <= 50.0 ** 2 / 2))
+    session = hrv.frequency_domain(windows)
+    assert session['windows'] == 3
+    assert (session['lf_hf'] > 1) == (dominant == 'lf')
+
+
+def test_frequency_domain_leaves_out_sparse_windows():
+    seconds, intervals = sinusoid_beats(910, 0.1)
+    # Only one beat in ten of the second window is present, fewer than min_beats_per_second.
+    sparse = (seconds >= 300) & (seconds < 600) & (np.arange(len(seconds)) % 10 != 0)
+    intervals[sparse] = np.nan
+    windows = hrv.windowed_frequency_domain(seconds, intervals, 300, min_beats_per_second=0.5)
+    assert list(windows['start']) == [0.0, 600.0]
+    assert list(windows['beats']) == [np.count_nonzero((seconds >= start) & (seconds < start + 300)) for start in (0, 600)]
+
+
+def test_frequency_domain_without_whole_windows():
+    seconds, intervals = sinusoid_beats(200, 0.1)
+    windows = hrv.windowed_frequency_domain(seconds, intervals, 300)
+    assert len(windows['start']) == 0
+    assert hrv.frequency_domain(windows) == {'windows': 0, 'lf': None, 'hf': None, 'lf_hf': None}
+
+
+def test_frequency_rows_replaced_on_rerun(plugins, act_db):
+    plugin = plugins['fbb_hrv']
+    tables = (plugin._tables['frequency_window'], plugin._tables['frequency'])
+    for duration, expected_windows in ((910, 3), (610, 2)):
+        seconds, intervals = sinusoid_beats(duration, 0.25)
+        timestamps = [start + datetime.timedelta(seconds=second) for second in seconds]
+        with act_db.managed_session() as activity_db_session:
+            plugin._hrv_frequency(activity_db_session, '9101', timestamps, seconds, intervals)
+        with act_db.managed_session() as activity_db_session:
+            windows = activity_db_session.query(tables[0]).filter_by(activity_id='9101').order_by('window').all()
+            assert [row.window for row in windows] == list(range(expected_windows))
+            assert all(row.hrv_hf > row.hrv_lf for row in windows)
+            session = activity_db_session.query(tables[1]).filter_by(activity_id='9101').one()
+            assert session.windows == expected_windows and session.hrv_lf_hf < 1
@@ -0,0 +1,28 @@
+"""Tests of the secondary indexes declared by plugins."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+from sqlalchemy import create_engine, inspect, text
+
+from plugin_utils import sync_indexes
+
+
+def indexes(connection):
+    return {index['name']: index['column_names'] for index in inspect(connection).get_indexes('samples')}
+
+
+def test_sync_indexes():
+    engine = create_engine('sqlite://')
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE samples (a INTEGER, b INTEGER, c INTEGER)'))
+        connection.execute(text('CREATE INDEX samples_ix_stale ON samples (a)'))
+        connection.execute(text('CREATE INDEX samples_ix_kept ON samples (a, b)'))
+        connection.execute(text('CREATE INDEX samples_ix_changed ON samples (b)'))
+        connection.execute(text('CREATE INDEX samples_other ON samples (c)'))
+        sync_indexes(connection, 'samples', {'kept': ['a', 'b'], 'changed': ['b', 'c'], 'new': ['c']})
+        assert indexes(connection) == {'samples_ix_kept': ['a', 'b'], 'samples_ix_changed': ['b', 'c'], 'samples_ix_new': ['c'], 'samples_other': ['c']}
+        sync_indexes(connection, 'samples', {})
+        assert indexes(connection) == {'samples_other': ['c']}
+    engine.dispose()
@@ -0,0 +1,44 @@
+"""Tests of the per file UTC to local time conversion."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+import zoneinfo
+
+import pytest
+
+from plugin_utils import local_time_converter
+
+from conftest import FakeFitFile
+
+
+# US DST started at 2023-03-12 07:00 UTC, an activity from 06:00 to 08:00 UTC spans the switch.
+activity_start = datetime.datetime(2023, 3, 12, 6, 0, tzinfo=datetime.timezone.utc)
+timestamps = [activity_start + datetime.timedelta(seconds=seconds) for seconds in range(0, 7200, 7)]
+
+
+@pytest.mark.parametrize('utc_offset', [-5 * 3600, -4 * 3600, 0, 5 * 3600 + 1800])
+def test_fixed_offset_across_dst(utc_offset):
+    fit_file = FakeFitFile('1', None, (), utc_offset)
+    utc_datetime_to_local = local_time_converter(fit_file)
+    assert [utc_datetime_to_local(dt) for dt in timestamps] == [fit_file.utc_datetime_to_local(dt) for dt in timestamps]
+
+
+def test_dst_zone_across_dst():
+    fit_file = FakeFitFile('1', None, ())
+    fit_file.local_tz = zoneinfo.ZoneInfo('America/New_York')
+    utc_datetime_to_local = local_time_converter(fit_file)
+    local = [utc_datetime_to_local(dt) for dt in timestamps]
+    assert local == [fit_file.utc_datetime_to_local(dt) for dt in timestamps]
+    assert local[0] == datetime.datetime(2023, 3, 12, 1, 0)
+    assert local[-1] == datetime.datetime(2023, 3, 12, 3, 59, 56)
+
+
+def test_naive_and_missing_timezone():
+    fit_file = FakeFitFile('1', None, ())
+    naive = datetime.datetime(2023, 3, 12, 6, 30)
+    assert local_time_converter(fit_file)(naive) == fit_file.utc_datetime_to_local(naive) == naive
+    fit_file.local_tz = None
+    assert local_time_converter(fit_file)(activity_start) == fit_file.utc_datetime_to_local(activity_start)
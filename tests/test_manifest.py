@@ -0,0 +1,41 @@
+"""Tests of the plugin manifest."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+from plugin_utils import PluginManifest, build_manifest, write_manifest
+
+from conftest import FakeFitFile, repo_dir
+
+
+plugin_source = '''
+class sample():
+    _application_id = bytearray(b'\\x01\\x02')
+'''
+
+
+def test_only_plugin_files_are_listed(tmp_path):
+    (tmp_path / 'sample_plugin.py').write_text(plugin_source)
+    for filename in ('sample_pluginXpy', 'sample_plugin.py.orig', 'sample_plugin.pyc'):
+        (tmp_path / filename).write_text(plugin_source)
+    manifest = build_manifest(str(tmp_path))
+    assert manifest['plugins'] == [{'module': 'sample_plugin', 'class': 'sample', 'application_id': '0102'}]
+
+
+def test_repository_manifest():
+    manifest = build_manifest(repo_dir)
+    entries = {entry['class']: entry for entry in manifest['plugins']}
+    assert entries['stryd_zones']['application_id'] == '18fb2cf01a4b430dad66988c847421f4'
+    assert 'fbb_hrv' in entries
+
+
+def test_candidates(tmp_path):
+    (tmp_path / 'sample_plugin.py').write_text(plugin_source)
+    manifest = PluginManifest.load(str(tmp_path))
+    assert manifest is None
+    write_manifest(str(tmp_path))
+    manifest = PluginManifest.load(str(tmp_path))
+    plugin_names = ['sample', 'unlisted']
+    assert manifest.candidates(plugin_names, FakeFitFile('1', bytearray(b'\x01\x02'), ())) == ['sample', 'unlisted']
+    assert manifest.candidates(plugin_names, FakeFitFile('1', bytearray(b'\x03'), ())) == ['unlisted']
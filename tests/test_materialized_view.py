@@ -0,0 +1,76 @@
+"""Tests of the materialized plugin activity views."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+from sqlalchemy import text
+from fitfile.data_message import MessageFields
+from garmindb.garmindb import Activities
+
+from plugin_utils import MaterializedView
+
+from conftest import FakeFitFile, record_messages
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def import_activity(plugin, act_db, activity_id):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('eE', 'rE', 'tpRE'))
+    with act_db.managed_session() as activity_db_session:
+        for record_num, message_fields in enumerate(record_messages(start, 10, dev_eE=10.0, dev_rE=1.0, dev_tpRE=2.0)):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        session_fields = MessageFields(timestamp=start, dev_aE=1.0, dev_tS=100)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, session_fields)
+        plugin.write_steps_entry(activity_db_session, fit_file, activity_id, None, session_fields)
+        activity_db_session.add(Activities(activity_id=activity_id, name='run', start_time=start.replace(tzinfo=None)))
+
+
+def view_rows(act_db):
+    with act_db.managed_session() as activity_db_session:
+        return {row.activity_id: row for row in activity_db_session.execute(text('SELECT * FROM dozen_run_activities'))}
+
+
+def test_view_follows_imports_and_updates(plugins, act_db, monkeypatch):
+    plugin = plugins['fbb_dozen_run']
+    create_activity_view = plugin._views['activity_view'].__func__
+    # The setting of the plugin module as loaded by the plugin manager.
+    monkeypatch.setitem(create_activity_view.__globals__, 'materialize_activity_view', True)
+    create_activity_view(plugin._tables['session'], act_db)
+    import_activity(plugin, act_db, '2001')
+    import_activity(plugin, act_db, '2002')
+    rows = view_rows(act_db)
+    assert sorted(rows) == ['2001', '2002']
+    assert rows['2001'].name == 'run'
+    with act_db.managed_session() as activity_db_session:
+        activity_db_session.query(Activities).filter(Activities.activity_id == '2001').update({'name': 'renamed'})
+        activity_db_session.query(plugin._tables['session']).filter_by(activity_id='2002').delete()
+    rows = view_rows(act_db)
+    assert sorted(rows) == ['2001']
+    assert rows['2001'].name == 'renamed'
+
+
+def test_triggers_kept_when_unchanged(plugins, act_db):
+    plugin = plugins['fbb_dozen_run']
+    view = MaterializedView('dozen_run_test', plugin._tables['session'], [plugin._tables['session'].activity_id.label('activity_id'),
+                                                                         Activities.start_time.label('start_time')])
+    view.create(act_db)
+    with act_db.managed_session() as activity_db_session:
+        assert not view._sync_triggers(activity_db_session)
+
+
+def test_join_view_on_other_databases(plugins, act_db, monkeypatch):
+    plugin = plugins['fbb_dozen_run']
+    sessions_table = plugin._tables['session']
+    join_views = []
+    monkeypatch.setattr(act_db.engine.dialect, 'name', 'mysql')
+    monkeypatch.setattr(sessions_table, 'create_join_view', classmethod(lambda cls, db, view_name, *args, **kwargs: join_views.append(view_name)))
+    view = MaterializedView('dozen_run_join_test', sessions_table, [sessions_table.activity_id.label('activity_id'), Activities.start_time.label('start_time')])
+    view.create(act_db)
+    monkeypatch.undo()
+    assert join_views == ['dozen_run_join_test']
+    with act_db.managed_session() as activity_db_session:
+        assert activity_db_session.execute(text("SELECT name FROM sqlite_master WHERE name LIKE 'dozen_run_join_test%'")).fetchall() == []
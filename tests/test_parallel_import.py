@@ -0,0 +1,40 @@
+"""Tests of the plugin importer the parallel import and reprocessing run in their worker processes."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import pytest
+import fitfile
+
+from plugin_utils import PluginImporter
+from plugin_utils.parallel_import import merge_table
+
+from conftest import dozen_run_file
+
+
+def test_failed_file_rows_are_dropped(plugins, act_db, db_params, monkeypatch):
+    plugin = plugins['fbb_dozen_run']
+    files = {'/activities/3001.fit': dozen_run_file(plugin, '3001', fail_after=15), '/activities/3002.fit': dozen_run_file(plugin, '3002')}
+    monkeypatch.setattr(fitfile, 'File', lambda filename, measurement_system: files[filename])
+    importer = PluginImporter({'fbb_dozen_run': plugin}, db_params)
+    try:
+        importer.import_file('/activities/3001.fit')
+    except ValueError:
+        pass
+    assert importer.import_file('/activities/3002.fit') == ['fbb_dozen_run']
+    importer.close()
+    records = plugin._tables['record']
+    with act_db.managed_session() as activity_db_session:
+        assert activity_db_session.query(records).filter(records.activity_id == '3001').count() == 0
+        assert activity_db_session.query(records).filter(records.activity_id == '3002').count() == 20
+        assert activity_db_session.query(plugin._tables['session']).filter_by(activity_id='3002').count() == 1
+
+
+def test_tables_computed_across_activities_are_not_merged(plugins, act_db):
+    plugin = plugins['stryd_zones']
+    assert 'power_curve_best' in plugin._derived_table_keys()
+    with act_db.managed_session() as activity_db_session:
+        with pytest.raises(ValueError):
+            merge_table(plugin._tables['power_curve_best'], activity_db_session, activity_db_session)
+        assert merge_table(plugin._tables['power_curve'], activity_db_session, activity_db_session) == (0, 0)
@@ -0,0 +1,84 @@
+"""Tests of the incremental Parquet export of plugin tables."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import os
+import json
+import datetime
+
+import pytest
+from fitfile.data_message import MessageFields
+
+from conftest import FakeFitFile, record_messages
+
+
+pq = pytest.importorskip('pyarrow.parquet')
+parquet_export = pytest.importorskip('plugin_utils.parquet_export')
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def import_run(plugin, act_db, activity_id, activity_start):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('eE', 'rE', 'tpRE'))
+    with act_db.managed_session() as activity_db_session:
+        for record_num, message_fields in enumerate(record_messages(activity_start, 30, dev_eE=10.0, dev_rE=1.0, dev_tpRE=2.0)):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        session_fields = MessageFields(timestamp=activity_start, dev_aE=1.0, dev_tS=100)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, session_fields)
+        plugin.write_steps_entry(activity_db_session, fit_file, activity_id, None, session_fields)
+
+
+def parquet_files(table_dir):
+    return sorted(os.path.relpath(os.path.join(directory, filename), table_dir)
+                  for directory, _, filenames in os.walk(table_dir) for filename in filenames if filename.endswith('.parquet'))
+
+
+def read_state(table_dir):
+    with open(os.path.join(table_dir, parquet_export.state_filename), encoding='utf-8') as file:
+        return json.load(file)
+
+
+def test_incremental_export_writes_only_new_files(plugins, act_db, tmp_path):
+    plugin = plugins['fbb_dozen_run']
+    output_dir = str(tmp_path / 'export')
+    records_dir = os.path.join(output_dir, 'dozen_run_records')
+    import_run(plugin, act_db, '9801', start)
+    assert parquet_export.export_plugin(act_db, plugin, output_dir) == {'dozen_run_records': 30, 'dozen_run_sessions': 1}
+    first_file = os.path.join('date=2023-03-12', 'part-00001-00000.parquet')
+    assert parquet_files(records_dir) == [first_file]
+    first_mtime = os.stat(os.path.join(records_dir, first_file)).st_mtime_ns
+    assert read_state(records_dir) == {'version': 1, 'partition': 'date', 'runs': 1, 'activities': ['9801'], 'files': [first_file]}
+
+    import_run(plugin, act_db, '9802', start + datetime.timedelta(days=1))
+    # A file of a stopped export isn't in the state file and is removed.
+    os.makedirs(os.path.join(records_dir, 'date=2023-03-14'))
+    open(os.path.join(records_dir, 'date=2023-03-14', 'part-00002-00001.parquet'), 'wb').close()
+    assert parquet_export.export_plugin(act_db, plugin, output_dir) == {'dozen_run_records': 30, 'dozen_run_sessions': 1}
+    second_file = os.path.join('date=2023-03-13', 'part-00002-00000.parquet')
+    assert parquet_files(records_dir) == [first_file, second_file]
+    assert os.stat(os.path.join(records_dir, first_file)).st_mtime_ns == first_mtime
+    state = read_state(records_dir)
+    assert (state['runs'], state['activities'], state['files']) == (2, ['9801', '9802'], [first_file, second_file])
+
+    second = pq.read_table(os.path.join(records_dir, second_file))
+    assert set(second.column('activity_id').to_pylist()) == {'9802'}
+    assert second.column('timestamp').to_pylist()[0] == datetime.datetime(2023, 3, 13, 1, 0)
+    assert second.schema.names == [column.name for column in plugin._tables['record'].__table__.columns]
+
+    assert parquet_export.export_plugin(act_db, plugin, output_dir) == {'dozen_run_records': 0, 'dozen_run_sessions': 0}
+    assert parquet_files(records_dir) == [first_file, second_file]
+    assert read_state(records_dir)['runs'] == 3
+
+
+def test_full_export_by_activity(plugins, act_db, tmp_path):
+    plugin = plugins['fbb_dozen_run']
+    output_dir = str(tmp_path / 'export')
+    import_run(plugin, act_db, '9901', start)
+    parquet_export.export_plugin(act_db, plugin, output_dir, partition='activity')
+    with pytest.raises(ValueError):
+        parquet_export.export_plugin(act_db, plugin, output_dir)
+    assert parquet_export.export_plugin(act_db, plugin, output_dir, partition='activity', incremental=False)['dozen_run_records'] == 30
+    assert parquet_files(os.path.join(output_dir, 'dozen_run_records')) == [os.path.join('activity=9901', 'part-00001-00000.parquet')]
@@ -0,0 +1,56 @@
+"""Tests of the streaming power summaries and the Stryd zones sessions."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+import pytest
+from fitfile.data_message import MessageFields
+
+from plugin_utils import PowerZoneAccumulator
+
+from conftest import FakeFitFile, record_messages
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_constant_power():
+    accumulator = PowerZoneAccumulator([200, 300])
+    for second in range(60):
+        accumulator.add(start + datetime.timedelta(seconds=second), 250)
+    summary = accumulator.summary()
+    assert summary['avg_power'] == summary['max_power'] == 250
+    assert summary['normalized_power'] == pytest.approx(250)
+    assert summary['work'] == pytest.approx(15.0)
+    assert (summary['zone_1_seconds'], summary['zone_2_seconds'], summary['zone_3_seconds']) == (0, 60, 0)
+
+
+def test_zones_and_pauses():
+    accumulator = PowerZoneAccumulator([100], max_sample_seconds=5)
+    accumulator.add(start, 50)
+    accumulator.add(start + datetime.timedelta(seconds=1), 150)
+    # A pause counts for max_sample_seconds only.
+    accumulator.add(start + datetime.timedelta(seconds=61), 50)
+    accumulator.add(start + datetime.timedelta(seconds=62), None)
+    summary = accumulator.summary()
+    assert (summary['zone_1_seconds'], summary['zone_2_seconds']) == (6, 1)
+    assert summary['normalized_power'] is None
+    assert summary['avg_power'] == pytest.approx((50 + 150 + 50 * 5) / 7)
+
+
+def test_stryd_session_zone_seconds(plugins, act_db):
+    plugin = plugins['stryd_zones']
+    activity_id = '4001'
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('Power',))
+    with act_db.managed_session() as activity_db_session:
+        for record_num, message_fields in enumerate(record_messages(start, 300, dev_Power=lambda index: 150 + index % 200)):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, MessageFields(timestamp=start))
+    with act_db.managed_session() as activity_db_session:
+        session = activity_db_session.query(plugin._tables['session']).filter_by(activity_id=activity_id).one()
+    zone_seconds = [getattr(session, f'zone_{zone}_seconds') for zone in range(1, 6)]
+    assert zone_seconds == [100, 50, 50, 38, 62]
+    assert sum(zone_seconds) == 300
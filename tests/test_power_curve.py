@@ -0,0 +1,85 @@
+"""Tests of the mean maximal power curves and the Stryd best power curve."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+import pytest
+from fitfile.data_message import MessageFields
+
+from conftest import FakeFitFile, record_messages
+
+
+np = pytest.importorskip('numpy')
+power_curve = pytest.importorskip('plugin_utils.power_curve')
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def series(seconds, power):
+    timestamps = np.datetime64('2023-03-12T01:00:00', 'ms') + np.array(seconds, dtype='timedelta64[s]')
+    return power_curve.power_series(timestamps, np.array(power, dtype=np.float64))
+
+
+def test_constant_power():
+    curve = power_curve.mean_max_power(series(range(60), [250.0] * 60))
+    assert [duration for duration, _, _ in curve] == [1, 2, 3, 5, 10, 15, 20, 30, 45, 60]
+    assert all(power == pytest.approx(250.0) and start_second == 0 for _, power, start_second in curve)
+
+
+def test_step_power():
+    curve = {duration: (power, start_second) for duration, power, start_second in
+             power_curve.mean_max_power(series(range(150), [100.0] * 100 + [300.0] * 50), [10, 30, 60, 120, 150, 151])}
+    assert curve[10] == (pytest.approx(300.0), 100)
+    assert curve[30] == (pytest.approx(300.0), 100)
+    assert curve[60] == (pytest.approx((300 * 50 + 100 * 10) / 60), 90)
+    assert curve[120] == (pytest.approx((300 * 50 + 100 * 70) / 120), 30)
+    assert curve[150] == (pytest.approx((300 * 50 + 100 * 100) / 150), 0)
+    # Durations longer than the activity are left out.
+    assert 151 not in curve
+
+
+def test_gaps_and_missing_samples_count_as_zero():
+    power = series(list(range(10)) + list(range(20, 30)), [300.0] * 9 + [np.nan] + [300.0] * 10)
+    assert len(power) == 30
+    assert list(power[9:21]) == [0.0] * 11 + [300.0]
+    curve = dict((duration, power) for duration, power, _ in power_curve.mean_max_power(power, [9, 10, 30]))
+    assert curve == {9: pytest.approx(300.0), 10: pytest.approx(300.0), 30: pytest.approx(5700.0 / 30)}
+
+
+def test_short_activity():
+    assert [duration for duration, _, _ in power_curve.mean_max_power(series(range(5), [200.0] * 5))] == [1, 2, 3, 5]
+    assert power_curve.mean_max_power(series([0], [200.0]), [1, 2]) == [(1, 200.0, 0)]
+
+
+def import_stryd(plugin, act_db, activity_id, activity_start, power):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('Power',))
+    with act_db.managed_session() as activity_db_session:
+        for record_num, message_fields in enumerate(record_messages(activity_start, len(power), dev_Power=lambda index: power[index])):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, MessageFields(timestamp=activity_start))
+
+
+def test_best_power_curve_across_activities(plugins, act_db):
+    plugin = plugins['stryd_zones']
+    import_stryd(plugin, act_db, '9401', start, [200] * 120)
+    import_stryd(plugin, act_db, '9402', start + datetime.timedelta(days=1), [400] * 20 + [100] * 100)
+    durations = [1, 2, 3, 5, 10, 15, 20, 30, 45, 60, 90, 120]
+    # The activity imported first keeps a duration both are as good at.
+    expected = {duration: '9402' if duration < 60 else '9401' for duration in durations}
+    with act_db.managed_session() as activity_db_session:
+        best = plugin.best_power_curve(activity_db_session)
+        assert {duration: activity_id for duration, (_, activity_id, _) in best.items()} == expected
+        assert best[30][0] == pytest.approx((400 * 20 + 100 * 10) / 30)
+        assert best[120][0] == pytest.approx(200.0)
+        assert best[20][2] == datetime.datetime(2023, 3, 13, 1, 0)
+        plugin.rebuild_best_power_curve(activity_db_session)
+    with act_db.managed_session() as activity_db_session:
+        assert plugin.best_power_curve(activity_db_session) == best
+        first_day = plugin.best_power_curve(activity_db_session, end=datetime.datetime(2023, 3, 13))
+        assert {activity_id for _, activity_id, _ in first_day.values()} == {'9401'}
+        curve_table = plugin._tables['power_curve']
+        assert activity_db_session.query(curve_table).filter_by(activity_id='9402').count() == len(durations)
@@ -0,0 +1,130 @@
+"""Tests of the records array cache and the records queries."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+import pytest
+from fitfile.data_message import MessageFields
+from idbutils import DbParams
+from garmindb.garmindb import ActivitiesDb
+
+from plugin_utils import RecordCache, invalidate_records
+from plugin_utils.reprocess import replace_activities
+
+from conftest import FakeFitFile, record_messages
+
+
+np = pytest.importorskip('numpy')
+record_query = pytest.importorskip('plugin_utils.record_query')
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+local_start = datetime.datetime(2023, 3, 12, 1, 0)
+
+
+def arrays(count):
+    return {'power': np.zeros(count)}
+
+
+def test_cache_evicts_least_recently_read():
+    cache = RecordCache(max_bytes=3 * 800)
+    for activity_id in ('1', '2', '3'):
+        cache.put(('records', activity_id), arrays(100))
+    assert cache.get(('records', '1')) is not None
+    cache.put(('records', '4'), arrays(100))
+    assert cache.get(('records', '2')) is None
+    assert [cache.get(('records', activity_id)) is not None for activity_id in ('1', '3', '4')] == [True] * 3
+    assert (len(cache), cache.bytes, cache.hits, cache.misses) == (3, 2400, 4, 1)
+    cache.put(('records', '3'), arrays(50))
+    assert cache.bytes == 2000
+    # Activities larger than the cache aren't cached and don't evict others.
+    cache.put(('records', '5'), arrays(400))
+    assert (len(cache), cache.get(('records', '5'))) == (3, None)
+
+
+def test_invalidate_records():
+    cache = RecordCache()
+    for key in (('records', '1'), ('records', '2'), ('other_records', '1')):
+        cache.put(key, arrays(10))
+    invalidate_records('records', ['1', '9'])
+    assert (cache.get(('records', '1')), len(cache), cache.bytes) == (None, 2, 160)
+    invalidate_records('records')
+    assert list(cache._entries) == [('other_records', '1')]
+    cache.clear()
+    assert (len(cache), cache.bytes) == (0, 0)
+
+
+def import_run(plugin, act_db, activity_id, activity_start=start, count=20, value=10.0):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('eE', 'rE', 'tpRE'))
+    with act_db.managed_session() as activity_db_session:
+        for record_num, message_fields in enumerate(record_messages(activity_start, count, dev_eE=lambda index: value + index, dev_rE=1.0, dev_tpRE=None)):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, MessageFields(timestamp=activity_start))
+
+
+def test_writes_invalidate_cached_activities(plugins, act_db, tmp_path):
+    plugin = plugins['fbb_dozen_run']
+    query = record_query.RecordQuery(plugin)
+    with act_db.managed_session() as activity_db_session:
+        assert len(query.activity(activity_db_session, '9501')['timestamp']) == 0
+    assert len(query.cache) == 1
+    import_run(plugin, act_db, '9501')
+    assert len(query.cache) == 0
+    with act_db.managed_session() as activity_db_session:
+        records = query.activity(activity_db_session, '9501', ['record', 'momentary_energy_expenditure'])
+        assert list(records) == ['record', 'momentary_energy_expenditure']
+        assert list(records['momentary_energy_expenditure']) == [10.0 + index for index in range(20)]
+        assert not records['record'].flags.writeable
+        query.activity(activity_db_session, '9501', ['timestamp'])
+    assert (query.cache.hits, len(query.cache)) == (1, 1)
+
+    record_table = plugin._tables['record']
+    (tmp_path / 'staging').mkdir()
+    staging_db_params = DbParams(db_type='sqlite', db_path=str(tmp_path / 'staging'))
+    staging_db = ActivitiesDb(staging_db_params)
+    with staging_db.managed_session() as staging_session:
+        staging_session.execute(record_table.__table__.insert(), [{'activity_id': '9501', 'record': 0, 'momentary_energy_expenditure': 99.0}])
+    staging_db.engine.dispose()
+    with act_db.managed_session() as activity_db_session:
+        replace_activities(activity_db_session, staging_db_params, [record_table], ['9501'])
+    assert len(query.cache) == 0
+    with act_db.managed_session() as activity_db_session:
+        assert list(query.activity(activity_db_session, '9501')['momentary_energy_expenditure']) == [99.0]
+
+
+def test_time_range(plugins, act_db):
+    plugin = plugins['fbb_dozen_run']
+    import_run(plugin, act_db, '9601')
+    import_run(plugin, act_db, '9602', start + datetime.timedelta(seconds=15), value=100.0)
+    query = record_query.RecordQuery(plugin, chunk_size=4)
+    with act_db.managed_session() as activity_db_session:
+        records = query.time_range(activity_db_session, local_start + datetime.timedelta(seconds=10), local_start + datetime.timedelta(seconds=20),
+                                   ['momentary_energy_expenditure', 'training_peaks_re'])
+        assert list(records) == ['activity_id', 'timestamp', 'momentary_energy_expenditure', 'training_peaks_re']
+        # From start up to, not including, end, ordered by timestamp.
+        assert records['timestamp'][0] == np.datetime64(local_start + datetime.timedelta(seconds=10))
+        assert records['timestamp'][-1] == np.datetime64(local_start + datetime.timedelta(seconds=19))
+        assert list(records['activity_id']) == ['9601'] * 5 + ['9601', '9602'] * 5
+        assert list(records['momentary_energy_expenditure'][5:7]) == [25.0, 100.0]
+        assert np.isnan(records['training_peaks_re']).all()
+        only = query.time_range(activity_db_session, local_start, local_start + datetime.timedelta(hours=1), activity_ids=['9602'])
+        assert len(only['timestamp']) == 20 and set(only['activity_id']) == {'9602'}
+        empty = query.time_range(activity_db_session, local_start - datetime.timedelta(hours=1), local_start)
+        assert len(empty['timestamp']) == 0
+
+
+def test_to_arrow(plugins, act_db):
+    pa = pytest.importorskip('pyarrow')
+    plugin = plugins['fbb_dozen_run']
+    import_run(plugin, act_db, '9701', count=3)
+    query = record_query.RecordQuery(plugin)
+    with act_db.managed_session() as activity_db_session:
+        table = query.activity(activity_db_session, '9701', ['timestamp', 'momentary_energy_expenditure', 'training_peaks_re'], arrow=True)
+    assert isinstance(table, pa.Table)
+    assert table.column_names == ['timestamp', 'momentary_energy_expenditure', 'training_peaks_re']
+    assert table.column('momentary_energy_expenditure').to_pylist() == [10.0, 11.0, 12.0]
+    assert table.column('training_peaks_re').null_count == 3
+    assert table.column('timestamp').to_pylist()[0] == local_start
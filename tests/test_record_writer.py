@@ -0,0 +1,60 @@
+"""Tests of the buffered records writes of RecordWriterMixin plugins."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+from fitfile.data_message import MessageFields
+
+from conftest import FakeFitFile, record_messages
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+dev_fields = ('eE', 'rE', 'tpRE')
+
+
+def write_records(plugin, activity_db_session, activity_id, count):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, dev_fields)
+    for record_num, message_fields in enumerate(record_messages(start, count, dev_eE=10.0, dev_rE=1.0, dev_tpRE=2.0)):
+        plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+    return fit_file
+
+
+def stored_records(plugin, act_db, activity_id):
+    table = plugin._tables['record']
+    with act_db.managed_session() as activity_db_session:
+        return activity_db_session.query(table).filter(table.activity_id == activity_id).count()
+
+
+def test_file_without_session_keeps_records(plugins, act_db):
+    plugin = plugins['fbb_dozen_run']
+    with act_db.managed_session() as activity_db_session:
+        write_records(plugin, activity_db_session, '1001', 20)
+    assert stored_records(plugin, act_db, '1001') == 20
+
+
+def test_records_written_when_next_activity_starts(plugins, act_db):
+    plugin = plugins['fbb_dozen_run']
+    with act_db.managed_session() as activity_db_session:
+        write_records(plugin, activity_db_session, '1002', 20)
+        fit_file = write_records(plugin, activity_db_session, '1003', 10)
+        plugin.write_session_entry(activity_db_session, fit_file, '1003', MessageFields(timestamp=start, dev_aE=1.0, dev_tS=100))
+        assert stored_records(plugin, act_db, '1002') == 0
+    assert stored_records(plugin, act_db, '1002') == 20
+    assert stored_records(plugin, act_db, '1003') == 10
+
+
+def test_rolled_back_records_are_dropped(plugins, act_db):
+    plugin = plugins['fbb_dozen_run']
+    try:
+        with act_db.managed_session() as activity_db_session:
+            write_records(plugin, activity_db_session, '1004', 20)
+            raise RuntimeError('import failed')
+    except RuntimeError:
+        pass
+    with act_db.managed_session() as activity_db_session:
+        write_records(plugin, activity_db_session, '1005', 5)
+    assert stored_records(plugin, act_db, '1004') == 0
+    assert stored_records(plugin, act_db, '1005') == 5
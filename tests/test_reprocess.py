@@ -0,0 +1,121 @@
+"""Tests of the in place plugin table upgrades and the reprocessing of the upgraded plugins' activities."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import pytest
+import fitfile
+from sqlalchemy import create_engine, inspect, text
+from idbutils import DbParams
+from garmindb.garmindb import ActivitiesDb, File
+
+from plugin_utils import PluginImporter
+from plugin_utils.reprocess import upgrade_tables, replace_activities, reprocess, checkpoint_tablename
+
+from conftest import repo_dir, dozen_run_file
+
+
+def import_files(plugin, db_params, files, monkeypatch):
+    monkeypatch.setattr(fitfile, 'File', lambda filename, measurement_system: files[filename])
+    importer = PluginImporter({'fbb_dozen_run': plugin}, db_params)
+    for filename in files:
+        importer.import_file(filename)
+    importer.close()
+
+
+def execute(db_params, *statements):
+    engine = create_engine(ActivitiesDb._sqlite_url(db_params))
+    try:
+        with engine.begin() as connection:
+            for statement in statements:
+                result = connection.execute(text(statement))
+            return result.fetchall() if result.returns_rows else None
+    finally:
+        engine.dispose()
+
+
+def version(db_params, tablename):
+    return execute(db_params, f"SELECT value FROM _attributes WHERE key = '{tablename}.version'")[0][0]
+
+
+def checkpoints(db_params):
+    return execute(db_params, f'SELECT plugin, activity_id, done FROM {checkpoint_tablename} ORDER BY activity_id')
+
+
+def test_upgrade_adds_columns_and_queues_activities(plugins, act_db, db_params, monkeypatch):
+    plugin = plugins['fbb_dozen_run']
+    import_files(plugin, db_params, {f'/activities/{activity_id}.fit': dozen_run_file(plugin, activity_id) for activity_id in ('8001', '8002')}, monkeypatch)
+    execute(db_params, 'ALTER TABLE dozen_run_sessions DROP COLUMN energy_expenditure_p90',
+            "UPDATE _attributes SET value = '1' WHERE key = 'dozen_run_sessions.version'")
+    assert upgrade_tables(db_params, {'fbb_dozen_run': plugin}) == {'fbb_dozen_run': ['dozen_run_sessions']}
+    engine = create_engine(ActivitiesDb._sqlite_url(db_params))
+    assert 'energy_expenditure_p90' in {column['name'] for column in inspect(engine).get_columns('dozen_run_sessions')}
+    engine.dispose()
+    assert version(db_params, 'dozen_run_sessions') == '2'
+    assert checkpoints(db_params) == [('fbb_dozen_run', '8001', 0), ('fbb_dozen_run', '8002', 0)]
+    assert upgrade_tables(db_params, {'fbb_dozen_run': plugin}) == {}
+    assert len(checkpoints(db_params)) == 2
+
+
+def test_upgrade_refuses_changed_primary_key(plugins, act_db, db_params):
+    execute(db_params, 'DROP TABLE dozen_run_records', 'CREATE TABLE dozen_run_records (activity_id VARCHAR PRIMARY KEY, record INTEGER, timestamp DATETIME)',
+            "UPDATE _attributes SET value = '0' WHERE key = 'dozen_run_records.version'")
+    with pytest.raises(RuntimeError, match='primary key'):
+        upgrade_tables(db_params, {'fbb_dozen_run': plugins['fbb_dozen_run']})
+    assert version(db_params, 'dozen_run_records') == '0'
+
+
+def test_derived_table_recreated_and_rebuilt(plugins, act_db, db_params, monkeypatch):
+    plugin = plugins['fbb_dozen_run']
+    import_files(plugin, db_params, {'/activities/8051.fit': dozen_run_file(plugin, '8051')}, monkeypatch)
+    execute(db_params, "UPDATE _attributes SET value = '0' WHERE key = 'dozen_run_sessions_weekly.version'",
+            "INSERT INTO dozen_run_sessions_weekly (period_start, metric, count, total, min, max, mean) VALUES ('2020-01-06', 'stale', 1, 1, 1, 1, 1)")
+    results = reprocess(db_params, repo_dir, [])
+    assert results['missing'] == {} and not any(results['reprocessed'].values())
+    assert version(db_params, 'dozen_run_sessions_weekly') == '1'
+    assert execute(db_params, 'SELECT period_start, metric, count FROM dozen_run_sessions_weekly ORDER BY metric') == [
+        ('2023-03-06', 'avg_energy_expenditure', 1), ('2023-03-06', 'avg_running_economy', 1), ('2023-03-06', 'avg_training_peaks_re', 1)
+    ]
+    assert checkpoints(db_params) == []
+
+
+def test_replace_activities(plugins, act_db, db_params, tmp_path, monkeypatch):
+    plugin = plugins['fbb_dozen_run']
+    import_files(plugin, db_params, {f'/activities/{activity_id}.fit': dozen_run_file(plugin, activity_id) for activity_id in ('8101', '8102')}, monkeypatch)
+    records = plugin._tables['record']
+    staging_db_params = DbParams(db_type='sqlite', db_path=str(tmp_path / 'staging'))
+    (tmp_path / 'staging').mkdir()
+    staging_db = ActivitiesDb(staging_db_params)
+    with staging_db.managed_session() as staging_session:
+        staging_session.execute(records.__table__.insert(), [{'activity_id': '8101', 'record': record, 'training_peaks_re': 3.0} for record in range(5)])
+    with act_db.managed_session() as activity_db_session:
+        replace_activities(activity_db_session, staging_db_params, [records], ['8101'])
+    with act_db.managed_session() as activity_db_session:
+        assert [row.training_peaks_re for row in activity_db_session.query(records).filter_by(activity_id='8101')] == [3.0] * 5
+        assert activity_db_session.query(records).filter_by(activity_id='8102').count() == 20
+    with staging_db.managed_session() as staging_session:
+        assert staging_session.query(records).count() == 0
+    staging_db.engine.dispose()
+
+
+def test_reprocess_resumes_after_partial_batch(plugins, act_db, db_params, monkeypatch):
+    plugin = plugins['fbb_dozen_run']
+    filenames = [f'/activities/{activity_id}.fit' for activity_id in ('8201', '8202', '8203')]
+    import_files(plugin, db_params, {filename: dozen_run_file(plugin, File.id_from_path(filename)) for filename in filenames}, monkeypatch)
+    execute(db_params, "UPDATE _attributes SET value = '0' WHERE key = 'dozen_run_records.version'")
+    files = {filename: dozen_run_file(plugin, File.id_from_path(filename), records=30) for filename in filenames}
+    files[filenames[1]] = dozen_run_file(plugin, '8202', fail_after=10, records=30)
+    monkeypatch.setattr(fitfile, 'File', lambda filename, measurement_system: files[filename])
+    results = reprocess(db_params, repo_dir, filenames[:2], workers=1, batch_size=1)
+    assert results['reprocessed']['fbb_dozen_run'] == 1
+    assert list(results['failed']) == [filenames[1]]
+    assert results['missing'] == {'fbb_dozen_run': 2}
+    assert checkpoints(db_params) == [('fbb_dozen_run', '8201', 1), ('fbb_dozen_run', '8202', 0), ('fbb_dozen_run', '8203', 0)]
+    assert execute(db_params, 'SELECT activity_id, COUNT(*) FROM dozen_run_records GROUP BY activity_id') == [('8201', 30), ('8202', 20), ('8203', 20)]
+    files[filenames[1]] = dozen_run_file(plugin, '8202', records=30)
+    results = reprocess(db_params, repo_dir, filenames, workers=1, batch_size=1)
+    assert results['reprocessed']['fbb_dozen_run'] == 2
+    assert results['failed'] == {} and results['missing'] == {}
+    assert checkpoints(db_params) == []
+    assert execute(db_params, 'SELECT activity_id, COUNT(*) FROM dozen_run_records GROUP BY activity_id') == [('8201', 30), ('8202', 30), ('8203', 30)]
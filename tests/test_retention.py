@@ -0,0 +1,88 @@
+"""Tests of the records tiers, retention, and LTTB plot downsampling."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+import pytest
+from fitfile.data_message import MessageFields
+
+from conftest import FakeFitFile, record_messages
+
+
+np = pytest.importorskip('numpy')
+retention = pytest.importorskip('plugin_utils.retention')
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_lttb_keeps_endpoints_and_size():
+    x = np.arange(1000)
+    y = np.sin(x / 50.0)
+    indices = retention.lttb(x, y, 100)
+    assert len(indices) == 100
+    assert (indices[0], indices[-1]) == (0, 999)
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_lttb_keeps_spikes():
+    y = np.zeros(1000)
+    y[437] = 10.0
+    y[812] = -10.0
+    indices = retention.lttb(np.arange(1000), y, 50)
+    assert 437 in indices and 812 in indices
+
+
+@pytest.mark.parametrize('points', [2, 10, 11])
+def test_lttb_small_series_unchanged(points):
+    assert list(retention.lttb(np.arange(10), np.arange(10), points)) == list(range(10))
+
+
+def test_lttb_straight_line_is_evenly_sampled():
+    indices = retention.lttb(np.arange(101), np.arange(101) * 2.0, 11)
+    assert len(indices) == 11
+    assert (indices[0], indices[-1]) == (0, 100)
+
+
+def test_bucket_summaries():
+    timestamps = np.array(['2023-03-12T05:00:00', '2023-03-12T05:00:04', '2023-03-12T05:00:09', '2023-03-12T05:00:25', 'NaT'],
+                          dtype='datetime64[ms]')
+    power = np.array([100.0, np.nan, 300.0, 50.0, 1000.0])
+    rows = retention.bucket_summaries(timestamps, {'power': power}, 10)
+    assert [row['bucket'] for row in rows] == [0, 2]
+    assert [row['samples'] for row in rows] == [3, 1]
+    assert rows[0]['timestamp'] == datetime.datetime(2023, 3, 12, 5, 0)
+    assert rows[1]['timestamp'] == datetime.datetime(2023, 3, 12, 5, 0, 20)
+    assert (rows[0]['power_min'], rows[0]['power_mean'], rows[0]['power_max']) == (100.0, 200.0, 300.0)
+    assert (rows[1]['power_min'], rows[1]['power_mean'], rows[1]['power_max']) == (50.0, 50.0, 50.0)
+    assert retention.bucket_summaries(np.array([], dtype='datetime64[ms]'), {}, 10) == []
+
+
+def import_run(plugin, act_db, activity_id, count):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, ('eE', 'rE', 'tpRE'))
+    with act_db.managed_session() as activity_db_session:
+        for record_num, message_fields in enumerate(record_messages(start, count, dev_eE=lambda index: float(index), dev_rE=1.0, dev_tpRE=2.0)):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        session_fields = MessageFields(timestamp=start, dev_aE=1.0, dev_tS=100)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, session_fields)
+        plugin.write_steps_entry(activity_db_session, fit_file, activity_id, None, session_fields)
+
+
+def test_retention_replaces_records_with_tiers(plugins, act_db):
+    plugin = plugins['fbb_dozen_run']
+    import_run(plugin, act_db, '5001', 125)
+    record_retention = retention.RecordRetention(plugin, raw_days=30)
+    assert record_retention.run(act_db, now=datetime.datetime(2023, 3, 20)) == 0
+    assert record_retention.run(act_db, now=datetime.datetime(2023, 6, 1)) == 1
+    with act_db.managed_session() as activity_db_session:
+        assert activity_db_session.query(plugin._tables['record']).filter_by(activity_id='5001').count() == 0
+        minutes = activity_db_session.query(plugin._tables['tier_60']).filter_by(activity_id='5001').order_by('bucket').all()
+        assert [row.samples for row in minutes] == [60, 60, 5]
+        assert minutes[0].momentary_energy_expenditure_mean == pytest.approx(29.5)
+        assert minutes[2].momentary_energy_expenditure_max == 124.0
+        timestamps, values = retention.plot_series(activity_db_session, plugin, '5001', 'momentary_energy_expenditure', points=5)
+        assert len(values) == 5 and values[0] == pytest.approx(4.5) and values[-1] == pytest.approx(122.0)
+    assert record_retention.run(act_db, now=datetime.datetime(2023, 6, 1)) == 0
@@ -0,0 +1,40 @@
+"""Tests of the per day and per week session rollups."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+import pytest
+
+from plugin_utils.rollups import period_start
+
+
+def test_period_start():
+    sunday = datetime.datetime(2023, 3, 12, 23, 59)
+    assert period_start(sunday, 'day') == datetime.date(2023, 3, 12)
+    assert period_start(sunday, 'week') == datetime.date(2023, 3, 6)
+    assert period_start(datetime.date(2023, 3, 13), 'week') == datetime.date(2023, 3, 13)
+
+
+def test_rollups_match_rebuild(plugins, act_db):
+    plugin = plugins['stryd_zones']
+    rollups = plugin.rollups
+    days = [datetime.datetime(2023, 3, day, 8) for day in (6, 6, 8, 12, 13)]
+    with act_db.managed_session() as activity_db_session:
+        for index, timestamp in enumerate(days):
+            session = {'activity_id': str(6000 + index), 'timestamp': timestamp, 'avg_power': 200.0 + index * 10, 'work': None}
+            plugin._write_session(activity_db_session, session)
+    with act_db.managed_session() as activity_db_session:
+        weekly = rollups.trend(activity_db_session, 'avg_power')
+        daily = rollups.trend(activity_db_session, 'avg_power', 'day')
+        assert rollups.trend(activity_db_session, 'work') == []
+    assert weekly == [(datetime.date(2023, 3, 6), 4, pytest.approx(215.0), 200.0, 230.0), (datetime.date(2023, 3, 13), 1, 240.0, 240.0, 240.0)]
+    assert daily[0] == (datetime.date(2023, 3, 6), 2, pytest.approx(205.0), 200.0, 210.0)
+    with act_db.managed_session() as activity_db_session:
+        plugin.rebuild_rollups(activity_db_session)
+    with act_db.managed_session() as activity_db_session:
+        assert rollups.trend(activity_db_session, 'avg_power') == weekly
+        assert rollups.trend(activity_db_session, 'avg_power', 'day') == daily
+        assert rollups.trend(activity_db_session, 'avg_power', 'day', start=datetime.date(2023, 3, 8), end=datetime.date(2023, 3, 13)) == daily[1:3]
@@ -0,0 +1,43 @@
+"""Tests of the counters and timers of the plugins' database work."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+from plugin_utils import PluginStats, RecordWriter
+
+
+def test_counters_and_timers():
+    stats = PluginStats()
+    stats.add('1', 'inserts')
+    stats.add('1', 'inserts')
+    stats.add('1', 'insert_time', 0.25)
+    stats.add('2', 'rows_written', 10)
+    stats.add('2', 'insert_time', 0.5)
+    assert stats.activity('1') == {**dict.fromkeys(PluginStats.names, 0), 'inserts': 2, 'insert_time': 0.25}
+    assert stats.activity('2')['rows_written'] == 10
+    assert stats.activity('3') == dict.fromkeys(PluginStats.names, 0)
+    assert (stats.totals['inserts'], stats.totals['rows_written'], stats.totals['insert_time']) == (2, 10, 0.75)
+    assert str(stats) == 'PluginStats(2 activities: 10 rows written in 2 inserts (0.750s), 0 rows skipped, 0 existence checks (0.000s))'
+    stats.reset()
+    assert stats.totals == dict.fromkeys(PluginStats.names, 0)
+    assert stats.activities == {}
+
+
+def test_record_writer_counts(plugins, act_db):
+    table = plugins['fbb_dozen_run']._tables['record']
+    stats = PluginStats()
+    with act_db.managed_session() as activity_db_session:
+        writer = RecordWriter(table, ('activity_id', 'record'), flush_size=4, stats=stats)
+        for record in range(10):
+            writer.add(activity_db_session, ('6001', record))
+        writer.finish(activity_db_session)
+    with act_db.managed_session() as activity_db_session:
+        writer = RecordWriter(table, ('activity_id', 'record'), flush_size=4, stats=stats)
+        for record in range(12):
+            writer.add(activity_db_session, ('6001', record))
+        writer.finish(activity_db_session)
+    counters = stats.activity('6001')
+    assert (counters['rows_written'], counters['inserts'], counters['rows_skipped'], counters['existence_checks']) == (12, 4, 10, 2)
+    assert counters['insert_time'] > 0 and counters['existence_check_time'] > 0
+    assert stats.totals == counters
@@ -0,0 +1,42 @@
+"""Tests of the paddle stroke summaries."""
+
+__author__ = "Tom Goetz"
+__copyright__ = "Copyright Tom Goetz"
+__license__ = "GPL"
+
+import datetime
+
+from fitfile.data_message import MessageFields
+
+from conftest import FakeFitFile, record_messages
+
+
+start = datetime.datetime(2023, 3, 12, 5, 0, tzinfo=datetime.timezone.utc)
+
+
+def import_paddle(plugin, act_db, activity_id, dev_fields, **fields):
+    fit_file = FakeFitFile(activity_id, plugin._application_id, dev_fields)
+    with act_db.managed_session() as activity_db_session:
+        for record_num, message_fields in enumerate(record_messages(start, 125, cadence=30, **fields)):
+            plugin.write_record_entry(activity_db_session, fit_file, activity_id, message_fields, record_num)
+        plugin.write_session_entry(activity_db_session, fit_file, activity_id, MessageFields(timestamp=start))
+    with act_db.managed_session() as activity_db_session:
+        session = activity_db_session.get(plugin._tables['session'], activity_id)
+        histogram = activity_db_session.query(plugin._tables['stroke_rates']).filter_by(activity_id=activity_id).all()
+        intervals = activity_db_session.query(plugin._tables['stroke_intervals']).filter_by(activity_id=activity_id).order_by('interval').all()
+        return session, [(row.stroke_rate, row.seconds) for row in histogram], intervals
+
+
+def test_paddle_plus_strokes_from_records(plugins, act_db):
+    plugin = plugins['fbb_paddle_plus']
+    session, histogram, intervals = import_paddle(plugin, act_db, '7001', ('Strk', 'Srd', 'tStrk'), dev_Strk=lambda index: index // 2, dev_Srd=5.0)
+    assert (session.strokes, session.avg_stroke_rate, session.max_stroke_rate, session.avg_stroke_distance) == (62, 30.0, 30, 5.0)
+    assert histogram == [(30, 125.0)]
+    assert [(row.seconds, row.strokes, row.avg_stroke_distance) for row in intervals] == [(60.0, 29, 5.0), (60.0, 30, 5.0), (5.0, 3, 5.0)]
+
+
+def test_dozen_paddle_strokes_estimated_without_count(plugins, act_db):
+    plugin = plugins['fbb_dozen_paddle']
+    session, histogram, intervals = import_paddle(plugin, act_db, '7002', ('sc',))
+    assert (session.strokes, session.avg_stroke_rate) == (62, 30.0)
+    assert [row.strokes for row in intervals] == [30, 30, 2]